@@ -1,13 +1,20 @@
 from fastapi import APIRouter,Depends,HTTPException,status
 from sqlalchemy.orm import Session
 from .models import User
-from backend.database.database import get_db
+from .user_cache import CachedUser, user_cache
+from backend.database.database import DbSession, get_db, run_db
 import redis
 import logging
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from typing import Optional
-from backend.database.config import SECRET_KEY
+from uuid import UUID, uuid4
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from starlette.concurrency import run_in_threadpool
+from backend.utils.password_hashing import PasswordHasherBusy, password_hasher, pwd_context, hash_password, verify_password as _verify_password
+from backend.database.config import SECRET_KEY, REDIS_URL, TOKEN_REVOCATION_CACHE_TTL
 from datetime import datetime, timedelta
 from .auth_schemas import LogoutResponse, TokenVerificationResponse, UserCreate, UserResponse, Token
 from fastapi.security import OAuth2PasswordBearer
@@ -18,15 +25,18 @@ from fastapi.security import OAuth2PasswordRequestForm
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-redis_client = redis.Redis.from_url("redis://localhost:6379/0")
+redis_client = redis.Redis.from_url(REDIS_URL or "redis://localhost:6379/0")
 
 
 #jwt token settings
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 ALGORITHM = "HS256"  #шифрование 
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
+
+#отзыв токенов: ключ на каждый отозванный токен с TTL, равным остатку его жизни
+REVOKED_TOKEN_PREFIX = "revoked_token:"
+LEGACY_BLACKLIST_KEY = "token_blacklist"  #старое глобальное множество, см. backend/utils/migrate_token_blacklist.py
  
 
 router = APIRouter()
@@ -35,45 +45,73 @@ router = APIRouter()
 #support functions
 
 
-def get_current_user(token: str = Depends(oauth2_scheme),db: Session= Depends(get_db)) -> User:
+def authenticate_token(token: str) -> UUID:
+    """
+    Общая проверка токена для зависимостей авторизации: подпись и срок действия,
+    отзыв (Redis + локальный кэш) и ID пользователя из sub
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(
-                status_code = 403,
-                detail = "Недействительный токен"
-            )
-        user = db.query(User).get(user_id)
-        if not user:
-            raise HTTPException(
-                status_code=403,
-                detail="Пользователь не найден"
-            )
-        return user 
-    except JWTError:
+        user_id = UUID(payload["sub"])
+    except (JWTError, KeyError, TypeError, ValueError):
         raise HTTPException(
             status_code=403,
             detail="Неверный токен или истек срок его действия"
         )
+    if is_token_revoked(payload, token):
+        raise HTTPException(
+            status_code=403,
+            detail="Токен отозван"
+        )
+    return user_id
+
 
-        
-        
+def _user_not_found() -> HTTPException:
+    return HTTPException(
+        status_code=403,
+        detail="Пользователь не найден"
+    )
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme),db: DbSession= Depends(get_db)) -> User:
+    """
+    ORM-объект пользователя из базы — для маршрутов, которые его меняют
+    """
+    user_id = await run_in_threadpool(authenticate_token, token)
+    user = await run_db(db, lambda s: s.get(User, user_id))
+    if not user:
+        raise _user_not_found()
+    return user
+
+
+async def get_current_user_cached(token: str = Depends(oauth2_scheme), db: DbSession = Depends(get_db)) -> CachedUser:
+    """
+    Снимок пользователя из кэша — для маршрутов, которые пользователя только читают.
+    Сессия открывается лениво, так что при попадании в кэш запроса к базе нет
+    """
+    user_id = await run_in_threadpool(authenticate_token, token)
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+    user = await run_db(db, lambda s: s.get(User, user_id))
+    if not user:
+        raise _user_not_found()
+    return user_cache.put(user)
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)  #хэширует пароль пользователя перед сохранением в базу данных
+    return hash_password(password)  #хэширует пароль пользователя перед сохранением в базу данных
 
 
 def verify_password(plain_password: str,hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)  # проверяет соответствует ли введённый пароль хэшу в базе (используется при входе)
+    return _verify_password(plain_password, hashed_password)  # проверяет соответствует ли введённый пароль хэшу в базе (используется при входе)
 
 
 
 
 
-def create_user(db:Session, user:UserCreate) -> User:  #создаёт нового пользователя в базе данных (может использовать Email/Username для регистраци)
-    hashed_password = get_password_hash(user.password)  
+def create_user(db:Session, user:UserCreate, hashed_password: Optional[str] = None) -> User:  #создаёт нового пользователя в базе данных (может использовать Email/Username для регистраци)
+    hashed_password = hashed_password or get_password_hash(user.password)  
     db_user = User(
     username=user.username,
     email=user.email or None,  # email необязательный
@@ -86,56 +124,187 @@ def create_user(db:Session, user:UserCreate) -> User:  #создаёт ново
     return db_user
 
 
+def _hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Сервер перегружен, повторите попытку позже",
+        headers={"Retry-After": "1"}
+    )
+
+
 #проверяет логин и пароль пользователя, возвращает объект пользователя при успешной аутентификации
-def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
-    user = db.query(User).filter_by(username=username).first()
-    if not user or not verify_password(password, user.hashed_password):
+#bcrypt выполняется в отдельном пуле процессов (backend/utils/password_hashing.py), при переполнении — 429.
+#Хэш, сделанный с прежней стоимостью BCRYPT_ROUNDS, прозрачно пересчитывается после успешного входа
+async def authenticate_user(db: DbSession, username: str, password: str) -> Optional[User]:
+    user = await run_db(db, lambda s: s.query(User).filter_by(username=username).first())
+    if not user:
         return None
+    try:
+        if not await password_hasher.verify(password, user.hashed_password):
+            return None
+    except PasswordHasherBusy:
+        raise _hashing_busy()
+
+    if password_hasher.needs_update(user.hashed_password):
+        try:
+            user.hashed_password = await password_hasher.hash(password)
+            await run_db(db, lambda s: s.commit())
+        except PasswordHasherBusy:
+            pass  #пересчитаем при следующем входе
     return user
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str: #cоздаёт JWT токен для авторизации включая время истечения
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid4().hex})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+
+class RevocationCache:
+    """
+    Локальный кэш «токен не отозван» с коротким TTL: повторные проверки одного токена
+    не ходят в Redis. Отзыв в этом же процессе сбрасывает запись сразу, в других
+    процессах отозванный токен может приниматься не дольше TTL
+    """
+
+    def __init__(self, ttl: float, max_size: int = 100_000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_known_valid(self, revocation_id: str) -> bool:
+        if self.ttl <= 0:
+            return False
+        with self._lock:
+            expires_at = self._entries.get(revocation_id)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self._entries[revocation_id]
+                return False
+            return True
+
+    def remember_valid(self, revocation_id: str) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[revocation_id] = time.monotonic() + self.ttl
+            self._entries.move_to_end(revocation_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, revocation_id: str) -> None:
+        with self._lock:
+            self._entries.pop(revocation_id, None)
+
+
+revocation_cache = RevocationCache(TOKEN_REVOCATION_CACHE_TTL)
+
+
+class LegacyBlacklist:
+    """
+    Есть ли ещё старое множество LEGACY_BLACKLIST_KEY. migrate_token_blacklist удаляет его насовсем:
+    после этого проверка токена — один EXISTS без SISMEMBER. Пока множество есть, его наличие
+    перепроверяется не чаще раза в check_interval секунд
+    """
+
+    def __init__(self, check_interval: float = 60.0):
+        self.check_interval = check_interval
+        self.gone = False
+        self._checked_at: Optional[float] = None
+
+    def present(self) -> bool:
+        if self.gone:
+            return False
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self.gone = not redis_client.scard(LEGACY_BLACKLIST_KEY)
+        return not self.gone
+
+
+legacy_blacklist = LegacyBlacklist()
+
+
+def token_revocation_id(payload: dict, token: str) -> str:
+    """
+    Идентификатор токена для отзыва: jti, а для старых токенов без jti — sha256 самого токена
+    """
+    return payload.get("jti") or hashlib.sha256(token.encode()).hexdigest()
+
+
+def revoke_token(token: str) -> bool:
+    """
+    Отзывает токен до момента его истечения. Возвращает False для невалидных и уже истёкших токенов
+    """
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
+    except JWTError:
+        return False
+    ttl = int(payload.get("exp", 0) - time.time())
+    if ttl <= 0:
+        return False
+    revocation_id = token_revocation_id(payload, token)
+    redis_client.set(REVOKED_TOKEN_PREFIX + revocation_id, 1, ex=ttl)
+    revocation_cache.discard(revocation_id)
+    return True
+
+
+def is_token_revoked(payload: dict, token: str) -> bool:
+    revocation_id = token_revocation_id(payload, token)
+    if revocation_cache.is_known_valid(revocation_id):
+        return False
+    revoked = bool(redis_client.exists(REVOKED_TOKEN_PREFIX + revocation_id))
+    if not revoked and legacy_blacklist.present():
+        #старые отзывы, пока migrate_token_blacklist не перенёс и не удалил множество
+        revoked = bool(redis_client.sismember(LEGACY_BLACKLIST_KEY, token))
+    if not revoked:
+        revocation_cache.remember_valid(revocation_id)
+    return revoked
+
+
 def verify_token(token:str) -> str: #проверяет действительность токена 
-    if redis_client.sismember("token_blacklist", token):
-        logger.info(f"Token {token} is blacklisted")
-        raise HTTPException(
-            status_code = 403,
-            detail= "Токен отозван"
-        )
     try:
         payload = jwt.decode(token,SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(
-                status_code=403,
-                detail="" \
-                "Не удалось извлечь идентификатор пользователя из токена"
-            )
-        logger.info(f"Token {token} успешно проверен для пользователя с id {user_id}")
-        return user_id
     except JWTError as e:
         logger.warning(f"JWT encode провален: {e}")
         raise HTTPException(
             status_code=403,
             detail="Неверный токен или истек срок его действия"
         )
+    if is_token_revoked(payload, token):
+        logger.info(f"Token {payload.get('jti')} is revoked")
+        raise HTTPException(
+            status_code = 403,
+            detail= "Токен отозван"
+        )
+    user_id: str = payload.get("sub")
+    if user_id is None:
+        raise HTTPException(
+            status_code=403,
+            detail="" \
+            "Не удалось извлечь идентификатор пользователя из токена"
+        )
+    logger.info(f"Token {payload.get('jti')} успешно проверен для пользователя с id {user_id}")
+    return user_id
     
 
 #API endpoints
 @router.post("/register",response_model=UserResponse) #регистрация пользователя (username/email + password)
-def register_user(user:UserCreate,db: Session = Depends(get_db)):
-    db_user = db.query(User).filter_by(username=user.username).first()
+async def register_user(user:UserCreate,db: DbSession = Depends(get_db)):
+    db_user = await run_db(db, lambda s: s.query(User).filter_by(username=user.username).first())
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Пользователь с таким именем или email уже существует"
         )
-    created_user = create_user(db, user)
+    try:
+        hashed_password = await password_hasher.hash(user.password)
+    except PasswordHasherBusy:
+        raise _hashing_busy()
+    created_user = await run_db(db, lambda s: create_user(s, user, hashed_password))
     return UserResponse(
         id = str(created_user.id),
         username=created_user.username,
@@ -144,8 +313,8 @@ def register_user(user:UserCreate,db: Session = Depends(get_db)):
     )
 
 @router.post("/token", response_model=Token) #логин пользователя (username/email + password) 
-def login_for_access(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access(form_data: OAuth2PasswordRequestForm = Depends(), db: DbSession = Depends(get_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -170,18 +339,6 @@ async def verify_user_token(token:str):
 @router.post("/logout", response_model=LogoutResponse)
  #выход пользователя из системы, отзыва токена
 def logout(token: str):
-    redis_client.sadd("token_blacklist", token)
-    logger.info(f"Token {token} успешно отозван")
+    if revoke_token(token):
+        logger.info("Токен успешно отозван")
     return {"message": "Вы успешно вышли из системы"}
-             
-        
-
-      
-
-
-
-
-
-
-
-
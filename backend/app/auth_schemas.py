@@ -1,5 +1,5 @@
 from pydantic import BaseModel,EmailStr,model_validator,constr
-from typing import Optional,Annotated
+from typing import Dict,Optional,Annotated
 import re
 from uuid import UUID
 from backend.app.english_test_schemas import EnglishLevelEnum
@@ -55,6 +55,7 @@ class UserProfileResponse(BaseModel):
     email: Optional[str]
     english_level: EnglishLevelEnum
     avatar_url: str
+    avatar_urls: Dict[str, str]  #размер варианта в пикселях -> URL
 
 
 
@@ -84,3 +85,4 @@ class EmailVerificationResponse(BaseModel):
 
 class AvatarUploadResponse(BaseModel):
     avatar_url: str
+    avatar_urls: Dict[str, str]
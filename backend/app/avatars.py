@@ -0,0 +1,262 @@
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import time
+from typing import Dict, Optional
+
+from fastapi import UploadFile
+from fastapi.exceptions import HTTPException
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from backend.app.models import User
+from backend.database.config import AVATAR_MAX_BYTES
+
+AVATAR_DIR = "media/avatars"
+DEFAULT_AVATAR_FILE = "default_user.png"
+AVATAR_UPLOAD_PATH = "/profile/upload-avatar"
+ALLOWED_TYPES = ["image/png", "image/jpeg", "image/jpg"]
+ALLOWED_FORMATS = {"PNG", "JPEG"}
+MAX_SOURCE_DIMENSION = 4096  #больше не уменьшаем: распакованный исходник занимал бы десятки мегабайт
+AVATAR_SIZES = (64, 128, 400)
+DEFAULT_AVATAR_SIZE = 400
+WEBP_QUALITY = 80
+HASHED_AVATAR_RE = re.compile(r"^(?P<digest>[0-9a-f]{32})-(?P<size>\d+)\.webp$")
+LEGACY_AVATAR_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}[._]")  #{user.id}_{имя файла} и {user.id}.png
+ORPHAN_GRACE_SECONDS = 3600
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MULTIPART_OVERHEAD = 64 * 1024  #заголовки multipart и остальные поля формы сверх самого файла
+
+
+def avatar_too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Файл больше {AVATAR_MAX_BYTES // 1024} КБ")
+
+
+async def read_upload_limited(file: UploadFile, max_bytes: int = AVATAR_MAX_BYTES) -> bytes:
+    """
+    Читает загруженный файл кусками и прекращает чтение, как только превышен лимит
+    """
+    buffer = io.BytesIO()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        if buffer.tell() + len(chunk) > max_bytes:
+            raise avatar_too_large()
+        buffer.write(chunk)
+    return buffer.getvalue()
+
+
+def inspect_avatar(contents: bytes) -> None:
+    """
+    Проверяет формат и размеры по заголовку изображения: Image.open ленивый и пиксели не декодирует,
+    verify проверяет структуру файла
+    """
+    try:
+        with Image.open(io.BytesIO(contents)) as image:
+            image_format, (width, height) = image.format, image.size
+            image.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        raise HTTPException(status_code=400, detail="Файл не является корректным изображением")
+
+    if image_format not in ALLOWED_FORMATS:
+        raise HTTPException(status_code=400, detail="Допустимы только PNG и JPEG")
+    if width > MAX_SOURCE_DIMENSION or height > MAX_SOURCE_DIMENSION:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Изображение не должно превышать {MAX_SOURCE_DIMENSION}x{MAX_SOURCE_DIMENSION} пикселей",
+        )
+
+
+def avatar_variant_name(digest: str, size: int) -> str:
+    return f"{digest}-{size}.webp"
+
+
+def render_avatar_variants(contents: bytes) -> Dict[int, bytes]:
+    """
+    Квадратные варианты AVATAR_SIZES в WebP: поворот по EXIF, обрезка по центру, уменьшение
+    без увеличения маленьких исходников. Метаданные (EXIF, ICC, XMP) не переносятся
+    """
+    with Image.open(io.BytesIO(contents)) as source:
+        #JPEG декодируется сразу в уменьшенном масштабе (1/2, 1/4, 1/8), если этого хватает для большего варианта
+        source.draft("RGB", (max(AVATAR_SIZES), max(AVATAR_SIZES)))
+        image = ImageOps.exif_transpose(source)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P", "PA") else "RGB")
+
+    side = min(image.size)
+    variants = {}
+    for size in AVATAR_SIZES:
+        target = min(size, side)
+        variant = ImageOps.fit(image, (target, target), Image.Resampling.LANCZOS)
+        variant.info = {}
+        buffer = io.BytesIO()
+        variant.save(buffer, format="WEBP", quality=WEBP_QUALITY, method=4)
+        variants[size] = buffer.getvalue()
+    return variants
+
+
+def store_avatar(contents: bytes, directory: str = AVATAR_DIR) -> str:
+    """
+    Проверяет исходник, строит варианты и сохраняет их под именами из хеша исходника.
+    Одинаковые загрузки дают те же имена, поэтому уже сохранённые варианты не перезаписываются,
+    а только получают свежий mtime: иначе collect_orphan_avatars может удалить старый файл-сироту
+    до коммита avatar_url. Возвращает хеш. Выполняется в пуле потоков
+    """
+    inspect_avatar(contents)
+    digest = hashlib.sha256(contents).hexdigest()[:32]
+    for size, data in render_avatar_variants(contents).items():
+        path = os.path.join(directory, avatar_variant_name(digest, size))
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            write_file_atomic(path, data)
+    return digest
+
+
+def hashed_avatar_digest(filename: str) -> Optional[str]:
+    """
+    Хеш из имени варианта. У таких файлов содержимое по имени никогда не меняется
+    """
+    match = HASHED_AVATAR_RE.match(filename)
+    return match["digest"] if match else None
+
+
+def load_default_avatar(directory: str = AVATAR_DIR) -> bytes:
+    """
+    Аватар по умолчанию: файл из media/avatars, а если его нет — нейтральная заглушка
+    """
+    path = os.path.join(directory, DEFAULT_AVATAR_FILE)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    image = Image.new("RGB", (DEFAULT_AVATAR_SIZE, DEFAULT_AVATAR_SIZE), (226, 229, 234))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def collect_orphan_avatars(db: Session, directory: str = AVATAR_DIR, grace_seconds: float = ORPHAN_GRACE_SECONDS, dry_run: bool = False) -> list[str]:
+    """
+    Удаляет файлы аватаров, на которые не ссылается ни один пользователь: варианты прежних
+    загрузок, старые файлы {user.id}_{имя} и брошенные временные файлы. Файлы моложе
+    grace_seconds не трогаются — загрузка пишет варианты до коммита avatar_url.
+    Возвращает имена удалённых файлов
+    """
+    referenced_names = set()
+    referenced_digests = set()
+    for avatar_url in db.scalars(select(User.avatar_url).distinct()):
+        filename = avatar_url.rpartition("/")[2]
+        referenced_names.add(filename)
+        if digest := hashed_avatar_digest(filename):
+            referenced_digests.add(digest)
+
+    cutoff = time.time() - grace_seconds
+    removed = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.stat().st_mtime > cutoff:
+                continue
+            digest = hashed_avatar_digest(entry.name)
+            if digest is not None:
+                orphan = digest not in referenced_digests
+            else:
+                orphan = (entry.name.startswith(".tmp-") or LEGACY_AVATAR_RE.match(entry.name)) and entry.name not in referenced_names
+            if orphan:
+                if not dry_run:
+                    os.unlink(entry.path)
+                removed.append(entry.name)
+    return removed
+
+
+def avatar_variant_url(avatar_url: str, size: int = DEFAULT_AVATAR_SIZE) -> str:
+    """
+    URL нужного варианта аватара. Аватар по умолчанию и загруженные до появления вариантов
+    существуют в одном размере и возвращаются как есть
+    """
+    directory, _, filename = avatar_url.rpartition("/")
+    digest = hashed_avatar_digest(filename)
+    if digest is None or size not in AVATAR_SIZES:
+        return avatar_url
+    return f"{directory}/{avatar_variant_name(digest, size)}"
+
+
+def avatar_variant_urls(avatar_url: str) -> Dict[str, str]:
+    return {str(size): avatar_variant_url(avatar_url, size) for size in AVATAR_SIZES}
+
+
+def write_file_atomic(path: str, contents: bytes) -> None:
+    """
+    Пишет во временный файл рядом и переименовывает: читатели видят либо старый файл, либо новый целиком
+    """
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(contents)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class AvatarUploadLimitMiddleware:
+    """
+    Отсекает слишком большие загрузки аватара до разбора multipart: по Content-Length сразу,
+    а при chunked-передаче — как только прочитано больше лимита. FastAPI превращает ошибки
+    разбора тела в 400, поэтому ответ приложения подменяется на 413
+    """
+
+    def __init__(self, app, max_bytes: int = AVATAR_MAX_BYTES + MULTIPART_OVERHEAD, path: str = AVATAR_UPLOAD_PATH):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise ValueError("Request body too large")
+            return message
+
+        async def guarded_send(message):
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded:
+            await self._reject(send)
+
+    @staticmethod
+    async def _reject(send) -> None:
+        body = json.dumps({"detail": avatar_too_large().detail}, ensure_ascii=False).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
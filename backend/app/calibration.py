@@ -0,0 +1,312 @@
+"""
+Калибровка параметров 2PL вопросов (backend/app/irt.py) по накопленным ответам.
+
+Оценка маргинальным максимумом апостериорной плотности через EM (Bock–Aitkin): способность
+каждого теста интегрируется по сетке узлов со стандартным нормальным распределением. Ответы
+читаются из базы серверным курсором кусками по тестам один раз за запуск и сбрасываются во
+временные файлы (AnswerSpill), итерации EM читают их через memmap. В памяти держатся только
+ожидаемые счётчики вопросы × узлы, поэтому память не зависит от размера user_answers.
+
+Запуски инкрементальные: берутся тесты, завершённые после watermark прошлого запуска.
+Прежние ответы учитываются через априорное распределение параметров с центром в текущих
+значениях и точностью, растущей с числом уже учтённых ответов (Question.calibration_answers).
+"""
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Iterator, Optional
+
+import numpy as np
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from backend.app.models import EnglishTestSession, ItemCalibrationRun, Question, UserAnswer
+from backend.app.question_bank import invalidate_question_bank
+
+QUADRATURE_NODES = np.linspace(-4.0, 4.0, 41)
+_LOG_WEIGHTS = -0.5 * QUADRATURE_NODES ** 2
+_LOG_WEIGHTS -= np.log(np.exp(_LOG_WEIGHTS).sum())
+
+DIFFICULTY_PRIOR_SD = 1.0  #вокруг текущей трудности, для ещё не калиброванного вопроса — вокруг оценки по уровню
+LOG_DISCRIMINATION_PRIOR_SD = 0.5
+DIFFICULTY_BOUNDS = (-6.0, 6.0)
+DISCRIMINATION_BOUNDS = (0.2, 4.0)
+NEWTON_STEPS = 3
+MAX_NEWTON_STEP = 1.0
+
+CHUNK_SIZE = 50_000
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-3
+WATERMARK_LAG = timedelta(minutes=5)  #completed_at ставится в начале транзакции: ещё не закоммиченные тесты не должны оказаться до watermark
+
+#Куски ответов: индексы тестов (по возрастанию, с 0), индексы вопросов, правильность
+AnswerChunk = tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class ItemCalibrator:
+    """
+    Состояние EM по всем вопросам сразу: параметры, априорные распределения и ожидаемые
+    счётчики текущей итерации
+    """
+
+    def __init__(self, discrimination: np.ndarray, difficulty: np.ndarray, answers_seen: Optional[np.ndarray] = None):
+        a = np.asarray(discrimination, dtype=float)
+        self.b = np.asarray(difficulty, dtype=float).copy()
+        self.log_a = np.log(a)
+        answers_seen = np.zeros(len(a)) if answers_seen is None else np.asarray(answers_seen, dtype=float)
+
+        #Прежние ответы заменены нормальным распределением с центром в текущих параметрах (приближение Лапласа):
+        #точность — ожидаемая информация Фишера одного ответа при θ ~ N(0, 1), умноженная на число ответов
+        z = a[:, None] * (QUADRATURE_NODES[None, :] - self.b[:, None])
+        p = 1.0 / (1.0 + np.exp(-z))
+        weight = np.exp(_LOG_WEIGHTS) * p * (1.0 - p)
+        self.prior_b, self.prior_log_a = self.b.copy(), self.log_a.copy()
+        self.precision_b = DIFFICULTY_PRIOR_SD ** -2 + answers_seen * a ** 2 * weight.sum(axis=1)
+        self.precision_log_a = LOG_DISCRIMINATION_PRIOR_SD ** -2 + answers_seen * (weight * z ** 2).sum(axis=1)
+        self.begin_iteration()
+
+    @property
+    def a(self) -> np.ndarray:
+        return np.exp(self.log_a)
+
+    def begin_iteration(self) -> None:
+        n_items, n_nodes = len(self.b), len(QUADRATURE_NODES)
+        self.expected_total = np.zeros((n_items, n_nodes))
+        self.expected_correct = np.zeros((n_items, n_nodes))
+        self.log_likelihood = 0.0
+        p = 1.0 / (1.0 + np.exp(-self.a[:, None] * (QUADRATURE_NODES[None, :] - self.b[:, None])))
+        p = np.clip(p, 1e-12, 1 - 1e-12)
+        self._log_p, self._log_q = np.log(p), np.log1p(-p)
+
+    def accumulate(self, sessions: np.ndarray, items: np.ndarray, correct: np.ndarray) -> None:
+        """
+        E-шаг по куску: апостериорное распределение способности каждого теста на узлах
+        и его вклад в ожидаемые счётчики вопросов. Ответы одного теста должны идти подряд
+        """
+        if len(items) == 0:
+            return
+        starts = np.flatnonzero(np.r_[True, sessions[1:] != sessions[:-1]])
+        answer_log_likelihood = np.where(correct[:, None], self._log_p[items], self._log_q[items])
+        session_log_posterior = np.add.reduceat(answer_log_likelihood, starts, axis=0) + _LOG_WEIGHTS
+        peak = session_log_posterior.max(axis=1, keepdims=True)
+        posterior = np.exp(session_log_posterior - peak)
+        total = posterior.sum(axis=1, keepdims=True)
+        self.log_likelihood += float((peak + np.log(total)).sum())
+        posterior /= total
+
+        answer_posterior = np.repeat(posterior, np.diff(np.r_[starts, len(items)]), axis=0)
+        np.add.at(self.expected_total, items, answer_posterior)
+        np.add.at(self.expected_correct, items[correct], answer_posterior[correct])
+
+    def maximize(self) -> float:
+        """
+        M-шаг: несколько шагов Фишера по (b, log a) для всех вопросов одновременно.
+        Возвращает наибольшее изменение параметра
+        """
+        b_before, log_a_before = self.b.copy(), self.log_a.copy()
+        n, r = self.expected_total, self.expected_correct
+        for _ in range(NEWTON_STEPS):
+            a = self.a[:, None]
+            z = a * (QUADRATURE_NODES[None, :] - self.b[:, None])
+            p = 1.0 / (1.0 + np.exp(-z))
+            residual = r - n * p
+            weight = n * p * (1.0 - p)
+
+            grad_b = -a[:, 0] * residual.sum(axis=1) - self.precision_b * (self.b - self.prior_b)
+            grad_log_a = (residual * z).sum(axis=1) - self.precision_log_a * (self.log_a - self.prior_log_a)
+            info_bb = a[:, 0] ** 2 * weight.sum(axis=1) + self.precision_b
+            info_aa = (weight * z ** 2).sum(axis=1) + self.precision_log_a
+            info_ba = -a[:, 0] * (weight * z).sum(axis=1)
+            det = info_bb * info_aa - info_ba ** 2
+
+            step_b = np.clip((info_aa * grad_b - info_ba * grad_log_a) / det, -MAX_NEWTON_STEP, MAX_NEWTON_STEP)
+            step_log_a = np.clip((info_bb * grad_log_a - info_ba * grad_b) / det, -MAX_NEWTON_STEP, MAX_NEWTON_STEP)
+            self.b = np.clip(self.b + step_b, *DIFFICULTY_BOUNDS)
+            self.log_a = np.clip(self.log_a + step_log_a, *np.log(DISCRIMINATION_BOUNDS))
+        return float(max(np.abs(self.b - b_before).max(initial=0.0), np.abs(self.a - np.exp(log_a_before)).max(initial=0.0)))
+
+
+@dataclass
+class FitReport:
+    iterations: int
+    converged: bool
+    max_change: Optional[float]
+    log_likelihood: Optional[float]
+    sessions: int
+    answers: int
+    answers_per_item: np.ndarray
+    e_step_seconds: float
+    m_step_seconds: float
+
+
+def fit_items(calibrator: ItemCalibrator, read_chunks: Callable[[], Iterable[AnswerChunk]], max_iterations: int = MAX_ITERATIONS, tolerance: float = TOLERANCE) -> FitReport:
+    """
+    EM до сходимости: каждая итерация заново читает ответы через read_chunks
+    """
+    e_seconds = m_seconds = 0.0
+    max_change = log_likelihood = None
+    sessions = answers = 0
+    answers_per_item = np.zeros(len(calibrator.b), dtype=np.int64)
+    for iteration in range(1, max_iterations + 1):
+        start = time.perf_counter()
+        calibrator.begin_iteration()
+        sessions = answers = 0
+        answers_per_item[:] = 0
+        for session_idx, items, correct in read_chunks():
+            calibrator.accumulate(session_idx, items, correct)
+            sessions += int(session_idx[-1]) + 1 if len(session_idx) else 0
+            answers += len(items)
+            answers_per_item += np.bincount(items, minlength=len(answers_per_item))
+        e_seconds += time.perf_counter() - start
+        log_likelihood = calibrator.log_likelihood
+        if answers == 0:
+            return FitReport(0, True, None, None, 0, 0, answers_per_item, e_seconds, m_seconds)
+
+        start = time.perf_counter()
+        max_change = calibrator.maximize()
+        m_seconds += time.perf_counter() - start
+        if max_change < tolerance:
+            return FitReport(iteration, True, max_change, log_likelihood, sessions, answers, answers_per_item, e_seconds, m_seconds)
+    return FitReport(max_iterations, False, max_change, log_likelihood, sessions, answers, answers_per_item, e_seconds, m_seconds)
+
+
+def stream_answer_chunks(db: Session, question_index: dict, since: Optional[datetime], until: datetime, chunk_size: int = CHUNK_SIZE) -> Iterator[AnswerChunk]:
+    """
+    Ответы завершённых в (since, until] тестов серверным курсором, упорядоченные по тесту.
+    Последний тест куска может продолжиться в следующем, поэтому он переносится целиком.
+    Ответы на удалённые вопросы пропускаются
+    """
+    query = (
+        select(UserAnswer.session_id, UserAnswer.question_id, UserAnswer.is_correct)
+        .join(EnglishTestSession, EnglishTestSession.id == UserAnswer.session_id)
+        .where(EnglishTestSession.completed.is_(True), EnglishTestSession.completed_at <= until)
+        .order_by(UserAnswer.session_id)
+    )
+    if since is not None:
+        query = query.where(EnglishTestSession.completed_at > since)
+
+    carry = []
+    for rows in db.execute(query, execution_options={"yield_per": chunk_size}).partitions():
+        rows = carry + rows
+        last_session = rows[-1][0]
+        split = len(rows)
+        while split > 0 and rows[split - 1][0] == last_session:
+            split -= 1
+        if split == 0:  #тест длиннее куска
+            carry = rows
+            continue
+        carry = rows[split:]
+        yield _to_arrays(rows[:split], question_index)
+    if carry:
+        yield _to_arrays(carry, question_index)
+
+
+class AnswerSpill:
+    """
+    Куски ответов во временных файлах: выборка из БД с сортировкой по тесту выполняется один раз,
+    а каждая итерация EM читает те же куски из memmap без повторного запроса
+    """
+
+    DTYPES = (np.intp, np.intp, bool)  #session_idx, items, correct
+
+    def __init__(self, chunks: Iterable[AnswerChunk]):
+        self._files = [tempfile.TemporaryFile() for _ in range(3)]
+        self._bounds = [0]
+        for chunk in chunks:
+            for file, array, dtype in zip(self._files, chunk, self.DTYPES):
+                file.write(np.asarray(array, dtype=dtype).tobytes())
+            self._bounds.append(self._bounds[-1] + len(chunk[0]))
+        total = self._bounds[-1]
+        for file in self._files:
+            file.flush()
+        #пустой файл нельзя отобразить в память
+        self._arrays = [
+            np.memmap(file, dtype=dtype, mode="r", shape=(total,)) if total else np.empty(0, dtype=dtype)
+            for file, dtype in zip(self._files, self.DTYPES)
+        ]
+
+    def chunks(self) -> Iterator[AnswerChunk]:
+        session_idx, items, correct = self._arrays
+        for start, end in zip(self._bounds, self._bounds[1:]):
+            yield session_idx[start:end], items[start:end], correct[start:end]
+
+    def close(self) -> None:
+        self._arrays = []
+        for file in self._files:
+            file.close()
+
+    def __enter__(self) -> "AnswerSpill":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _to_arrays(rows: list, question_index: dict) -> AnswerChunk:
+    rows = [row for row in rows if row[1] in question_index]
+    sessions = np.fromiter((row[0] != prev[0] for prev, row in zip([(None,)] + rows, rows)), dtype=bool, count=len(rows))
+    session_idx = np.cumsum(sessions) - 1
+    items = np.fromiter((question_index[row[1]] for row in rows), dtype=np.intp, count=len(rows))
+    correct = np.fromiter((row[2] for row in rows), dtype=bool, count=len(rows))
+    return session_idx, items, correct
+
+
+def last_watermark(db: Session) -> Optional[datetime]:
+    return db.scalar(select(func.max(ItemCalibrationRun.watermark)))
+
+
+def calibrate_items(db: Session, chunk_size: int = CHUNK_SIZE, max_iterations: int = MAX_ITERATIONS, tolerance: float = TOLERANCE, lag: timedelta = WATERMARK_LAG) -> tuple[ItemCalibrationRun, FitReport]:
+    """
+    Калибрует вопросы по тестам, завершённым после прошлого запуска, и массово записывает
+    новые a, b в questions. Запуск сохраняется в item_calibration_runs той же транзакцией,
+    поэтому упавший запуск повторится целиком
+    """
+    started_at = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    since = last_watermark(db)
+    until = db.scalar(select(func.now())) - lag
+
+    questions = db.execute(select(Question.id, Question.discrimination, Question.difficulty, Question.calibration_answers).order_by(Question.id)).all()
+    question_index = {row.id: i for i, row in enumerate(questions)}
+    calibrator = ItemCalibrator(
+        discrimination=[row.discrimination for row in questions],
+        difficulty=[row.difficulty for row in questions],
+        answers_seen=[row.calibration_answers for row in questions],
+    )
+    with AnswerSpill(stream_answer_chunks(db, question_index, since, until, chunk_size)) as spill:
+        report = fit_items(calibrator, spill.chunks, max_iterations=max_iterations, tolerance=tolerance)
+
+    updated = np.flatnonzero(report.answers_per_item)
+    if len(updated):
+        #bulk UPDATE по первичному ключу: after_flush не видит этих изменений, поэтому банк сбрасывается явно.
+        #Сброс действует только в текущем процессе: воркеры API (калибровка запускается отдельной командой)
+        #получат новые параметры, когда их снимок устареет по QUESTION_BANK_TTL
+        db.execute(update(Question), [
+            {
+                "id": questions[i].id,
+                "difficulty": float(calibrator.b[i]),
+                "discrimination": float(calibrator.a[i]),
+                "calibration_answers": questions[i].calibration_answers + int(report.answers_per_item[i]),
+            }
+            for i in updated
+        ])
+
+    run = ItemCalibrationRun(
+        started_at=started_at,
+        finished_at=datetime.now(timezone.utc),
+        watermark=until if since is None else max(since, until),
+        sessions=report.sessions,
+        answers=report.answers,
+        items_updated=len(updated),
+        iterations=report.iterations,
+        converged=report.converged,
+        max_change=report.max_change,
+        log_likelihood=report.log_likelihood,
+        duration_seconds=time.perf_counter() - start,
+    )
+    db.add(run)
+    db.commit()
+    if len(updated):
+        invalidate_question_bank()
+    return run, report
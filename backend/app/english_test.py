@@ -1,25 +1,102 @@
-from fastapi import APIRouter, Depends
+import orjson
+from fastapi import APIRouter, Depends, Header
 from fastapi.exceptions import HTTPException
+from fastapi.responses import Response
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 from .models import DragItem, DropTarget, QuestionType, User
-from backend.database.database import get_db
-from .auth import get_current_user
+from backend.database.database import DbSession, get_db, run_db
+from backend.database.config import ADAPTIVE_BATCH_SIZE, ADAPTIVE_MAX_ITEMS, ADAPTIVE_MIN_ITEMS, ADAPTIVE_RANDOMESQUE, ADAPTIVE_SE_TARGET
+from .auth import get_current_user, get_current_user_cached
+from .user_cache import CachedUser
+from .idempotency import run_idempotent
+from .grading import LEVEL_ORDER, diagnose_level, grade_answers
+from .progress import record_completed_session, rollup_stats, session_answer_stats
+from .irt import AbilityEstimate, select_items, theta_to_level
+from .question_bank import QuestionBank, get_answer_keys, get_question_bank, get_questions
+from .prepared_tests import Blueprint, PreparedTest, prepared_test_pool, render_form, unpack_item_orders
 from backend.app.models import Question,EnglishTestSession,UserAnswer,Option,User,EnglishLevel,LevelUpgradeRequest
-from sqlalchemy.sql import func
+from typing import Optional
 from uuid import UUID, uuid4
 from collections import defaultdict
 
-from .english_test_schemas import AnswerPayload, GenerateTestResponse, QuestionResponse,SubmitAnswersRequest,SelectLevelRequest, SubmitAnswersResponse,SubmitDiagnosticResponse,SelectLevelResponse
+from .english_test_schemas import AdaptiveStepResponse, AnswerPayload, GenerateTestResponse, QuestionResponse, ResumeTestResponse,SubmitAnswersRequest,SelectLevelRequest, SubmitAnswersResponse,SubmitDiagnosticResponse,SelectLevelResponse
 
 router = APIRouter()
 
 
 #ЭНДПОИНТ ВЫЗЫВАЕТСЯ КОГДА ЮЗЕР КЛИКАЕТ НА ЧТО ТО ПО ТИПУ "Я ЗНАЮ СВОЙ УРОВЕНЬ" И ТАМ ВЫБИРАЕТ УРОВЕНЬ АНГЛИЙСКОГО ЯЗЫКА
 @router.post("/select-level", response_model=SelectLevelResponse)
-def select_english_level(payload: SelectLevelRequest, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    user.english_level = payload.level
-    db.commit()
-    return {"message": "Уровень английского языка успешно обновлен", "level": user.english_level.value}
+async def select_english_level(payload: SelectLevelRequest, user: User = Depends(get_current_user), db: DbSession = Depends(get_db)):
+    user.english_level = EnglishLevel(payload.level.value)
+    await run_db(db, lambda s: s.commit())
+    return {"message": "Уровень английского языка успешно обновлен", "level": payload.level.value}
+
+
+def diagnostic_blueprint() -> Blueprint:
+    return tuple((EnglishLevel(lvl), 5) for lvl in LEVEL_ORDER)
+
+
+def progression_blueprint(current_level: EnglishLevel) -> Blueprint:
+    return ((current_level, 8), (get_next_level(current_level), 7))
+
+
+def upgrade_blueprint(target_level: EnglishLevel) -> Blueprint:
+    return ((target_level, 15),)
+
+
+def all_blueprints() -> list[Blueprint]:
+    """
+    Все составы тестов — для фонового наполнения пула готовых форм
+    """
+    levels = [EnglishLevel(lvl) for lvl in LEVEL_ORDER]
+    blueprints = [diagnostic_blueprint()]
+    blueprints += [progression_blueprint(lvl) for lvl in levels]
+    blueprints += list(dict.fromkeys(upgrade_blueprint(get_next_level(lvl)) for lvl in levels))
+    return blueprints
+
+
+def start_test_session(db: Session, user_id: UUID, level, blueprint: Blueprint) -> tuple[UUID, PreparedTest]:
+    """
+    Создаёт сессию теста с готовой формой из пула; состав формы и порядок вариантов сохраняются в сессии.
+    ID сессии генерируется на стороне приложения, поэтому refresh после коммита не нужен
+    """
+    session_id = uuid4()
+    form = prepared_test_pool.take(db, blueprint, user_id)
+    question_ids = [q.id for q in form.questions]
+    db.add(EnglishTestSession(id=session_id, user_id=user_id, level=level, score=0, completed=False, question_ids=question_ids, option_orders=form.option_orders))
+    return session_id, form
+
+
+class PreEncodedJSONResponse(Response):
+    """
+    Ответ с уже закодированным JSON-телом: FastAPI не валидирует и не сериализует его повторно
+    """
+    media_type = "application/json"
+
+
+def build_test_response(session_id: UUID, form: PreparedTest, target_levels: Optional[list[str]] = None) -> GenerateTestResponse:
+    """
+    Ответ генерации теста без повторной валидации: вопросы формы уже проверены при её сборке
+    """
+    response = GenerateTestResponse.model_construct(
+        session_id=str(session_id),
+        target_levels=target_levels,
+        questions=list(form.questions),
+    )
+    response._questions_json = form.questions_json
+    return response
+
+
+def encode_test_response(response: GenerateTestResponse) -> bytes:
+    """
+    Тело ответа генерации теста: JSON вопросов подставляется готовым, кодируются только поля сессии
+    """
+    if response._questions_json is None:
+        return response.model_dump_json().encode()
+    head = orjson.dumps({name: getattr(response, name) for name in type(response).model_fields if name != "questions"})
+    return head[:-1] + b',"questions":' + response._questions_json + b"}"
 
 
 def generate_diagnostic_test(user_id: UUID, db: Session) -> GenerateTestResponse:
@@ -27,47 +104,91 @@ def generate_diagnostic_test(user_id: UUID, db: Session) -> GenerateTestResponse
     Функция для генерации теста, если пользователь не знает свой уровень англ
 
     """
-    session = EnglishTestSession( 
-        id=uuid4(),
-        user_id=user_id,
-        level="unknown",
-        score=0,
-        completed=False
-    )
-    db.add(session)
+    session_id, form = start_test_session(db, user_id, "unknown", diagnostic_blueprint())
     db.commit()
-    db.refresh(session)
-
-    level_order = ["A1", "A2", "B1", "B2", "C1", "C2"]
-    questions = []
-    for lvl in level_order:
-        q = (
-            db.query(Question)
-            .filter_by(level=lvl)
-            .order_by(func.random())
-            .limit(5)  
-            .all()
-        )
-        questions.extend(q)
 
-    questions_serialized = []
-    for q in questions:
-        if q.type == QuestionType.multiple_choice:
-            q.options = db.query(Option).filter_by(question_id=q.id).all()
+    return build_test_response(session_id, form)
 
-        elif q.type == QuestionType.drag_and_drop:
-            q.drag_items = db.query(DragItem).filter_by(question_id=q.id).all()
-            q.drop_targets = db.query(DropTarget).filter_by(question_id=q.id).all()
+def check_answers_in_form(answers_data: list[AnswerPayload], sessions: dict[UUID, EnglishTestSession]) -> None:
+    """
+    Ответы принимаются только для незавершённых сессий и только на вопросы их формы.
+    У сессий без сохранённой формы (созданных до question_ids) состав не проверяется
+    """
+    forms = {}
+    for entry in answers_data:
+        session = sessions.get(entry.session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Сессия не найдена")
+        if session.completed:
+            raise HTTPException(status_code=400, detail="Сессия уже завершена")
+        if session.question_ids is None:
+            continue
+        if session.id not in forms:
+            forms[session.id] = set(session.question_ids)
+        if entry.question_id not in forms[session.id]:
+            raise HTTPException(status_code=400, detail="Вопрос не входит в тест этой сессии")
 
-        # open_text — ничего не подгружаем
 
-        questions_serialized.append(QuestionResponse.model_validate(q))
+def resume_test_session(user_id: UUID, session_id: UUID, db: Session) -> ResumeTestResponse:
+    """
+    Незавершённый тест пользователя в том же виде, в каком он был выдан: вопросы берутся
+    из банка по сохранённому составу формы и выводятся в сохранённом порядке вариантов,
+    без новой выборки. Вопросы, удалённые из банка, пропускаются
+    """
+    session = db.query(EnglishTestSession).filter_by(id=session_id, user_id=user_id).one_or_none()
+    if session is None:
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+    if session.completed:
+        raise HTTPException(status_code=400, detail="Сессия уже завершена")
+    if session.question_ids is None:
+        raise HTTPException(status_code=400, detail="Тест создан до сохранения форм и не может быть продолжен")
+
+    orders = unpack_item_orders(session.option_orders) if session.option_orders else []
+    order_by_question = dict(zip(session.question_ids, orders))
+    answered = [qid for (qid,) in db.query(UserAnswer.question_id).filter(UserAnswer.session_id == session_id)]
+
+    bank = get_question_bank(db)
+    questions = get_questions(db, session.question_ids)
+    rendered, questions_json = render_form(bank, questions, [order_by_question.get(q.id) for q in questions])
+    response = ResumeTestResponse.model_construct(
+        session_id=str(session_id),
+        target_levels=None,
+        questions=list(rendered),
+        answered_question_ids=answered,
+    )
+    response._questions_json = questions_json
+    return response
 
 
-    return GenerateTestResponse(
-        session_id=str(session.id),
-        questions=questions_serialized
-    )
+def insert_answers(answers_data: list[AnswerPayload], db: Session) -> None:
+    """
+    Оценивает ответы и пишет их одним INSERT ... ON CONFLICT в текущей транзакции, без commit.
+    Повторный ответ на тот же вопрос сессии перезаписывает прежний; внутри одного запроса
+    побеждает последний
+    """
+    answers_data = list({(entry.session_id, entry.question_id): entry for entry in answers_data}.values())
+    answer_keys = get_answer_keys(db, {entry.question_id for entry in answers_data})
+
+    rows = []
+    for entry, key, is_correct in grade_answers(answer_keys, answers_data):
+        rows.append({
+            "session_id": entry.session_id,
+            "question_id": entry.question_id,
+            "selected_option_id": entry.selected_option_id if key.type == QuestionType.multiple_choice else None,
+            "answer_text": entry.answer_text if key.type == QuestionType.open_text else None,
+            "match_pairs": (entry.match_pairs or {}) if key.type == QuestionType.drag_and_drop else None,
+            "is_correct": is_correct,
+        })
+
+    if rows:
+        # render_nulls — чтобы все строки ушли одним батчем, а не группами по набору заполненных полей
+        statement = insert(UserAnswer).execution_options(render_nulls=True)
+        statement = statement.on_conflict_do_update(
+            index_elements=[UserAnswer.session_id, UserAnswer.question_id],
+            set_={column: statement.excluded[column] for column in ("selected_option_id", "answer_text", "match_pairs", "is_correct")},
+        )
+        db.execute(statement, rows)
+
 
 #Функциия сохранения ответов пользователя на вопросы теста
 def submit_answer(answers_data: list[AnswerPayload], db: Session) -> SubmitAnswersResponse:
@@ -79,121 +200,142 @@ def submit_answer(answers_data: list[AnswerPayload], db: Session) -> SubmitAnswe
             "selected_option_id": UUID
         }
     ]
+    Оценка идёт по скомпилированным ключам ответов из банка вопросов (без чтения из базы),
+    ответы пишутся одним многострочным INSERT. Сессии читаются одним запросом FOR SHARE,
+    а завершение теста берёт FOR UPDATE до подсчёта ответов: оно дождётся коммита этой записи и учтёт её
     """
-
-    for entry in answers_data:
-        question = db.query(Question).get(entry.question_id)
-        if not question:
-            continue  # или raise HTTPException, если нужно
-
-        is_correct = False
-
-        if question.type == QuestionType.multiple_choice:
-            selected_option = db.query(Option).get(entry.selected_option_id)
-            is_correct = selected_option.is_correct if selected_option else False
-
-            user_answer = UserAnswer(
-                session_id=entry.session_id,
-                question_id=entry.question_id,
-                selected_option_id=entry.selected_option_id,
-                is_correct=is_correct
-            )
-
-        elif question.type == QuestionType.open_text:
-            correct = question.correct_answer.strip().lower()
-            submitted = (entry.answer_text or "").strip().lower()
-            is_correct = correct == submitted
-
-            user_answer = UserAnswer(
-                session_id=entry.session_id,
-                question_id=entry.question_id,
-                answer_text=entry.answer_text,
-                is_correct=is_correct
-            )
-
-        elif question.type == QuestionType.drag_and_drop:
-            submitted_pairs = entry.match_pairs or {}
-            correct_items = db.query(DragItem).filter_by(question_id=question.id).all()
-            correct_map = {item.id.hex: item.target_key for item in correct_items}
-
-            is_correct = all(
-                correct_map.get(k) == v for k, v in submitted_pairs.items()
-            )
-
-            user_answer = UserAnswer(
-                session_id=entry.session_id,
-                question_id=entry.question_id,
-                match_pairs=submitted_pairs,
-                is_correct=is_correct
-            )
-
-        db.add(user_answer)
-
+    session_ids = {entry.session_id for entry in answers_data}
+    sessions = {}
+    if session_ids:
+        query = db.query(EnglishTestSession).filter(EnglishTestSession.id.in_(session_ids)).with_for_update(read=True)
+        sessions = {session.id: session for session in query}
+    check_answers_in_form(answers_data, sessions)
+    insert_answers(answers_data, db)
     db.commit()
     return SubmitAnswersResponse(message="Ответы успешно сохранены")
 
 
 
 
-def evaluate_english_level(user_answers: list[UserAnswer], db: Session) -> str:
+def submit_diagnostic(session_id: UUID, db:Session) -> SubmitDiagnosticResponse:
     """
-    Примитивный алгоритм оценивания уровня английского 
+    Функция для завершения диагностического теста и определения уровня английского пользователя.
+    Число запросов не зависит от числа ответов: ответы сворачиваются одним агрегирующим запросом
+    по уровню и категории вопроса, сессия и пользователь читаются вторым, оценка и новый уровень
+    пишутся в одной транзакции
     """
-    level_stats = defaultdict(lambda: {"correct": 0, "total": 0})
-    level_order = ["A1", "A2", "B1", "B2", "C1", "C2"]
+    #FOR UPDATE по сессии до подсчёта ответов: запись ответов (FOR SHARE) успеет закоммититься и попадёт в оценку,
+    #а параллельная повторная отправка дождётся коммита и не учтёт сессию в сводке второй раз
+    row = (
+        db.query(EnglishTestSession, User)
+        .join(User, User.id == EnglishTestSession.user_id)
+        .filter(EnglishTestSession.id == session_id)
+        .with_for_update(of=EnglishTestSession)
+        .one_or_none()
+    )
+    if row is None:
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+    session, user = row
 
-    for answer in user_answers:
-        question = db.query(Question).get(answer.question_id)
-        if not question or question.level.value not in level_order:
-            continue
-        lvl = question.level.value
-        level_stats[lvl]["total"] += 1
-        if answer.is_correct:
-            level_stats[lvl]["correct"] += 1
-
-    if all(stats["total"] == 0 for stats in level_stats.values()):
-        return "A1"
-
-    best_level = "A1"
-    for lvl in level_order:
-        stats = level_stats[lvl]
-        if stats["total"] == 0:
-            continue
+    answer_stats = session_answer_stats(db, session_id)
+    if not answer_stats:
+        raise HTTPException(
+            status_code=400,
+            detail="Нет ответов для данной сессии"
+        )
+    level_stats = rollup_stats(answer_stats, by="level")
+    diagnosed_level = diagnose_level(level_stats)
 
-        accuracy = stats["correct"] / stats["total"]
-        if accuracy >= 0.6:
-            best_level = lvl
-        else:
-            break
+    first_completion = not session.completed
+    session.score = sum(stats["correct"] for stats in level_stats.values())
+    session.completed = True
+    user.english_level = diagnosed_level
 
-    return best_level
+    if first_completion:
+        #время первого завершения: по нему калибровка отбирает новые сессии, повторная отправка его не сдвигает
+        session.completed_at = func.now()
+        record_completed_session(db, session, diagnosed_level, category_stats=rollup_stats(answer_stats, by="category"))
 
+    db.commit()
 
+    return SubmitDiagnosticResponse(diagnosed_level=diagnosed_level)
 
-def submit_diagnostic(session_id: UUID, db:Session) -> SubmitDiagnosticResponse:
+
+
+def adaptive_step(bank: QuestionBank, responses: dict[UUID, bool]) -> tuple[AbilityEstimate, list[UUID]]:
     """
-    Функция для завершения диагностического теста и определения уровня английского пользователя
+    Оценка способности по ответам адаптивной диагностики и следующие вопросы.
+    Пустой список — диагностику пора завершать: ошибка оценки ниже ADAPTIVE_SE_TARGET
+    (после ADAPTIVE_MIN_ITEMS ответов), достигнут ADAPTIVE_MAX_ITEMS или вопросы кончились
     """
-    answers = db.query(UserAnswer).filter(UserAnswer.session_id == session_id).all()
-    if not answers:
-        raise HTTPException(
-            status_code=400,
-            detail="Нет ответов для данной сессии"
-        )
-    diagnosed_level = evaluate_english_level(answers, db)
-    
-    # Обновляем пользователя
-    session = db.query(EnglishTestSession).get(session_id)
-    session.score = sum(1 for ans in answers if ans.is_correct)
-    session.completed = True
+    estimate = bank.items.estimate(responses)
+    answered = len(responses)
+    if answered >= ADAPTIVE_MAX_ITEMS or (answered >= ADAPTIVE_MIN_ITEMS and estimate.standard_error < ADAPTIVE_SE_TARGET):
+        return estimate, []
+    k = min(ADAPTIVE_BATCH_SIZE, ADAPTIVE_MAX_ITEMS - answered)
+    selected = select_items(estimate.theta, bank.items.a, bank.items.b, bank.items.mask(responses), k, ADAPTIVE_RANDOMESQUE)
+    return estimate, [bank.items.question_ids[i] for i in selected]
+
+
+def adaptive_response(session_id: UUID, bank: QuestionBank, estimate: AbilityEstimate, answered: int, question_ids: list[UUID], diagnosed_level: Optional[str] = None) -> AdaptiveStepResponse:
+    return AdaptiveStepResponse(
+        session_id=str(session_id),
+        finished=diagnosed_level is not None,
+        answered=answered,
+        theta=estimate.theta,
+        standard_error=estimate.standard_error,
+        questions=[QuestionResponse.model_validate(bank.get(qid)) for qid in question_ids],
+        diagnosed_level=diagnosed_level,
+    )
 
-    user = db.query(User).get(session.user_id)
-    user.english_level = diagnosed_level
 
+def start_adaptive_diagnostic(user_id: UUID, db: Session) -> AdaptiveStepResponse:
+    """
+    Начало адаптивной диагностики: сессия и первые вопросы, самые информативные при θ = 0
+    """
+    session_id = uuid4()
+    bank = get_question_bank(db)
+    estimate, question_ids = adaptive_step(bank, {})
+    db.add(EnglishTestSession(id=session_id, user_id=user_id, level="unknown", score=0, completed=False, question_ids=question_ids))
     db.commit()
+    return adaptive_response(session_id, bank, estimate, 0, question_ids)
 
-    return SubmitDiagnosticResponse(diagnosed_level=diagnosed_level)
 
+def submit_adaptive_answers(user_id: UUID, session_id: UUID, answers_data: list[AnswerPayload], db: Session) -> AdaptiveStepResponse:
+    """
+    Ответы на очередные вопросы адаптивной диагностики. Θ пересчитывается по всем ответам сессии;
+    если точность достаточна, сессия завершается и уровень пользователя обновляется
+    в той же транзакции, иначе возвращаются следующие вопросы, и они добавляются к форме сессии
+    """
+    if any(entry.session_id != session_id for entry in answers_data):
+        raise HTTPException(status_code=400, detail="Ответы относятся к другой сессии")
+
+    session = db.query(EnglishTestSession).filter_by(id=session_id).with_for_update().one_or_none()
+    if session is None or session.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+    if session.completed:
+        raise HTTPException(status_code=400, detail="Сессия уже завершена")
+    check_answers_in_form(answers_data, {session.id: session})
+
+    insert_answers(answers_data, db)
+    responses = dict(db.query(UserAnswer.question_id, UserAnswer.is_correct).filter(UserAnswer.session_id == session_id).all())
+    bank = get_question_bank(db)
+    estimate, question_ids = adaptive_step(bank, responses)
+
+    diagnosed_level = None
+    if not question_ids:
+        diagnosed_level = theta_to_level(estimate.theta)
+        session.score = sum(responses.values())
+        session.completed = True
+        session.completed_at = func.now()
+        db.get(User, user_id).english_level = diagnosed_level
+        record_completed_session(db, session, diagnosed_level)
+    else:
+        served = list(session.question_ids or [])
+        session.question_ids = served + [qid for qid in question_ids if qid not in served]
+
+    db.commit()
+    return adaptive_response(session_id, bank, estimate, len(responses), question_ids, diagnosed_level)
 
 
 def get_next_level(current: EnglishLevel) -> EnglishLevel: 
@@ -222,50 +364,10 @@ def generate_level_progression_test(user_id: UUID, db: Session) -> GenerateTestR
             detail="Пользователь не имеет определенного уровня английского языка"
         )
 
-    current_level = user.english_level
-    next_level = get_next_level(current_level)
-    target_levels = [current_level.value, next_level.value]
-
-    session = EnglishTestSession(
-        id=uuid4(),
-        user_id=user_id,
-        level=current_level,
-        score=0,
-        completed=False
-    )
-    db.add(session)
+    session_id, form = start_test_session(db, user_id, user.english_level, progression_blueprint(user.english_level))
     db.commit()
-    db.refresh(session)
-
-    questions = []
-    for lvl in target_levels:
-        q = (
-            db.query(Question)
-            .filter_by(level=lvl)
-            .order_by(func.random())
-            .limit(8 if lvl == target_levels[0] else 7)  
-            .all()
-        )
-        questions.extend(q)
-
-    questions_serialized = []
-    for q in questions:
-        if q.type == QuestionType.multiple_choice:
-            q.options = db.query(Option).filter_by(question_id=q.id).all()
-
-        elif q.type == QuestionType.drag_and_drop:
-            q.drag_items = db.query(DragItem).filter_by(question_id=q.id).all()
-            q.drop_targets = db.query(DropTarget).filter_by(question_id=q.id).all()
-
-        # open_text — ничего не подгружаем
-
-        questions_serialized.append(QuestionResponse.model_validate(q))
-
 
-    return GenerateTestResponse(
-        session_id=str(session.id),
-        questions=questions_serialized
-    )
+    return build_test_response(session_id, form)
 
 def generate_upgrade_test(user_id: UUID,db:Session ) -> GenerateTestResponse:
     """
@@ -280,15 +382,8 @@ def generate_upgrade_test(user_id: UUID,db:Session ) -> GenerateTestResponse:
         )
     
     next_level = get_next_level(user.english_level)
-    session = EnglishTestSession(
-        id = uuid4(),
-        user_id = user_id,
-        level = next_level,
-        score = 0,
-        completed = False
-    )
-    db.add(session)
-    
+    session_id, form = start_test_session(db, user_id, next_level, upgrade_blueprint(next_level))
+
     upgrade_request = LevelUpgradeRequest(
         user_id = user_id,
         target_level = next_level,
@@ -296,37 +391,19 @@ def generate_upgrade_test(user_id: UUID,db:Session ) -> GenerateTestResponse:
 
     db.add(upgrade_request)
     db.commit()
-    db.refresh(session)
-
-    questions = (
-        db.query(Question)
-        .filter_by(level=next_level.value)
-        .order_by(func.random())
-        .limit(15)  
-        .all()
-    )
 
-    questions_serialized = []
-    for q in questions:
-        if q.type == QuestionType.multiple_choice:
-            q.options = db.query(Option).filter_by(question_id=q.id).all()
-        elif q.type == QuestionType.drag_and_drop:
-            q.drag_items = db.query(DragItem).filter_by(question_id=q.id).all()
-            q.drop_targets = db.query(DropTarget).filter_by(question_id=q.id).all()
-
-        questions_serialized.append(QuestionResponse.model_validate(q))
-
-    return GenerateTestResponse(
-        session_id=str(session.id),
-        target_levels=[next_level.value],
-        questions=questions_serialized
-    )
+    return build_test_response(session_id, form, target_levels=[next_level.value])
 
 def evaluate_upgrade_test(session_id: UUID, db: Session) -> SubmitDiagnosticResponse:
     """
     Оценка результатов теста на повышение уровня
 
     """
+    #блокировка сессии до подсчёта ответов, как в submit_diagnostic
+    session = db.query(EnglishTestSession).filter_by(id=session_id).with_for_update().one_or_none()
+    if not session:
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+
     answers = db.query(UserAnswer).filter_by(session_id=session_id).all()
     if not answers:
         raise HTTPException(status_code=400, detail="Нет ответов для данной сессии")
@@ -335,12 +412,11 @@ def evaluate_upgrade_test(session_id: UUID, db: Session) -> SubmitDiagnosticResp
     total = len(answers)
     score = int((correct_count / total) * 100)
 
-    session = db.query(EnglishTestSession).get(session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="Сессия не найдена")
-
+    first_completion = not session.completed
     session.score = correct_count
     session.completed = True
+    if first_completion:
+        session.completed_at = func.now()
 
     user = db.query(User).get(session.user_id)
     if not user:
@@ -362,6 +438,9 @@ def evaluate_upgrade_test(session_id: UUID, db: Session) -> SubmitDiagnosticResp
         if upgrade_request:
             upgrade_request.passed = False
 
+    if first_completion:
+        record_completed_session(db, session)
+
     db.commit()
 
     return SubmitDiagnosticResponse(diagnosed_level=user.english_level)
@@ -370,52 +449,86 @@ def evaluate_upgrade_test(session_id: UUID, db: Session) -> SubmitDiagnosticResp
 
 
 
-@router.post("/generate-upgrade-test", response_model=GenerateTestResponse)
-def upgrade_test(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@router.post("/generate-upgrade-test", response_model=GenerateTestResponse, response_class=PreEncodedJSONResponse)
+async def upgrade_test(user: CachedUser = Depends(get_current_user_cached), db: DbSession = Depends(get_db)):
     """ 
     Генерация теста для запроса на повышение уровня
     """
-    return generate_upgrade_test(user.id, db)
+    result = await run_db(db, lambda s: generate_upgrade_test(user.id, s))
+    return PreEncodedJSONResponse(encode_test_response(result))
 
 @router.post("/submit-upgrade-test/{session_id}", response_model=SubmitDiagnosticResponse)
-def submit_upgrade_test(session_id: UUID, db: Session = Depends(get_db)):
+async def submit_upgrade_test(session_id: UUID, db: DbSession = Depends(get_db)):
     """
     Завершение теста на повышение уровня и оценка результатов"""
-    return evaluate_upgrade_test(session_id, db)
+    return await run_db(db, lambda s: evaluate_upgrade_test(session_id, s))
 
 
-@router.post("/generate-diagnostic-test",response_model=GenerateTestResponse)
-def diagnostic_test(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@router.post("/generate-diagnostic-test",response_model=GenerateTestResponse, response_class=PreEncodedJSONResponse)
+async def diagnostic_test(user: CachedUser = Depends(get_current_user_cached), db: DbSession = Depends(get_db)):
     """
     Генерация диагностического теста
     """
-    result = generate_diagnostic_test(user.id, db)
-    return result
+    result = await run_db(db, lambda s: generate_diagnostic_test(user.id, s))
+    return PreEncodedJSONResponse(encode_test_response(result))
 
 
 @router.post("/submit-diagnostic/{session_id}",response_model=SubmitDiagnosticResponse)
-def submit_diagnostic_result(session_id: UUID, db: Session = Depends(get_db)):
+async def submit_diagnostic_result(session_id: UUID, db: DbSession = Depends(get_db)):
     """
     Завершение диагностики и определение уровня
     """
-    result = submit_diagnostic(session_id, db)
+    result = await run_db(db, lambda s: submit_diagnostic(session_id, s))
     return result
 
 
-@router.post("/generate-level-test",response_model=GenerateTestResponse)
-def level_progress_test(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@router.post("/generate-level-test",response_model=GenerateTestResponse, response_class=PreEncodedJSONResponse)
+async def level_progress_test(user: CachedUser = Depends(get_current_user_cached), db: DbSession = Depends(get_db)):
     """
     Генерация теста по текущему уровню
     """
-    result = generate_level_progression_test(user.id, db)
-    return result
+    result = await run_db(db, lambda s: generate_level_progression_test(user.id, s))
+    return PreEncodedJSONResponse(encode_test_response(result))
 
 
 @router.post("/submit-answers",response_model=SubmitAnswersResponse)
-def submit_answers(payload: SubmitAnswersRequest, db: Session = Depends(get_db)):
+async def submit_answers(payload: SubmitAnswersRequest, db: DbSession = Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    """
+    Принимает список ответов и сохраняет их. Повтор с тем же Idempotency-Key возвращает прежний ответ;
+    ключ действует в пределах сессий, к которым относятся ответы
+    """
+    session_ids = ",".join(sorted({str(entry.session_id) for entry in payload.answers}))
+    return await run_idempotent(
+        f"submit-answers:{session_ids}", idempotency_key, payload, SubmitAnswersResponse,
+        lambda: run_db(db, lambda s: submit_answer(payload.answers, s)),
+    )
+
+
+@router.get("/sessions/{session_id}", response_model=ResumeTestResponse, response_class=PreEncodedJSONResponse)
+async def resume_test(session_id: UUID, user: CachedUser = Depends(get_current_user_cached), db: DbSession = Depends(get_db)):
     """
-    Принимает список ответов и сохраняет их
+    Продолжение незавершённого теста после переподключения: тот же состав и порядок вариантов,
+    answered_question_ids — вопросы, ответы на которые уже сохранены
     """
-    return submit_answer(payload.answers, db)
+    result = await run_db(db, lambda s: resume_test_session(user.id, session_id, s))
+    return PreEncodedJSONResponse(encode_test_response(result))
 
 
+@router.post("/adaptive-diagnostic", response_model=AdaptiveStepResponse)
+async def adaptive_diagnostic(user: CachedUser = Depends(get_current_user_cached), db: DbSession = Depends(get_db)):
+    """
+    Начало адаптивной диагностики: вопросы выдаются по одному (ADAPTIVE_BATCH_SIZE)
+    """
+    return await run_db(db, lambda s: start_adaptive_diagnostic(user.id, s))
+
+
+@router.post("/adaptive-diagnostic/{session_id}/answers", response_model=AdaptiveStepResponse)
+async def adaptive_diagnostic_answers(session_id: UUID, payload: SubmitAnswersRequest, user: CachedUser = Depends(get_current_user_cached), db: DbSession = Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    """
+    Ответы на выданные вопросы; в ответе — следующие вопросы или итоговый уровень (finished=true).
+    Повтор с тем же Idempotency-Key возвращает те же следующие вопросы, а не выбирает новые
+    """
+    return await run_idempotent(
+        f"adaptive:{user.id}:{session_id}", idempotency_key, payload, AdaptiveStepResponse,
+        lambda: run_db(db, lambda s: submit_adaptive_answers(user.id, session_id, payload.answers, s)),
+    )
@@ -1,6 +1,7 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 from uuid import UUID
-from typing import List, Optional
+from datetime import datetime
+from typing import Dict, List, Optional
 from enum import Enum
 
 
@@ -85,10 +86,26 @@ class GenerateTestResponse(BaseModel):
     target_levels: Optional[List[str]] = None
     questions: List[QuestionResponse]
 
+    _questions_json: Optional[bytes] = PrivateAttr(default=None)  #готовый JSON списка questions из формы пула
+
+
+class ResumeTestResponse(GenerateTestResponse):
+    answered_question_ids: List[UUID] = []  #вопросы, ответы на которые уже сохранены
+
 
 class SubmitDiagnosticResponse(BaseModel):
     diagnosed_level: EnglishLevelEnum
 
+
+class AdaptiveStepResponse(BaseModel):
+    session_id: str
+    finished: bool
+    answered: int
+    theta: float  #текущая оценка способности
+    standard_error: float
+    questions: List[QuestionResponse]  #следующие вопросы, пусто после завершения
+    diagnosed_level: Optional[EnglishLevelEnum] = None
+
 class TestHistoryQuestion(BaseModel):
     question_text: str
     user_answer: Optional[str]
@@ -100,10 +117,31 @@ class TestSessionHistory(BaseModel):
     level: EnglishLevelEnum
     score: int
     completed: bool
-    questions: List[TestHistoryQuestion]
+    created_at: datetime
+    completed_at: Optional[datetime]
+    answers_total: int
+    answers_correct: int
+    questions_total: Optional[int] = None  #вопросов в выданной форме, None — у тестов до сохранения форм
 
 class TestHistoryResponse(BaseModel):
     history: List[TestSessionHistory]
+    next_cursor: Optional[str] = None  #передать в ?cursor= для следующей страницы, None — страниц больше нет
+
+class TestSessionDetailResponse(TestSessionHistory):
+    questions: List[TestHistoryQuestion]
+
+
+class CategoryAccuracy(BaseModel):
+    correct: int
+    total: int
+    accuracy: float
+
+class ProgressSummaryResponse(BaseModel):
+    tests_taken: int
+    last_diagnosed_level: Optional[EnglishLevelEnum]
+    best_scores: Dict[str, int]  #уровень теста -> лучший результат
+    category_accuracy: Dict[str, CategoryAccuracy]  #категория вопросов -> точность
+    updated_at: Optional[datetime]
 
 
 class SelectLevelResponse(BaseModel):
@@ -0,0 +1,94 @@
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Iterable, Mapping, Optional
+from uuid import UUID
+
+from backend.app.english_test_schemas import AnswerPayload
+from backend.app.models import QuestionType
+
+
+LEVEL_ORDER = ("A1", "A2", "B1", "B2", "C1", "C2")
+PASSING_LEVEL_ACCURACY = 0.6
+
+
+def diagnose_level(level_stats: Mapping[str, Mapping[str, int]]) -> str:
+    """
+    Уровень по итогам диагностики: самый высокий уровень, до которого включительно
+    доля правильных ответов на каждом уровне не ниже PASSING_LEVEL_ACCURACY.
+    level_stats: уровень -> {"correct": n, "total": m}; уровни без вопросов пропускаются
+    """
+    if all(stats["total"] == 0 for stats in level_stats.values()):
+        return "A1"
+
+    best_level = "A1"
+    for lvl in LEVEL_ORDER:
+        stats = level_stats.get(lvl)
+        if not stats or stats["total"] == 0:
+            continue
+        if stats["correct"] / stats["total"] >= PASSING_LEVEL_ACCURACY:
+            best_level = lvl
+        else:
+            break
+    return best_level
+
+
+def normalize_text_answer(text: Optional[str]) -> str:
+    return (text or "").strip().lower()
+
+
+@dataclass(frozen=True)
+class AnswerKey:
+    """
+    Скомпилированный ключ ответа на вопрос: всё, что нужно для оценки без обращения к базе
+    """
+    question_id: UUID
+    type: QuestionType
+    correct_option_ids: frozenset = frozenset()       # multiple_choice
+    open_answers: frozenset = frozenset()             # open_text, уже нормализованные
+    drag_map: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))  # drag_item_id.hex -> target_key
+
+
+def compile_answer_key(question) -> AnswerKey:
+    """
+    Строит ключ по снимку вопроса (QuestionSnapshot) или ORM-объекту Question с подгруженными дочерними элементами
+    """
+    if question.type == QuestionType.multiple_choice:
+        return AnswerKey(
+            question_id=question.id,
+            type=question.type,
+            correct_option_ids=frozenset(o.id for o in question.options if o.is_correct),
+        )
+    if question.type == QuestionType.open_text:
+        answer = normalize_text_answer(question.correct_answer)
+        return AnswerKey(
+            question_id=question.id,
+            type=question.type,
+            open_answers=frozenset([answer]) if answer else frozenset(),
+        )
+    return AnswerKey(
+        question_id=question.id,
+        type=question.type,
+        drag_map=MappingProxyType({item.id.hex: item.target_key for item in question.drag_items}),
+    )
+
+
+def is_answer_correct(key: AnswerKey, answer: AnswerPayload) -> bool:
+    if key.type == QuestionType.multiple_choice:
+        return answer.selected_option_id in key.correct_option_ids
+    if key.type == QuestionType.open_text:
+        return normalize_text_answer(answer.answer_text) in key.open_answers
+    submitted_pairs = answer.match_pairs or {}
+    return all(key.drag_map.get(k) == v for k, v in submitted_pairs.items())
+
+
+def grade_answers(answer_keys: Mapping[UUID, AnswerKey], answers: Iterable[AnswerPayload]) -> list[tuple[AnswerPayload, AnswerKey, bool]]:
+    """
+    Оценивает список ответов целиком в памяти. Ответы на неизвестные вопросы пропускаются
+    """
+    graded = []
+    for answer in answers:
+        key = answer_keys.get(answer.question_id)
+        if key is None:
+            continue
+        graded.append((answer, key, is_answer_correct(key, answer)))
+    return graded
@@ -0,0 +1,76 @@
+"""
+Заголовок Idempotency-Key у отправки ответов: повтор запроса с тем же ключом (клиент не дождался
+ответа на нестабильной сети) не выполняется заново, а получает сохранённый в Redis ответ.
+Пока первый запрос выполняется, повтор получает 409; тот же ключ с другим телом — 422
+"""
+import hashlib
+import json
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from fastapi.exceptions import HTTPException
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+import backend.app.auth as auth_module
+from backend.database.config import IDEMPOTENCY_KEY_TTL
+
+IDEMPOTENCY_PREFIX = "idempotency:"
+PENDING_TTL = 60  #секунды: ключ упавшего посреди запроса процесса освобождается сам
+MAX_KEY_LENGTH = 255
+
+ResponseModel = TypeVar("ResponseModel", bound=BaseModel)
+
+
+def request_fingerprint(payload: BaseModel) -> str:
+    return hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
+
+
+def claim_key(redis_key: str, fingerprint: str) -> Optional[str]:
+    """
+    Занимает ключ на время выполнения запроса. Если запрос с этим ключом уже выполнен,
+    возвращает сохранённый JSON ответа
+    """
+    client = auth_module.redis_client
+    if client.set(redis_key, json.dumps({"fingerprint": fingerprint}), nx=True, ex=PENDING_TTL):
+        return None
+    stored = client.get(redis_key)
+    record = json.loads(stored) if stored is not None else {"fingerprint": fingerprint}
+    if record["fingerprint"] != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key уже использован для другого запроса")
+    if "response" not in record:
+        raise HTTPException(status_code=409, detail="Запрос с этим Idempotency-Key ещё выполняется")
+    return record["response"]
+
+
+def store_response(redis_key: str, fingerprint: str, response_json: str) -> None:
+    record = {"fingerprint": fingerprint, "response": response_json}
+    auth_module.redis_client.set(redis_key, json.dumps(record), ex=IDEMPOTENCY_KEY_TTL)
+
+
+def release_key(redis_key: str) -> None:
+    auth_module.redis_client.delete(redis_key)
+
+
+async def run_idempotent(scope: str, key: Optional[str], payload: BaseModel, response_model: type[ResponseModel], call: Callable[[], Awaitable[ResponseModel]]) -> ResponseModel:
+    """
+    Выполняет call не больше одного раза на ключ в пределах scope. Без ключа — просто выполняет.
+    Ошибка освобождает ключ: повтор выполнится заново
+    """
+    if key is None:
+        return await call()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key должен быть от 1 до {MAX_KEY_LENGTH} символов")
+
+    redis_key = f"{IDEMPOTENCY_PREFIX}{scope}:{key}"
+    fingerprint = request_fingerprint(payload)
+    stored = await run_in_threadpool(claim_key, redis_key, fingerprint)
+    if stored is not None:
+        return response_model.model_validate_json(stored)
+
+    try:
+        result = await call()
+    except BaseException:
+        await run_in_threadpool(release_key, redis_key)
+        raise
+    await run_in_threadpool(store_response, redis_key, fingerprint, result.model_dump_json())
+    return result
@@ -0,0 +1,109 @@
+"""
+Двухпараметрическая модель IRT (2PL) для адаптивной диагностики:
+P(верно | θ) = 1 / (1 + exp(-a·(θ - b))), a — дискриминативность вопроса, b — трудность.
+Способность θ оценивается по апостериорному среднему (EAP) на сетке со стандартным
+нормальным априорным распределением, следующий вопрос — с максимальной информацией при текущей θ.
+"""
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+
+#Начальная трудность вопроса по уровню CEFR, пока параметры не откалиброваны по ответам.
+#Границы уровней по θ — середины между соседними значениями
+LEVEL_DIFFICULTY = {"A1": -2.5, "A2": -1.5, "B1": -0.5, "B2": 0.5, "C1": 1.5, "C2": 2.5}
+LEVEL_CUTPOINTS = np.array([-2.0, -1.0, 0.0, 1.0, 2.0])
+LEVELS = tuple(LEVEL_DIFFICULTY)
+
+THETA_GRID = np.linspace(-4.0, 4.0, 161)
+_LOG_PRIOR = -0.5 * THETA_GRID ** 2
+
+
+def probability(theta, a, b) -> np.ndarray:
+    """
+    Вероятность правильного ответа; θ, a и b транслируются по правилам NumPy
+    """
+    return 1.0 / (1.0 + np.exp(-np.asarray(a) * (np.asarray(theta) - np.asarray(b))))
+
+
+def item_information(theta: float, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Информация Фишера вопросов при θ: a² · P · (1 - P)
+    """
+    p = probability(theta, a, b)
+    return a ** 2 * p * (1.0 - p)
+
+
+@dataclass(frozen=True)
+class AbilityEstimate:
+    theta: float
+    standard_error: float
+
+
+def estimate_ability(a: np.ndarray, b: np.ndarray, correct: np.ndarray) -> AbilityEstimate:
+    """
+    EAP-оценка θ и её стандартная ошибка (апостериорное стандартное отклонение)
+    по ответам на вопросы с параметрами a, b. Без ответов — априорные 0 и 1
+    """
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    correct = np.asarray(correct, dtype=bool)
+    p = probability(THETA_GRID[:, None], a[None, :], b[None, :])  #сетка × вопросы
+    p = np.clip(p, 1e-12, 1 - 1e-12)
+    log_likelihood = np.where(correct[None, :], np.log(p), np.log1p(-p)).sum(axis=1)
+    log_posterior = _LOG_PRIOR + log_likelihood
+    posterior = np.exp(log_posterior - log_posterior.max())
+    posterior /= posterior.sum()
+    theta = float(posterior @ THETA_GRID)
+    variance = float(posterior @ (THETA_GRID - theta) ** 2)
+    return AbilityEstimate(theta=theta, standard_error=variance ** 0.5)
+
+
+def select_items(theta: float, a: np.ndarray, b: np.ndarray, exclude: np.ndarray, k: int = 1, randomesque: int = 1, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    Индексы k вопросов с наибольшей информацией при θ среди не исключённых (exclude — булева маска).
+    randomesque > 1 — случайные k из randomesque·k самых информативных, чтобы все пользователи
+    не получали одни и те же первые вопросы
+    """
+    information = np.where(exclude, -np.inf, item_information(theta, a, b))
+    available = int((~exclude).sum())
+    top = min(available, k * max(randomesque, 1))
+    if top == 0:
+        return np.empty(0, dtype=int)
+    candidates = np.argpartition(-information, top - 1)[:top]
+    if top > k:
+        rng = rng or np.random.default_rng()
+        candidates = rng.choice(candidates, size=k, replace=False)
+    return candidates[np.argsort(-information[candidates])]
+
+
+def theta_to_level(theta: float) -> str:
+    return LEVELS[int(np.searchsorted(LEVEL_CUTPOINTS, theta))]
+
+
+class ItemPool:
+    """
+    Параметры вопросов банка в виде массивов для векторных вычислений
+    """
+
+    def __init__(self, question_ids: Sequence, discrimination: Sequence[float], difficulty: Sequence[float]):
+        self.question_ids = tuple(question_ids)
+        self.index = {qid: i for i, qid in enumerate(self.question_ids)}
+        self.a = np.asarray(discrimination, dtype=float)
+        self.b = np.asarray(difficulty, dtype=float)
+
+    def __len__(self) -> int:
+        return len(self.question_ids)
+
+    def mask(self, question_ids) -> np.ndarray:
+        mask = np.zeros(len(self), dtype=bool)
+        mask[[self.index[qid] for qid in question_ids if qid in self.index]] = True
+        return mask
+
+    def estimate(self, responses: dict) -> AbilityEstimate:
+        """
+        responses: question_id -> верно ли; вопросы не из пула игнорируются
+        """
+        known = [(self.index[qid], bool(is_correct)) for qid, is_correct in responses.items() if qid in self.index]
+        idx = np.array([i for i, _ in known], dtype=int)
+        correct = np.array([c for _, c in known], dtype=bool)
+        return estimate_ability(self.a[idx], self.b[idx], correct)
@@ -1,20 +1,46 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from backend.app.auth import router as auth_router
-from backend.app.english_test import router as engtest_router
+from backend.app.english_test import all_blueprints, router as engtest_router
+from backend.app.prepared_tests import prepared_test_pool
 from backend.app.profile import router as profile_router
-from fastapi.staticfiles import StaticFiles
+from backend.app.monitoring import router as monitoring_router, metrics_middleware
+from backend.app.avatars import DEFAULT_AVATAR_FILE, AvatarUploadLimitMiddleware, load_default_avatar
+from backend.app.media import MediaFiles
+from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
+from backend.utils.password_hashing import password_hasher
+from backend.utils.email import email_queue
 import os 
 
 os.makedirs("media/avatars", exist_ok=True)
-app = FastAPI()
 
-app.mount("/media", StaticFiles(directory="media"), name="media")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    prepared_test_pool.start(all_blueprints())
+    yield
+    await run_in_threadpool(prepared_test_pool.close, 5)
+    password_hasher.shutdown()
+    await run_in_threadpool(email_queue.close, 10)  #дослать письма из очереди
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.mount(
+    "/media",
+    MediaFiles(directory="media", in_memory={f"avatars/{DEFAULT_AVATAR_FILE}": load_default_avatar()}),
+    name="media",
+)
 
 
 app.include_router(auth_router, prefix="/auth")
 app.include_router(engtest_router,prefix="/test")
 app.include_router(profile_router,prefix="/profile")
+app.include_router(monitoring_router)
+
+app.add_middleware(AvatarUploadLimitMiddleware)
+app.middleware("http")(metrics_middleware)
 
 
 origins = [
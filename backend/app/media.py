@@ -0,0 +1,52 @@
+import hashlib
+import mimetypes
+import os
+from typing import Dict, Optional
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Scope
+
+from backend.app.avatars import hashed_avatar_digest
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"  #файл с тем же именем может измениться — браузер проверяет ETag
+IN_MEMORY_CACHE_CONTROL = "public, max-age=86400"
+
+
+class MediaFiles(StaticFiles):
+    """
+    StaticFiles для media/: файлы с хешем содержимого в имени отдаются как immutable на год
+    со строгим ETag из хеша, остальные — с обязательной проверкой ETag. Файлы из in_memory
+    (аватар по умолчанию) отдаются из памяти без обращения к диску
+    """
+
+    def __init__(self, *, directory: str, in_memory: Optional[Dict[str, bytes]] = None, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.in_memory = {
+            path: (content, f'"{hashlib.sha256(content).hexdigest()[:32]}"')
+            for path, content in (in_memory or {}).items()
+        }
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if path in self.in_memory and scope["method"] in ("GET", "HEAD"):
+            content, etag = self.in_memory[path]
+            headers = {"etag": etag, "cache-control": IN_MEMORY_CACHE_CONTROL}
+            if self.is_not_modified(Headers(headers=headers), Headers(scope=scope)):
+                return NotModifiedResponse(Headers(headers=headers))
+            return Response(content, media_type=mimetypes.guess_type(path)[0], headers=headers)
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        filename = os.path.basename(full_path)
+        if hashed_avatar_digest(filename):
+            response.headers["etag"] = f'"{os.path.splitext(filename)[0]}"'
+            response.headers["cache-control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["cache-control"] = REVALIDATE_CACHE_CONTROL
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -1,10 +1,12 @@
 import uuid 
-from sqlalchemy import Column, String,Enum,ForeignKey,Text,Integer,Boolean
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Column, String,Enum,ForeignKey,Text,Integer,Boolean,DateTime,Float,Index,LargeBinary,UniqueConstraint,func
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import declarative_base,relationship
 import enum
 
+from backend.app.irt import LEVEL_DIFFICULTY
+
 Base = declarative_base()
 
 class EnglishLevel(enum.Enum):
@@ -47,6 +49,10 @@ class LevelUpgradeRequest(Base):
     passed = Column(Boolean, default=False)  #статус запроса на повышение уровня 
 
     user = relationship("User")
+
+    __table_args__ = (
+        Index("ix_level_upgrade_requests_user_target", "user_id", "target_level"),
+    )
     
 class EnglishTestSession(Base):
     __tablename__ = "test_sessions"
@@ -56,9 +62,39 @@ class EnglishTestSession(Base):
     level = Column(Enum(EnglishLevel), nullable=False)  #уровень теста
     score = Column(Integer,nullable=False)  #результат теста
     completed = Column(Boolean, default=False)  #статус завершения теста
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    completed_at = Column(DateTime(timezone=True), nullable=True)  #ставится при завершении теста, ключ пагинации истории
+    question_ids = Column(ARRAY(UUID(as_uuid=True)), nullable=True)  #вопросы выданной формы по порядку, ответы на другие не принимаются; NULL — старые сессии
+    option_orders = Column(LargeBinary, nullable=True)  #порядок вариантов ответа вопросов формы (prepared_tests.pack_item_orders), для продолжения теста
+    diagnosed_level = Column(Enum(EnglishLevel), nullable=True)  #итог диагностики (по ответам или по θ адаптивного теста), ставится при первом завершении
 
     user = relationship("User")
 
+    __table_args__ = (
+        Index("ix_test_sessions_user_completed_at", "user_id", "completed_at", "id"),  #keyset-пагинация истории пользователя
+        Index("ix_test_sessions_completed_at", "completed_at"),  #инкрементальная калибровка вопросов по watermark
+    )
+
+class UserProgressSummary(Base):
+    """
+    Агрегаты прогресса пользователя для профиля. Обновляются инкрементально при завершении
+    теста (backend/app/progress.py), пересобираются командой backend/utils/rebuild_progress_summaries.py
+    """
+    __tablename__ = "user_progress_summaries"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    tests_taken = Column(Integer, nullable=False, default=0)  #завершённые тесты любого вида
+    last_diagnosed_level = Column(Enum(EnglishLevel), nullable=True)  #результат последней диагностики
+    best_scores = Column(JSONB, nullable=False, default=dict)  #уровень теста -> лучший score
+    category_stats = Column(JSONB, nullable=False, default=dict)  #категория вопроса -> {"correct": n, "total": m}
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+def _initial_difficulty(context) -> float:
+    level = context.get_current_parameters()["level"]
+    return LEVEL_DIFFICULTY.get(getattr(level, "value", level), 0.0)
+
+
 class Question(Base):
     __tablename__ = "questions"
 
@@ -68,13 +104,41 @@ class Question(Base):
     category = Column(Enum(QuestionCategory), nullable=False)  #категория вопроса
     type = Column(Enum(QuestionType), nullable=False)  #тип вопроса
     correct_answer = Column(Text,nullable=True)  #правильный ответ для вопросов с открытым текстом (вписать вариант ответа)
+    difficulty = Column(Float, nullable=False, default=_initial_difficulty, server_default="0")  #трудность b в модели IRT, до калибровки — по уровню
+    discrimination = Column(Float, nullable=False, default=1.0, server_default="1")  #дискриминативность a в модели IRT
+    calibration_answers = Column(Integer, nullable=False, default=0, server_default="0")  #ответов, учтённых калибровкой a и b
+
+    __table_args__ = (
+        Index("ix_questions_level_type", "level", "type"),  #выборка вопросов по уровню (и типу)
+    )
+
+
+class ItemCalibrationRun(Base):
+    """
+    Запуски калибровки параметров вопросов (backend/app/calibration.py). Следующий запуск
+    обрабатывает только тесты, завершённые после watermark последнего
+    """
+    __tablename__ = "item_calibration_runs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=False)
+    watermark = Column(DateTime(timezone=True), nullable=False, index=True)  #учтены тесты с completed_at <= watermark
+    sessions = Column(Integer, nullable=False)  #тестов в этом запуске
+    answers = Column(Integer, nullable=False)  #ответов в этом запуске
+    items_updated = Column(Integer, nullable=False)
+    iterations = Column(Integer, nullable=False)  #итераций EM
+    converged = Column(Boolean, nullable=False)
+    max_change = Column(Float, nullable=True)  #наибольшее изменение параметра на последней итерации
+    log_likelihood = Column(Float, nullable=True)  #маргинальное лог-правдоподобие ответов на последней итерации
+    duration_seconds = Column(Float, nullable=False)
 
 
 class Option(Base): 
     __tablename__ = "options"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    question_id = Column(UUID(as_uuid=True), ForeignKey("questions.id"), nullable=False)
+    question_id = Column(UUID(as_uuid=True), ForeignKey("questions.id"), nullable=False, index=True)
     text = Column(String, nullable=False)
     is_correct = Column(Boolean, default=False)
 
@@ -89,17 +153,21 @@ class UserAnswer(Base):
     answer_text = Column(Text, nullable=True)
     is_correct = Column(Boolean, nullable=False)  #правильный ли ответ
     feedback = Column(Text, nullable=True)  #обратная связь по ответу
-    match_pairs = Column(JSONB, nullable=True)  # ключи drag_item_id -> drop_target_id
+    match_pairs = Column(JSONB(none_as_null=True), nullable=True)  # ключи drag_item_id -> drop_target_id
 
 
     question = relationship("Question")
     session = relationship("EnglishTestSession")
 
+    __table_args__ = (
+        UniqueConstraint("session_id", "question_id", name="uq_user_answers_session_question"),  #повторная отправка ответа перезаписывает его
+    )
+
 class DragItem(Base):
     __tablename__ = "drag_items"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    question_id = Column(UUID(as_uuid=True), ForeignKey("questions.id"), nullable=False)
+    question_id = Column(UUID(as_uuid=True), ForeignKey("questions.id"), nullable=False, index=True)
     label = Column(String, nullable=False)  #текст перетаскиваемого элемента
     target_key = Column(String, nullable=False)  #ключ для сопоставления элемента в правильнкю позицию 
 
@@ -109,7 +177,7 @@ class DropTarget(Base):
     __tablename__ = "drop_targets"
 
     id= Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    question_id = Column(UUID(as_uuid=True), ForeignKey("questions.id"), nullable=False)
+    question_id = Column(UUID(as_uuid=True), ForeignKey("questions.id"), nullable=False, index=True)
     placeholder = Column(String, nullable=False)  #текст подсказки 
     target_key = Column(String, nullable=False)  #ключ для сопоставления с DragItem
 
@@ -0,0 +1,185 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import APIRouter, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import iter_route_contexts
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+
+import backend.app.auth as auth_module
+from backend.database.database import async_engine, engine, get_pool_status
+
+router = APIRouter()
+
+
+REQUESTS = Counter(
+    "http_requests_total", "Количество HTTP-запросов", ["method", "route", "status"]
+)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP-запросы в обработке", ["method"]
+)
+LATENCY = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+DB_QUERIES = Histogram(
+    "http_request_db_queries", "Количество SQL-запросов на HTTP-запрос", ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+DB_TIME = Histogram(
+    "http_request_db_duration_seconds", "Суммарное время SQL-запросов на HTTP-запрос", ["route"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+
+#Счётчики SQL текущего запроса. Значение — изменяемый список [запросов, секунд]:
+#контекст копируется в пул потоков и в greenlet run_sync, а список остаётся общим
+_request_db_stats: ContextVar[Optional[list]] = ContextVar("request_db_stats", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context._query_start_time = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_db_stats.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - context._query_start_time
+
+
+#id маршрута -> полный шаблон пути с префиксами include_router: route.path в FastAPI — путь без префикса
+_route_paths: dict[int, str] = {}
+
+
+def _route_path(app, route) -> Optional[str]:
+    path = _route_paths.get(id(route))
+    if path is None and app is not None:
+        _route_paths.update((id(context.original_route), context.path_format) for context in iter_route_contexts(app.routes))
+        path = _route_paths.get(id(route))
+    return path or getattr(route, "path_format", None)
+
+
+def route_template(scope: dict) -> str:
+    """
+    Шаблон маршрута (/test/submit-diagnostic/{session_id}) вместо фактического пути,
+    чтобы не плодить метки. Берётся из маршрута, который роутер кладёт в scope["route"]
+    после сопоставления; неизвестные пути схлопываются в "unmatched"
+    """
+    route = scope.get("route")
+    if route is None:
+        if "endpoint" in scope and scope.get("root_path"):
+            return f"{scope['root_path']}/{{path}}"  #смонтированное приложение, например /media
+        return "unmatched"
+    return _route_path(scope.get("app"), route) or "unmatched"
+
+
+async def metrics_middleware(request: Request, call_next):
+    method = request.method
+    db_stats = [0, 0.0]
+    token = _request_db_stats.set(db_stats)
+    IN_PROGRESS.labels(method).inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = route_template(request.scope)
+        LATENCY.labels(method, route).observe(time.perf_counter() - start)
+        IN_PROGRESS.labels(method).dec()
+        REQUESTS.labels(method, route, str(status)).inc()
+        DB_QUERIES.labels(route).observe(db_stats[0])
+        DB_TIME.labels(route).observe(db_stats[1])
+        _request_db_stats.reset(token)
+
+
+class PoolCollector:
+    """
+    Экспортирует состояние пулов соединений (см. backend.database.pool_stats) в Prometheus
+    """
+
+    def collect(self):
+        gauges = {
+            name: GaugeMetricFamily(f"db_pool_{name}", f"Пул соединений: {name}", labels=["pool"])
+            for name in ("size", "checked_in", "checked_out", "overflow", "timeouts")
+        }
+        checkout = HistogramMetricFamily(
+            "db_pool_checkout_seconds", "Время получения соединения из пула", labels=["pool"]
+        )
+        for pool, status in get_pool_status().items():
+            for name, gauge in gauges.items():
+                gauge.add_metric([pool], status[name])
+            checkout.add_metric(
+                [pool],
+                buckets=list(status["checkout_latency_histogram"].items()),
+                sum_value=status["wait_seconds_total"],
+            )
+        yield from gauges.values()
+        yield checkout
+
+
+REGISTRY.register(PoolCollector())
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics() -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+@router.get("/health")
+def health() -> dict:
+    """
+    Liveness: процесс жив и обслуживает запросы
+    """
+    return {"status": "ok"}
+
+
+def _check_sync_postgres() -> None:
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+async def _check_postgres() -> None:
+    """
+    Проверяет движок, которым пользуется get_db: asyncpg при DB_ASYNC, иначе синхронный
+    """
+    if async_engine is None:
+        await run_in_threadpool(_check_sync_postgres)
+        return
+    async with async_engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+
+
+@router.get("/ready")
+async def ready() -> JSONResponse:
+    """
+    Readiness: доступны ли Postgres и Redis
+    """
+    checks = {}
+    for name, check in (("postgres", _check_postgres), ("redis", lambda: run_in_threadpool(auth_module.redis_client.ping))):
+        try:
+            await check()
+            checks[name] = "ok"
+        except Exception as e:
+            checks[name] = f"error: {e.__class__.__name__}"
+
+    ok = all(result == "ok" for result in checks.values())
+    return JSONResponse(status_code=200 if ok else 503, content={"status": "ok" if ok else "unavailable", "checks": checks})
+
+
+@router.get("/pool-stats")
+def pool_stats() -> dict:
+    """
+    Состояние пулов соединений с БД: занятые/свободные/overflow соединения,
+    время ожидания и гистограмма задержки получения соединения
+    """
+    return get_pool_status()
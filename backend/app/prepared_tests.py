@@ -0,0 +1,329 @@
+import dataclasses
+import logging
+import random
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Iterable, Optional
+from uuid import UUID
+
+from sqlalchemy.orm import Session
+
+from backend.app.english_test_schemas import QuestionResponse
+from backend.app.models import EnglishLevel
+from backend.app.question_bank import QuestionBank, QuestionSnapshot, encode_question, get_question_bank, get_questions
+from backend.app.question_sampler import get_question_sampler
+from backend.database.config import (
+    TEST_FORM_POOL_LOW_WATER,
+    TEST_FORM_POOL_SIZE,
+    TEST_FORM_RECENT_QUESTIONS,
+)
+from backend.database.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+#Состав теста: (уровень, сколько вопросов) в порядке выдачи
+Blueprint = tuple[tuple[EnglishLevel, int], ...]
+
+UNIQUE_FORM_ATTEMPTS = 3  #повторов подряд, после которых считаем, что уникальные формы этого состава кончились
+RENDERED_QUESTIONS_LIMIT = 100_000  #перестановок вопросов в кэше снимка банка, сверх — кодируются на месте
+
+#Порядок показа вариантов ответа (options) и перетаскиваемых элементов (drag_items) одного вопроса:
+#индексы в каноническом порядке — по id, он не зависит от порядка загрузки банка
+ItemOrder = tuple[tuple[int, ...], tuple[int, ...]]
+
+
+@dataclass(frozen=True)
+class PreparedTest:
+    """
+    Собранный и сериализованный набор вопросов теста. bank_generation — поколение снимка банка вопросов,
+    из которого он собран: после перечитывания банка форма устаревает.
+    questions_json — готовый JSON-массив questions для тела ответа,
+    option_orders — перемешанный порядок вариантов каждого вопроса (pack_item_orders), сохраняется в сессии
+    """
+    blueprint: Blueprint
+    bank_generation: int
+    question_ids: frozenset[UUID]
+    questions: tuple[QuestionResponse, ...]
+    questions_json: bytes
+    option_orders: bytes = b""
+
+
+def _canonical(items: tuple) -> list:
+    return sorted(items, key=lambda item: item.id)
+
+
+def shuffled_order(question: QuestionSnapshot) -> ItemOrder:
+    return (
+        tuple(random.sample(range(len(question.options)), len(question.options))),
+        tuple(random.sample(range(len(question.drag_items)), len(question.drag_items))),
+    )
+
+
+def apply_item_order(question: QuestionSnapshot, order: Optional[ItemOrder]) -> QuestionSnapshot:
+    """
+    Вопрос с вариантами в сохранённом порядке. Если число вариантов с тех пор изменилось
+    (вопрос отредактирован), порядок не применяется
+    """
+    if order is None:
+        return question
+    options, drag_items = order
+    if len(options) != len(question.options) or len(drag_items) != len(question.drag_items):
+        return question
+    if not options and not drag_items:
+        return question
+    canonical_options, canonical_drag_items = _canonical(question.options), _canonical(question.drag_items)
+    return dataclasses.replace(
+        question,
+        options=tuple(canonical_options[i] for i in options),
+        drag_items=tuple(canonical_drag_items[i] for i in drag_items),
+    )
+
+
+def pack_item_orders(orders: Iterable[ItemOrder]) -> bytes:
+    """
+    Порядки вариантов вопросов формы в байтах: на каждый вопрос — число вариантов и их индексы,
+    затем то же для drag_items, по байту на значение (30 вопросов по 4 варианта — около 200 байт)
+    """
+    packed = bytearray()
+    for order in orders:
+        for indexes in order:
+            packed.append(len(indexes))
+            packed.extend(indexes)
+    return bytes(packed)
+
+
+def unpack_item_orders(packed: bytes) -> list[ItemOrder]:
+    orders = []
+    position = 0
+    while position < len(packed):
+        order = []
+        for _ in range(2):
+            count = packed[position]
+            order.append(tuple(packed[position + 1:position + 1 + count]))
+            position += 1 + count
+        orders.append(tuple(order))
+    return orders
+
+
+def render_form(bank: QuestionBank, questions: Iterable[QuestionSnapshot], orders: Iterable[Optional[ItemOrder]]) -> tuple[tuple[QuestionResponse, ...], bytes]:
+    """
+    Вопросы формы в заданном порядке вариантов и готовый JSON-массив для тела ответа.
+    Вопрос банка в каждом порядке вариантов кодируется один раз на снимок (bank.rendered):
+    перестановок у вопроса немного, и формы пула быстро их повторяют
+    """
+    rendered = []
+    fragments = []
+    for question, order in zip(questions, orders):
+        in_bank = bank.get(question.id) is question
+        cached = bank.rendered.get((question.id, order)) if in_bank else None
+        if cached is None:
+            shown = apply_item_order(question, order)
+            fragment = bank.question_json.get(question.id) if in_bank and shown is question else None
+            cached = (QuestionResponse.model_validate(shown), fragment or encode_question(shown))
+            if in_bank and len(bank.rendered) < RENDERED_QUESTIONS_LIMIT:
+                bank.rendered[(question.id, order)] = cached
+        rendered.append(cached[0])
+        fragments.append(cached[1])
+    return tuple(rendered), b"[" + b",".join(fragments) + b"]"
+
+
+def build_prepared_test(db: Session, blueprint: Blueprint, exclude: Iterable[UUID] = ()) -> PreparedTest:
+    """
+    Собирает форму текущим сэмплером вопросов. Вопросы из exclude (недавно виденные пользователем)
+    и уже попавшие в форму не повторяются, пока на уровне хватает других (QuestionSampler.sample_ids)
+    """
+    bank = get_question_bank(db)
+    sampler = get_question_sampler()
+    exclude = set(exclude)
+    question_ids = []
+    for level, k in blueprint:
+        chosen = sampler.sample_ids(db, level, k, exclude)
+        question_ids.extend(chosen)
+        exclude.update(chosen)
+
+    questions = get_questions(db, question_ids)
+    #варианты ответов перемешиваются для каждой формы: правильный не стоит всегда на одном месте
+    orders = [shuffled_order(q) for q in questions]
+    rendered, questions_json = render_form(bank, questions, orders)
+    return PreparedTest(
+        blueprint=blueprint,
+        bank_generation=bank.generation,
+        question_ids=frozenset(q.id for q in questions),
+        questions=rendered,
+        questions_json=questions_json,
+        option_orders=pack_item_orders(orders),
+    )
+
+
+class RecentQuestions:
+    """
+    Последние выданные пользователю вопросы (не больше per_user на пользователя),
+    LRU по пользователям. Хранятся в памяти процесса: тесты, выданные другим uvicorn worker,
+    здесь не видны
+    """
+
+    def __init__(self, per_user: int, max_users: int = 50_000):
+        self.per_user = per_user
+        self.max_users = max_users
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: UUID) -> frozenset[UUID]:
+        with self._lock:
+            return frozenset(self._entries.get(user_id, ()))
+
+    def add(self, user_id: UUID, question_ids: Iterable[UUID]) -> None:
+        if self.per_user <= 0:
+            return
+        with self._lock:
+            recent = self._entries.get(user_id)
+            if recent is None:
+                recent = self._entries[user_id] = deque(maxlen=self.per_user)
+            recent.extend(question_ids)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+
+class PreparedTestPool:
+    """
+    Пул заранее собранных форм по каждому составу теста. Фоновый поток пополняет пул до size,
+    как только в нём остаётся меньше low_water форм. Формы в пуле не совпадают по набору вопросов,
+    пользователю выдаётся форма без недавно виденных им вопросов, а если такой нет —
+    форма собирается на месте. Формы устаревшей версии банка вопросов отбрасываются.
+    size=0 — пул выключен, каждая форма собирается на месте.
+
+    Пул и недавние вопросы свои в каждом процессе, поэтому «без недавно виденных вопросов»
+    гарантируется только в пределах одного uvicorn worker: при WEB_CONCURRENCY > 1 запросы
+    пользователя, попавшие в разные процессы, могут получить повторяющиеся вопросы
+    """
+
+    def __init__(self, size: int = TEST_FORM_POOL_SIZE, low_water: int = TEST_FORM_POOL_LOW_WATER, recent_questions: int = TEST_FORM_RECENT_QUESTIONS, session_factory=SessionLocal):
+        self.size = size
+        self.low_water = min(low_water, size)
+        self.recent = RecentQuestions(recent_questions)
+        self.session_factory = session_factory
+
+        self.built = 0
+        self.hits = 0
+        self.misses = 0
+        self._forms: dict[Blueprint, deque[PreparedTest]] = {}
+        self._bank_generation = -1
+        self._refill_requested = False
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._cond = threading.Condition()
+
+    def available(self, blueprint: Blueprint) -> int:
+        with self._cond:
+            return len(self._forms.get(blueprint, ()))
+
+    def take(self, db: Session, blueprint: Blueprint, user_id: UUID) -> PreparedTest:
+        """
+        Выдаёт форму пользователю и запоминает её вопросы как недавно виденные
+        """
+        bank_generation = get_question_bank(db).generation
+        recent = self.recent.get(user_id)
+        form = None
+        with self._cond:
+            self._drop_stale(bank_generation)
+            forms = self._forms.setdefault(blueprint, deque())
+            for candidate in forms:
+                if recent.isdisjoint(candidate.question_ids):
+                    form = candidate
+                    forms.remove(candidate)
+                    break
+            if self.size > 0 and len(forms) < self.low_water:
+                self._refill_requested = True
+                self._cond.notify_all()
+            if form is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if form is None:
+            form = build_prepared_test(db, blueprint, exclude=recent)
+        self.recent.add(user_id, form.question_ids)
+        return form
+
+    def _drop_stale(self, bank_generation: int) -> None:
+        if bank_generation > self._bank_generation:
+            self._bank_generation = bank_generation
+            for forms in self._forms.values():
+                forms.clear()
+
+    def refill(self, db: Session, blueprints: Optional[Iterable[Blueprint]] = None) -> int:
+        """
+        Пополняет пул до size по каждому составу (по умолчанию — по уже известным).
+        Возвращает число собранных форм
+        """
+        if self.size <= 0:
+            return 0
+        with self._cond:
+            blueprints = list(self._forms) if blueprints is None else list(blueprints)
+        built = 0
+        for blueprint in blueprints:
+            duplicates = 0
+            while duplicates < UNIQUE_FORM_ATTEMPTS and not self._closed:
+                with self._cond:
+                    if len(self._forms.get(blueprint, ())) >= self.size:
+                        break
+                form = build_prepared_test(db, blueprint)
+                with self._cond:
+                    self._drop_stale(form.bank_generation)
+                    if form.bank_generation < self._bank_generation:
+                        continue  #банк обновился, пока форма собиралась
+                    forms = self._forms.setdefault(blueprint, deque())
+                    if any(form.question_ids == other.question_ids for other in forms):
+                        #маленький банк: уникальных форм может не хватить на весь пул
+                        duplicates += 1
+                        continue
+                    forms.append(form)
+                    built += 1
+                    duplicates = 0
+        self.built += built
+        return built
+
+    def start(self, blueprints: Iterable[Blueprint]) -> None:
+        """
+        Регистрирует составы тестов и запускает фоновый поток пополнения
+        """
+        if self.size <= 0:
+            return
+        with self._cond:
+            for blueprint in blueprints:
+                self._forms.setdefault(blueprint, deque())
+            if self._thread is None:
+                self._closed = False
+                self._thread = threading.Thread(target=self._producer, name="test-form-producer", daemon=True)
+                self._thread.start()
+            self._refill_requested = True
+            self._cond.notify_all()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def _producer(self) -> None:
+        while True:
+            with self._cond:
+                #раз в минуту пул пополняется и без сигнала: банк мог измениться в другом процессе
+                self._cond.wait_for(lambda: self._closed or self._refill_requested, timeout=60)
+                if self._closed:
+                    return
+                self._refill_requested = False
+            try:
+                with self.session_factory() as db:
+                    self.refill(db)
+            except Exception:
+                logger.exception("Не удалось пополнить пул форм тестов")
+                with self._cond:
+                    self._cond.wait(5)
+
+
+prepared_test_pool = PreparedTestPool()
@@ -1,41 +1,59 @@
 from sqlalchemy.orm import Session
-from fastapi import APIRouter, Depends, File, UploadFile
+from fastapi import APIRouter, Depends, File, Query, UploadFile
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import aliased, defer
 from sqlalchemy.orm import Session
 from typing import Dict, Optional
 from uuid import UUID
 from fastapi.exceptions import HTTPException
-from PIL import Image
-import io
-
-from backend.database.database import get_db
-from backend.app.auth import get_current_user
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from backend.database.database import DbSession, get_db, run_db
+from starlette.concurrency import run_in_threadpool
+from backend.app.auth import get_current_user, get_current_user_cached
+from backend.app.user_cache import CachedUser
+from backend.app.progress import get_progress_summary
+from backend.app.avatars import (
+    ALLOWED_TYPES,
+    AVATAR_DIR,
+    DEFAULT_AVATAR_SIZE,
+    avatar_too_large,
+    avatar_variant_name,
+    avatar_variant_urls,
+    read_upload_limited,
+    store_avatar,
+)
+from backend.database.config import AVATAR_MAX_BYTES
 from backend.app.models import EnglishLevel, User, EnglishTestSession, UserAnswer, Question, Option
 from backend.app.english_test_schemas import (
     TestHistoryResponse,
     TestHistoryQuestion,
     TestSessionHistory,
+    TestSessionDetailResponse,
+    ProgressSummaryResponse,
     EnglishLevelEnum,
 )
 from backend.app.auth_schemas import UpdateEmailRequest, UserProfileResponse, VerifyEmailRequest,EmailUpdateResponse,EmailVerificationResponse,AvatarUploadResponse
 from backend.utils.email_verification import send_verification_code,generate_verification_code
+from backend.utils.email import EmailQueueFull
 
 router = APIRouter()
 
-ALLOWED_TYPES = ["image/png", "image/jpeg", "image/jpg"]
-MAX_DIMENSION = 400
 
 
 
 
 # получение данных профиля
 @router.get("/me", response_model=UserProfileResponse)
-def get_profile_info(user: User = Depends(get_current_user)) -> UserProfileResponse:
+async def get_profile_info(user: CachedUser = Depends(get_current_user_cached)) -> UserProfileResponse:
     return {
         "id": str(user.id),
         "username": user.username,
         "email": user.email,
         "english_level": user.english_level.value,
-        "avatar_url": user.avatar_url
+        "avatar_url": user.avatar_url,
+        "avatar_urls": avatar_variant_urls(user.avatar_url),
     }
 
 
@@ -43,84 +61,187 @@ def get_profile_info(user: User = Depends(get_current_user)) -> UserProfileRespo
 
 
 #  Получение истории тестов
-@router.get("/history", response_model=TestHistoryResponse)
-def get_profile_test_history(user: User = Depends(get_current_user), db: Session = Depends(get_db)) -> TestHistoryResponse:
+HISTORY_PAGE_SIZE = 10
+HISTORY_MAX_PAGE_SIZE = 100
+
+
+def encode_history_cursor(completed_at: datetime, session_id: UUID) -> str:
+    return urlsafe_b64encode(f"{completed_at.isoformat()}|{session_id}".encode()).decode()
+
+
+def decode_history_cursor(cursor: str) -> tuple[datetime, UUID]:
+    try:
+        completed_at, session_id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(completed_at), UUID(session_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный курсор истории")
+
+
+#число вопросов формы считает база: массив question_ids в историю не загружается
+_questions_total = func.cardinality(EnglishTestSession.question_ids)
+
+
+def _session_summary(session: EnglishTestSession, answers_total: int, answers_correct: int, questions_total: Optional[int]) -> dict:
+    return {
+        "session_id": str(session.id),
+        "level": session.level.value,
+        "score": session.score,
+        "completed": session.completed,
+        "created_at": session.created_at,
+        "completed_at": session.completed_at,
+        "answers_total": answers_total,
+        "answers_correct": answers_correct,
+        "questions_total": questions_total,
+    }
+
+
+def load_test_history(user_id: UUID, db: Session, limit: int = HISTORY_PAGE_SIZE, cursor: Optional[str] = None) -> dict:
     """
-    Возвращает последние 10 завершённых тестов пользователя — с деталями по каждому вопросу
+    Страница завершённых тестов пользователя, новые первыми, — одним запросом.
+    Keyset-пагинация по (completed_at, id): cursor — next_cursor предыдущей страницы
     """
-    sessions = (
-        db.query(EnglishTestSession)
-        .filter_by(user_id = user.id, completed = True)
-        .order_by(EnglishTestSession.id.desc())
-        .limit(10)
-        .all()
+    answers_correct = func.count(UserAnswer.id).filter(UserAnswer.is_correct.is_(True))
+    query = (
+        db.query(EnglishTestSession, func.count(UserAnswer.id), answers_correct, _questions_total)
+        .options(defer(EnglishTestSession.question_ids))
+        .outerjoin(UserAnswer, UserAnswer.session_id == EnglishTestSession.id)
+        .filter(
+            EnglishTestSession.user_id == user_id,
+            EnglishTestSession.completed_at.isnot(None),  #completed_at есть только у завершённых
+        )
+        .group_by(EnglishTestSession.id)
+        .order_by(EnglishTestSession.completed_at.desc(), EnglishTestSession.id.desc())
     )
+    if cursor:
+        completed_at, session_id = decode_history_cursor(cursor)
+        query = query.filter(tuple_(EnglishTestSession.completed_at, EnglishTestSession.id) < (completed_at, session_id))
 
-    history = []
+    rows = query.limit(limit + 1).all()
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1][0]
+        next_cursor = encode_history_cursor(last.completed_at, last.id)
 
+    return {
+        "history": [_session_summary(session, total, correct, questions_total) for session, total, correct, questions_total in page],
+        "next_cursor": next_cursor,
+    }
 
-    for session in sessions:
-        answers = (
-            db.query(UserAnswer)
-            .filter_by(session_id = session.id)
-            .all()
-        )
 
-        session_data = {
-            "session_id": str(session.id),
-            "level": session.level.value,
-            "score": session.score,
-            "completed": session.completed,
-            "questions": []
+def load_test_session_detail(user_id: UUID, session_id: UUID, db: Session) -> dict:
+    """
+    Ответы одной сессии пользователя с текстами вопросов и правильными ответами — одним запросом,
+    в порядке вопросов формы
+    """
+    selected_option = aliased(Option)
+    correct_option_text = (
+        select(Option.text)
+        .where(Option.question_id == UserAnswer.question_id, Option.is_correct.is_(True))
+        .limit(1)
+        .scalar_subquery()
+    )
+    rows = (
+        db.query(
+            EnglishTestSession,
+            _questions_total,
+            UserAnswer.id,
+            UserAnswer.answer_text,
+            UserAnswer.is_correct,
+            Question.prompt,
+            selected_option.text,
+            func.coalesce(correct_option_text, Question.correct_answer),  #для open_text — эталонный текст
+        )
+        .options(defer(EnglishTestSession.question_ids))
+        .outerjoin(UserAnswer, UserAnswer.session_id == EnglishTestSession.id)
+        .outerjoin(Question, Question.id == UserAnswer.question_id)
+        .outerjoin(selected_option, selected_option.id == UserAnswer.selected_option_id)
+        .filter(EnglishTestSession.id == session_id, EnglishTestSession.user_id == user_id)
+        #в порядке выдачи формы; ответы сессий без сохранённой формы — в конце, по стабильному ключу
+        .order_by(func.array_position(EnglishTestSession.question_ids, UserAnswer.question_id).nulls_last(), UserAnswer.id)
+        .all()
+    )
+    if not rows:
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+
+    questions = [
+        {
+            "question_text": prompt,
+            "user_answer": selected_text if selected_text is not None else answer_text,
+            "correct_answer": correct_answer,
+            "is_correct": is_correct,
         }
+        for _, _, answer_id, answer_text, is_correct, prompt, selected_text, correct_answer in rows
+        if answer_id is not None
+    ]
+    detail = _session_summary(rows[0][0], len(questions), sum(q["is_correct"] for q in questions), rows[0][1])
+    detail["questions"] = questions
+    return detail
 
-        for ans in answers:
-            question = db.query(Question).get(ans.question_id)
-            selected_option = db.query(Option).get(ans.selected_option_id)
-            correct_option = (
-                db.query(Option)
-                .filter_by(question_id=ans.question_id, is_correct=True)
-                .first()
-            )
-
-        session_data["questions"].append({
-                "question_text": question.prompt,
-                "user_answer": selected_option.text if selected_option else ans.answer_text,
-                "correct_answer": correct_option.text if correct_option else None,
-                "is_correct": ans.is_correct
-            })
 
-        history.append(session_data)
-
-    return {"history": history}
+@router.get("/history", response_model=TestHistoryResponse)
+async def get_profile_test_history(
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    user: CachedUser = Depends(get_current_user_cached),
+    db: DbSession = Depends(get_db)
+) -> TestHistoryResponse:
+    return await run_db(db, lambda s: load_test_history(user.id, s, limit, cursor))
+
+
+@router.get("/history/{session_id}", response_model=TestSessionDetailResponse)
+async def get_profile_test_session(
+    session_id: UUID,
+    user: CachedUser = Depends(get_current_user_cached),
+    db: DbSession = Depends(get_db)
+) -> TestSessionDetailResponse:
+    return await run_db(db, lambda s: load_test_session_detail(user.id, session_id, s))
+
+
+@router.get("/progress", response_model=ProgressSummaryResponse)
+async def get_profile_progress(
+    user: CachedUser = Depends(get_current_user_cached),
+    db: DbSession = Depends(get_db)
+) -> ProgressSummaryResponse:
+    """
+    Сводка прогресса: читает только user_progress_summaries, без сканирования user_answers
+    """
+    return await run_db(db, lambda s: get_progress_summary(s, user.id))
 
 
 @router.post("/update-email", response_model=EmailUpdateResponse)
-def update_email(
+async def update_email(
     payload: UpdateEmailRequest,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ) -> EmailUpdateResponse:
-    existing = db.query(User).filter_by(email=payload.email).first()
+    existing = await run_db(db, lambda s: s.query(User).filter_by(email=payload.email).first())
     if existing and existing.id != user.id:
         raise HTTPException(status_code=400, detail="Email уже используется другим пользователем")
 
     user.email = payload.email
     user.email_verified = False
     user.email_verification_code = generate_verification_code()
-    db.commit()
+    code = user.email_verification_code
 
-    send_verification_code(email=payload.email, code=user.email_verification_code)
+    # письмо уходит из фоновой очереди (backend/utils/email.py), запрос SMTP не ждёт.
+    # Новый email фиксируется только после постановки письма: при переполненной очереди старый адрес остаётся подтверждённым
+    try:
+        send_verification_code(email=payload.email, code=code)
+    except EmailQueueFull:
+        await run_db(db, lambda s: s.rollback())
+        raise HTTPException(status_code=503, detail="Не удалось отправить код, повторите попытку позже")
+    await run_db(db, lambda s: s.commit())
 
-    return EmailUpdateResponse(message="Код подтверждения отправлен", email=user.email)
+    return EmailUpdateResponse(message="Код подтверждения отправлен", email=payload.email)
 
 
 
 @router.post("/verify-email", response_model=EmailVerificationResponse)
-def verify_email(
+async def verify_email(
     payload: VerifyEmailRequest,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ) -> EmailVerificationResponse:
     if user.email_verified:
         return EmailVerificationResponse(message="Email уже подтверждён")
@@ -130,7 +251,7 @@ def verify_email(
 
     user.email_verified = True
     user.email_verification_code = None
-    db.commit()
+    await run_db(db, lambda s: s.commit())
 
     return EmailVerificationResponse(message="Email успешно подтверждён")
 
@@ -142,27 +263,19 @@ def verify_email(
 async def upload_avatar(
     file: UploadFile = File(...),
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ) -> AvatarUploadResponse:
     if file.content_type not in ALLOWED_TYPES:
         raise HTTPException(status_code=400, detail="Допустимы только PNG и JPEG")
+    if file.size is not None and file.size > AVATAR_MAX_BYTES:
+        raise avatar_too_large()
 
-    contents = await file.read()
-
-    try:
-        image = Image.open(io.BytesIO(contents))
-        if image.width > MAX_DIMENSION or image.height > MAX_DIMENSION:
-            raise HTTPException(status_code=400, detail="Изображение не должно превышать 400x400 пикселей")
-    except Exception:
-        raise HTTPException(status_code=400, detail="Файл не является корректным изображением")
-
-    filename = f"{user.id}_{file.filename}"
-    filepath = f"media/avatars/{filename}"
-
-    with open(filepath, "wb") as f:
-        f.write(contents)
+    #файл читается кусками с лимитом, проверка, уменьшение и запись вариантов — в пуле потоков
+    contents = await read_upload_limited(file)
+    digest = await run_in_threadpool(store_avatar, contents, AVATAR_DIR)
 
-    user.avatar_url = f"/media/avatars/{filename}"
-    db.commit()
+    avatar_url = f"/media/avatars/{avatar_variant_name(digest, DEFAULT_AVATAR_SIZE)}"
+    user.avatar_url = avatar_url
+    await run_db(db, lambda s: s.commit())
 
-    return AvatarUploadResponse(avatar_url=user.avatar_url)
\ No newline at end of file
+    return AvatarUploadResponse(avatar_url=avatar_url, avatar_urls=avatar_variant_urls(avatar_url))
@@ -0,0 +1,229 @@
+from collections import defaultdict
+from typing import Iterable, Optional
+from uuid import UUID
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import distinct_on, insert
+from sqlalchemy.orm import Session
+
+from backend.app.grading import LEVEL_ORDER, diagnose_level
+from backend.app.models import EnglishLevel, EnglishTestSession, Question, User, UserAnswer, UserProgressSummary
+
+
+def _correct_count():
+    return func.count(UserAnswer.id).filter(UserAnswer.is_correct.is_(True))
+
+
+def _lock_summaries(db: Session, user_ids: list[UUID]) -> list[UserProgressSummary]:
+    """
+    Строки сводок пользователей под SELECT ... FOR UPDATE (в порядке user_id); создаются при первом обращении.
+    Параллельные завершения тестов одного пользователя и пересборка сводок применяются по очереди
+    """
+    db.execute(
+        insert(UserProgressSummary).on_conflict_do_nothing(index_elements=[UserProgressSummary.user_id]),
+        [{"user_id": user_id, "tests_taken": 0, "best_scores": {}, "category_stats": {}} for user_id in user_ids],
+    )
+    return (
+        db.query(UserProgressSummary)
+        .filter(UserProgressSummary.user_id.in_(user_ids))
+        .order_by(UserProgressSummary.user_id)
+        .with_for_update()
+        .populate_existing()
+        .all()
+    )
+
+
+def _lock_summary(db: Session, user_id: UUID) -> UserProgressSummary:
+    [summary] = _lock_summaries(db, [user_id])
+    return summary
+
+
+def session_category_stats(db: Session, session_id: UUID) -> dict[str, dict]:
+    """
+    Правильные/все ответы сессии по категориям вопросов — один агрегирующий запрос по ответам этой сессии
+    """
+    rows = (
+        db.query(Question.category, _correct_count(), func.count(UserAnswer.id))
+        .join(Question, Question.id == UserAnswer.question_id)
+        .filter(UserAnswer.session_id == session_id)
+        .group_by(Question.category)
+    )
+    return {category.value: {"correct": correct, "total": total} for category, correct, total in rows}
+
+
+def session_answer_stats(db: Session, session_id: UUID) -> dict[tuple[str, str], dict]:
+    """
+    Правильные/все ответы сессии по (уровень, категория) вопроса — один агрегирующий запрос.
+    Из него сворачиваются и статистика по уровням для диагностики, и по категориям для сводки
+    """
+    rows = (
+        db.query(Question.level, Question.category, _correct_count(), func.count(UserAnswer.id))
+        .join(Question, Question.id == UserAnswer.question_id)
+        .filter(UserAnswer.session_id == session_id)
+        .group_by(Question.level, Question.category)
+    )
+    return {(level.value, category.value): {"correct": correct, "total": total} for level, category, correct, total in rows}
+
+
+def rollup_stats(answer_stats: dict[tuple[str, str], dict], by: str) -> dict[str, dict]:
+    """
+    Сворачивает session_answer_stats по уровню (by="level") или категории (by="category")
+    """
+    index = ("level", "category").index(by)
+    totals = defaultdict(lambda: {"correct": 0, "total": 0})
+    for group, stats in answer_stats.items():
+        totals[group[index]]["correct"] += stats["correct"]
+        totals[group[index]]["total"] += stats["total"]
+    return dict(totals)
+
+
+def record_completed_session(db: Session, session: EnglishTestSession, diagnosed_level: Optional[str] = None, category_stats: Optional[dict[str, dict]] = None) -> None:
+    """
+    Добавляет завершённую сессию в сводку пользователя. Вызывается в транзакции завершения
+    теста до commit и ровно один раз на сессию. Лучший результат считается только для тестов
+    конкретного уровня: у диагностики уровень unknown.
+    diagnosed_level сохраняется и в сессии — по нему сводку восстанавливает пересборка.
+    category_stats — уже посчитанная статистика сессии по категориям, иначе читается из базы
+    """
+    summary = _lock_summary(db, session.user_id)
+    summary.tests_taken += 1
+
+    level = EnglishLevel(session.level).value
+    if level in LEVEL_ORDER:
+        best_scores = dict(summary.best_scores)
+        best_scores[level] = max(best_scores.get(level, 0), session.score)
+        summary.best_scores = best_scores
+
+    if category_stats is None:
+        category_stats = session_category_stats(db, session.id)
+    merged = {category: dict(stats) for category, stats in summary.category_stats.items()}
+    for category, stats in category_stats.items():
+        totals = merged.setdefault(category, {"correct": 0, "total": 0})
+        totals["correct"] += stats["correct"]
+        totals["total"] += stats["total"]
+    summary.category_stats = merged
+
+    if diagnosed_level is not None:
+        session.diagnosed_level = EnglishLevel(diagnosed_level)
+        summary.last_diagnosed_level = session.diagnosed_level
+    summary.updated_at = func.now()
+
+
+def get_progress_summary(db: Session, user_id: UUID) -> dict:
+    """
+    Сводка прогресса для профиля — чтение одной строки user_progress_summaries
+    """
+    summary = db.get(UserProgressSummary, user_id)
+    category_stats = summary.category_stats if summary else {}
+    return {
+        "tests_taken": summary.tests_taken if summary else 0,
+        "last_diagnosed_level": summary.last_diagnosed_level.value if summary and summary.last_diagnosed_level else None,
+        "best_scores": summary.best_scores if summary else {},
+        "category_accuracy": {
+            category: {**stats, "accuracy": stats["correct"] / stats["total"] if stats["total"] else 0.0}
+            for category, stats in category_stats.items()
+        },
+        "updated_at": summary.updated_at if summary else None,
+    }
+
+
+def build_progress_summaries(db: Session, user_ids: Iterable[UUID]) -> list[dict]:
+    """
+    Считает сводки с нуля для набора пользователей набором агрегирующих запросов
+    (сессии, ответы по категориям, последняя диагностика). Уровень последней диагностики
+    берётся из сессии; для диагностик, завершённых до появления test_sessions.diagnosed_level, —
+    по статистике ответов по уровням вопросов
+    """
+    user_ids = list(user_ids)
+    summaries = {}
+
+    def summary_for(user_id) -> dict:
+        if user_id not in summaries:
+            summaries[user_id] = {
+                "user_id": user_id, "tests_taken": 0, "last_diagnosed_level": None,
+                "best_scores": {}, "category_stats": {},
+            }
+        return summaries[user_id]
+
+    completed = (EnglishTestSession.completed.is_(True), EnglishTestSession.user_id.in_(user_ids))
+
+    for user_id, level, taken, best in (
+        db.query(EnglishTestSession.user_id, EnglishTestSession.level, func.count(), func.max(EnglishTestSession.score))
+        .filter(*completed)
+        .group_by(EnglishTestSession.user_id, EnglishTestSession.level)
+    ):
+        summary = summary_for(user_id)
+        summary["tests_taken"] += taken
+        if level.value in LEVEL_ORDER:
+            summary["best_scores"][level.value] = best
+
+    for user_id, category, correct, total in (
+        db.query(EnglishTestSession.user_id, Question.category, _correct_count(), func.count(UserAnswer.id))
+        .join(UserAnswer, UserAnswer.session_id == EnglishTestSession.id)
+        .join(Question, Question.id == UserAnswer.question_id)
+        .filter(*completed)
+        .group_by(EnglishTestSession.user_id, Question.category)
+    ):
+        summary_for(user_id)["category_stats"][category.value] = {"correct": correct, "total": total}
+
+    #последняя завершённая диагностика каждого пользователя
+    legacy_diagnostics = []
+    for user_id, session_id, diagnosed_level in db.execute(
+        select(EnglishTestSession.user_id, EnglishTestSession.id, EnglishTestSession.diagnosed_level)
+        .where(*completed, EnglishTestSession.level == EnglishLevel.unknown)
+        .ext(distinct_on(EnglishTestSession.user_id))
+        .order_by(EnglishTestSession.user_id, EnglishTestSession.completed_at.desc().nulls_last())
+    ):
+        if diagnosed_level is None:
+            legacy_diagnostics.append(session_id)
+        else:
+            summary_for(user_id)["last_diagnosed_level"] = diagnosed_level
+
+    level_stats = defaultdict(dict)
+    if legacy_diagnostics:
+        for user_id, level, correct, total in (
+            db.query(EnglishTestSession.user_id, Question.level, _correct_count(), func.count(UserAnswer.id))
+            .join(UserAnswer, UserAnswer.session_id == EnglishTestSession.id)
+            .join(Question, Question.id == UserAnswer.question_id)
+            .filter(EnglishTestSession.id.in_(legacy_diagnostics))
+            .group_by(EnglishTestSession.user_id, Question.level)
+        ):
+            level_stats[user_id][level.value] = {"correct": correct, "total": total}
+    for user_id, stats in level_stats.items():
+        summary_for(user_id)["last_diagnosed_level"] = EnglishLevel(diagnose_level(stats))
+
+    return list(summaries.values())
+
+
+def rebuild_progress_summaries(db: Session, batch_size: int = 1000) -> int:
+    """
+    Пересобирает user_progress_summaries с нуля: пользователи обходятся батчами по id,
+    каждый батч — отдельная транзакция. Строки сводок батча блокируются до подсчёта, как при
+    завершении теста: тест, завершающийся во время пересборки, либо уже виден подсчёту,
+    либо добавится к сводке после коммита батча. Строки обновляются на месте (удалённую строку
+    не нашёл бы ожидающий её _lock_summary), у пользователей без тестов — нулевые сводки.
+    Возвращает число записанных сводок
+    """
+    written = 0
+    last_id = None
+    while True:
+        query = db.query(User.id)
+        if last_id is not None:
+            query = query.filter(User.id > last_id)
+        user_ids = [user_id for (user_id,) in query.order_by(User.id).limit(batch_size)]
+        if not user_ids:
+            return written
+
+        _lock_summaries(db, user_ids)
+        built = {summary["user_id"]: summary for summary in build_progress_summaries(db, user_ids)}
+        now = db.scalar(select(func.now()))
+        db.execute(update(UserProgressSummary), [
+            {
+                "user_id": user_id, "tests_taken": 0, "last_diagnosed_level": None,
+                "best_scores": {}, "category_stats": {}, **built.get(user_id, {}), "updated_at": now,
+            }
+            for user_id in user_ids
+        ])
+        db.commit()
+        written += len(user_ids)
+        last_id = user_ids[-1]
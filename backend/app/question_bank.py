@@ -0,0 +1,337 @@
+import asyncio
+import random
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from itertools import chain, count
+from types import MappingProxyType
+from typing import Iterable, Optional
+from uuid import UUID
+
+import orjson
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.util import await_only
+from sqlalchemy.util.concurrency import in_greenlet
+
+from backend.app.english_test_schemas import QuestionResponse
+from backend.app.grading import AnswerKey, compile_answer_key
+from backend.app.irt import ItemPool
+from backend.app.models import DragItem, DropTarget, EnglishLevel, Option, Question, QuestionCategory, QuestionType
+from backend.database.config import QUESTION_BANK_TTL
+
+
+#Неизменяемые снимки банка вопросов. Поля совпадают с ORM-моделями,
+#поэтому QuestionResponse.model_validate работает с ними так же, как с Question
+
+@dataclass(frozen=True)
+class OptionSnapshot:
+    id: UUID
+    text: str
+    is_correct: bool
+
+
+@dataclass(frozen=True)
+class DragItemSnapshot:
+    id: UUID
+    label: str
+    target_key: str
+
+
+@dataclass(frozen=True)
+class DropTargetSnapshot:
+    id: UUID
+    placeholder: str
+    target_key: str
+
+
+@dataclass(frozen=True)
+class QuestionSnapshot:
+    id: UUID
+    prompt: str
+    level: EnglishLevel
+    category: QuestionCategory
+    type: QuestionType
+    correct_answer: Optional[str] = None
+    difficulty: float = 0.0
+    discrimination: float = 1.0
+    options: tuple[OptionSnapshot, ...] = ()
+    drag_items: tuple[DragItemSnapshot, ...] = ()
+    drop_targets: tuple[DropTargetSnapshot, ...] = ()
+
+
+def encode_question(question: QuestionSnapshot) -> bytes:
+    """
+    JSON вопроса в том виде, в каком его отдают эндпоинты генерации тестов (QuestionResponse)
+    """
+    return orjson.dumps(QuestionResponse.model_validate(question).model_dump(mode="json"))
+
+
+class QuestionBank:
+    """
+    Снимок всех вопросов с вариантами ответов, проиндексированный по уровню и типу вопроса.
+    Ключи ответов и JSON вопросов готовятся один раз при загрузке снимка: вопросы в нём не меняются,
+    а любое изменение банка приводит к новому снимку.
+    version — номер инвалидации, на момент которой снимок загружен; generation — номер самой загрузки,
+    он растёт и при перечитывании по TTL, когда version не меняется
+    """
+
+    def __init__(self, questions: Iterable[QuestionSnapshot], version: int, generation: int = 0):
+        self.version = version
+        self.generation = generation
+        self.loaded_at = time.monotonic()
+
+        by_id = {}
+        by_level = defaultdict(list)
+        by_level_type = defaultdict(list)
+        for q in questions:
+            by_id[q.id] = q
+            by_level[q.level].append(q)
+            by_level_type[(q.level, q.type)].append(q)
+
+        self.questions = MappingProxyType(by_id)
+        self.by_level = MappingProxyType({lvl: tuple(qs) for lvl, qs in by_level.items()})
+        self.by_level_type = MappingProxyType({key: tuple(qs) for key, qs in by_level_type.items()})
+        self.answer_keys = MappingProxyType({qid: compile_answer_key(q) for qid, q in by_id.items()})
+        self.question_json = MappingProxyType({qid: encode_question(q) for qid, q in by_id.items()})
+        self.items = ItemPool(by_id, [q.discrimination for q in by_id.values()], [q.difficulty for q in by_id.values()])
+        #(id вопроса, порядок вариантов) -> (QuestionResponse, JSON); заполняется prepared_tests.render_form
+        self.rendered: dict = {}
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def get(self, question_id: UUID) -> Optional[QuestionSnapshot]:
+        return self.questions.get(question_id)
+
+    def level_questions(self, level, question_type: Optional[QuestionType] = None) -> tuple[QuestionSnapshot, ...]:
+        level = EnglishLevel(level)
+        if question_type is None:
+            return self.by_level.get(level, ())
+        return self.by_level_type.get((level, QuestionType(question_type)), ())
+
+    def sample(self, level, k: int, question_type: Optional[QuestionType] = None) -> list[QuestionSnapshot]:
+        """
+        Случайная выборка k вопросов уровня без обращения к базе данных
+        """
+        pool = self.level_questions(level, question_type)
+        return random.sample(pool, min(k, len(pool)))
+
+
+def load_question_children(db: Session, question_ids: Optional[Iterable[UUID]] = None) -> tuple[dict, dict, dict]:
+    """
+    Загружает варианты ответов, перетаскиваемые элементы и цели для набора вопросов —
+    ровно три запроса (IN-список) независимо от количества вопросов.
+    question_ids=None — для всего банка
+    """
+    if question_ids is not None:
+        question_ids = list(question_ids)
+
+    def _grouped(model, to_snapshot) -> dict:
+        grouped = defaultdict(list)
+        if question_ids is not None and not question_ids:
+            return grouped
+        query = db.query(model)
+        if question_ids is not None:
+            query = query.filter(model.question_id.in_(question_ids))
+        for row in query:
+            grouped[row.question_id].append(to_snapshot(row))
+        return grouped
+
+    options = _grouped(Option, lambda o: OptionSnapshot(id=o.id, text=o.text, is_correct=bool(o.is_correct)))
+    drag_items = _grouped(DragItem, lambda d: DragItemSnapshot(id=d.id, label=d.label, target_key=d.target_key))
+    drop_targets = _grouped(DropTarget, lambda t: DropTargetSnapshot(id=t.id, placeholder=t.placeholder, target_key=t.target_key))
+    return options, drag_items, drop_targets
+
+
+def load_questions(db: Session, question_ids: Optional[Iterable[UUID]] = None) -> list[QuestionSnapshot]:
+    """
+    Загружает вопросы вместе с дочерними элементами за четыре запроса.
+    Порядок результата совпадает с порядком question_ids
+    """
+    if question_ids is not None:
+        question_ids = list(question_ids)
+        if not question_ids:
+            return []
+
+    query = db.query(Question)
+    if question_ids is not None:
+        query = query.filter(Question.id.in_(question_ids))
+    rows = query.all()
+    options, drag_items, drop_targets = load_question_children(db, None if question_ids is None else [q.id for q in rows])
+
+    questions = {
+        q.id: QuestionSnapshot(
+            id=q.id,
+            prompt=q.prompt,
+            level=q.level,
+            category=q.category,
+            type=q.type,
+            correct_answer=q.correct_answer,
+            difficulty=q.difficulty,
+            discrimination=q.discrimination,
+            options=tuple(options.get(q.id, ())),
+            drag_items=tuple(drag_items.get(q.id, ())),
+            drop_targets=tuple(drop_targets.get(q.id, ())),
+        )
+        for q in rows
+    }
+    if question_ids is None:
+        return list(questions.values())
+    return [questions[qid] for qid in question_ids if qid in questions]
+
+
+_generations = count(1)
+
+
+def load_question_bank(db: Session, version: int = 0) -> QuestionBank:
+    """
+    Загружает весь банк вопросов четырьмя запросами (вопросы + три таблицы дочерних элементов).
+    Каждый снимок получает новое поколение
+    """
+    return QuestionBank(load_questions(db), version, next(_generations))
+
+
+_bank_lock = threading.Lock()
+_bank: Optional[QuestionBank] = None
+_bank_version = 0
+_bank_load: Optional["_BankLoad"] = None
+
+
+def invalidate_question_bank() -> None:
+    """
+    Помечает текущий снимок устаревшим, следующий вызов get_question_bank перечитает банк
+    """
+    global _bank_version
+    with _bank_lock:
+        _bank_version += 1
+
+
+def _is_fresh(bank: Optional[QuestionBank]) -> bool:
+    if bank is None or bank.version != _bank_version:
+        return False
+    return QUESTION_BANK_TTL <= 0 or time.monotonic() - bank.loaded_at < QUESTION_BANK_TTL
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class _BankLoad:
+    """
+    Идущая загрузка снимка банка: остальные вызовы к холодному банку ждут её, а не грузят банк сами
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self._futures: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def wait(self) -> None:
+        if not in_greenlet():
+            self.done.wait()
+            return
+        #асинхронный режим: run_sync выполняется в потоке event loop, ждать можно только future
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with _bank_lock:
+            if self.done.is_set():
+                return
+            self._futures.append((loop, future))
+        await_only(future)
+
+    def finish(self) -> None:
+        with _bank_lock:
+            self.done.set()
+            futures, self._futures = self._futures, []
+        for loop, future in futures:
+            loop.call_soon_threadsafe(_resolve, future)
+
+
+def get_question_bank(db: Session) -> QuestionBank:
+    """
+    Возвращает актуальный снимок банка вопросов, при необходимости перечитывая его из базы.
+    TTL нужен для изменений, сделанных другими процессами (например, seed_questions.py).
+    Банк перечитывает один вызов за раз: пока он грузит, остальные получают прежний снимок,
+    а если снимка ещё нет — ждут загрузку (в асинхронном режиме — не блокируя event loop)
+    """
+    global _bank, _bank_load
+    bank = _bank
+    if _is_fresh(bank):
+        return bank
+
+    with _bank_lock:
+        bank = _bank
+        if _is_fresh(bank):
+            return bank
+        loading_elsewhere = _bank_load is not None
+        if not loading_elsewhere:
+            _bank_load = _BankLoad()
+        load = _bank_load
+    if loading_elsewhere:
+        if bank is not None:
+            return bank
+        load.wait()
+        return get_question_bank(db)
+
+    try:
+        loaded = load_question_bank(db, _bank_version)
+        with _bank_lock:
+            _bank = loaded
+        return loaded
+    finally:
+        with _bank_lock:
+            _bank_load = None
+        load.finish()
+
+
+def get_questions(db: Session, question_ids: Iterable[UUID]) -> list[QuestionSnapshot]:
+    """
+    Возвращает снимки вопросов по ID в исходном порядке: из банка, а отсутствующие в нём
+    (например, добавленные другим процессом) — одним батчем через load_questions
+    """
+    question_ids = list(question_ids)
+    bank = get_question_bank(db)
+    found = {qid: bank.get(qid) for qid in question_ids}
+    missing = [qid for qid, q in found.items() if q is None]
+    if missing:
+        found.update((q.id, q) for q in load_questions(db, missing))
+    return [found[qid] for qid in question_ids if found.get(qid) is not None]
+
+
+def get_answer_keys(db: Session, question_ids: Iterable[UUID]) -> dict[UUID, AnswerKey]:
+    """
+    Скомпилированные ключи ответов для набора вопросов. На тёплом банке запросов к базе нет
+    """
+    question_ids = set(question_ids)
+    answer_keys = get_question_bank(db).answer_keys
+    keys = {qid: answer_keys[qid] for qid in question_ids if qid in answer_keys}
+    missing = question_ids - keys.keys()
+    if missing:
+        keys.update((q.id, compile_answer_key(q)) for q in load_questions(db, missing))
+    return keys
+
+
+#Хук инвалидации: любой коммит, который создаёт/меняет/удаляет вопросы или их дочерние
+#элементы через ORM, сбрасывает снимок. Массовые query(...).update() сюда не попадают —
+#после них нужно явно вызвать invalidate_question_bank()
+
+_BANK_MODELS = (Question, Option, DragItem, DropTarget)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_question_bank_changes(session, flush_context):
+    if any(isinstance(obj, _BANK_MODELS) for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info["question_bank_dirty"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_question_bank_on_commit(session):
+    if session.info.pop("question_bank_dirty", False):
+        invalidate_question_bank()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_question_bank_changes(session):
+    session.info.pop("question_bank_dirty", None)
@@ -0,0 +1,64 @@
+from abc import ABC, abstractmethod
+from typing import Collection
+from uuid import UUID
+
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+
+from backend.app.models import EnglishLevel, Question
+from backend.app.question_bank import get_question_bank
+from backend.database.config import QUESTION_SAMPLER
+
+
+class QuestionSampler(ABC):
+    """
+    Стратегия случайной выборки ID вопросов заданного уровня.
+    Вопросы из exclude попадают в выборку, только если остальных вопросов уровня меньше k
+    """
+    name = "base"
+
+    @abstractmethod
+    def sample_ids(self, db: Session, level, k: int, exclude: Collection[UUID] = ()) -> list[UUID]:
+        ...
+
+
+class BankSampler(QuestionSampler):
+    """
+    Выборка из закэшированного списка вопросов уровня (question_bank), запросов к базе нет.
+    Берёт k + len(exclude) вопросов, из которых не меньше k не исключены:
+    стоимость O(k + len(exclude)) и не зависит от размера банка
+    """
+    name = "bank"
+
+    def sample_ids(self, db: Session, level, k: int, exclude: Collection[UUID] = ()) -> list[UUID]:
+        candidates = [q.id for q in get_question_bank(db).sample(level, k + len(exclude))]
+        fresh = [qid for qid in candidates if qid not in exclude]
+        return (fresh + [qid for qid in candidates if qid in exclude])[:k]
+
+
+class RandomOrderSampler(QuestionSampler):
+    """
+    ORDER BY random() LIMIT k — сортирует все вопросы уровня на каждый вызов.
+    exclude отфильтровывается в самом запросе; второй запрос — только если неисключённых не хватило.
+    Оставлен как запасной вариант и как точка отсчёта для бенчмарка
+    """
+    name = "random"
+
+    def sample_ids(self, db: Session, level, k: int, exclude: Collection[UUID] = ()) -> list[UUID]:
+        query = db.query(Question.id).filter_by(level=EnglishLevel(level))
+        exclude = list(exclude)
+        fresh = query.filter(Question.id.not_in(exclude)) if exclude else query
+        ids = [row.id for row in fresh.order_by(func.random()).limit(k)]
+        if exclude and len(ids) < k:
+            ids += [row.id for row in query.filter(Question.id.in_(exclude)).order_by(func.random()).limit(k - len(ids))]
+        return ids
+
+
+SAMPLERS = {sampler.name: sampler for sampler in (BankSampler(), RandomOrderSampler())}
+
+
+def get_question_sampler(name: str = QUESTION_SAMPLER) -> QuestionSampler:
+    try:
+        return SAMPLERS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный сэмплер вопросов: {name}")
@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from itertools import chain
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from backend.app.models import EnglishLevel, User
+from backend.database.config import USER_CACHE_TTL
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """
+    Снимок пользователя для маршрутов, которые его только читают.
+    Хэш пароля и код подтверждения email сюда не попадают
+    """
+    id: UUID
+    username: str
+    email: Optional[str]
+    english_level: EnglishLevel
+    avatar_url: str
+    email_verified: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "CachedUser":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            english_level=user.english_level or EnglishLevel.unknown,
+            avatar_url=user.avatar_url,
+            email_verified=bool(user.email_verified),
+        )
+
+
+class UserCache:
+    """
+    Кэш пользователей по ID с коротким TTL. Изменения через ORM в этом процессе
+    сбрасывают запись сразу (см. хук ниже), изменения из других процессов видны через TTL
+    """
+
+    def __init__(self, ttl: float, max_size: int = 50_000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: UUID) -> Optional[CachedUser]:
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            return user
+
+    def put(self, user: User) -> CachedUser:
+        cached = CachedUser.from_user(user)
+        if self.ttl > 0:
+            with self._lock:
+                self._entries[cached.id] = (time.monotonic() + self.ttl, cached)
+                self._entries.move_to_end(cached.id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return cached
+
+    def invalidate(self, user_id: UUID) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+user_cache = UserCache(USER_CACHE_TTL)
+
+
+#Хук инвалидации: коммит, который меняет пользователя через ORM (уровень, email, аватар...),
+#сбрасывает его запись в кэше. После массовых UPDATE нужно вызвать user_cache.invalidate явно
+
+@event.listens_for(Session, "after_flush")
+def _track_user_changes(session, flush_context):
+    changed = {obj.id for obj in chain(session.dirty, session.deleted) if isinstance(obj, User)}
+    if changed:
+        session.info.setdefault("changed_user_ids", set()).update(changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_users_on_commit(session):
+    for user_id in session.info.pop("changed_user_ids", ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_user_changes(session):
+    session.info.pop("changed_user_ids", None)
@@ -0,0 +1,68 @@
+"""
+Пропускная способность отправки писем на локальный SMTP-сервер (aiosmtpd):
+новое соединение на каждое письмо (как send_email) против очереди EmailQueue
+с постоянными соединениями.
+
+    python -m backend.benchmarks.email_benchmark --messages 500 --workers 1 2 4
+"""
+import argparse
+import smtplib
+import socket
+import time
+
+from aiosmtpd.controller import Controller
+
+from backend.utils.email import EmailQueue, build_message
+
+
+class CountingHandler:
+    def __init__(self):
+        self.delivered = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.delivered += 1
+        return "250 OK"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch-size", type=int, default=20)
+    args = parser.parse_args()
+
+    handler = CountingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    connect = lambda: smtplib.SMTP(controller.hostname, controller.port, timeout=10)
+    try:
+        start = time.perf_counter()
+        for i in range(args.messages):
+            with connect() as server:
+                server.send_message(build_message(f"user{i}@example.com", "Код", "123456"))
+        elapsed = time.perf_counter() - start
+        print(f"{'connection per message':<26} {args.messages / elapsed:8.0f} msg/s")
+
+        for workers in args.workers:
+            queue = EmailQueue(workers=workers, batch_size=args.batch_size, max_size=args.messages, connect=connect)
+            start = time.perf_counter()
+            for i in range(args.messages):
+                queue.enqueue(f"user{i}@example.com", "Код", "123456")
+            enqueued = time.perf_counter() - start
+            queue.flush()
+            elapsed = time.perf_counter() - start
+            queue.close()
+            print(f"{f'queue, workers={workers}':<26} {queue.sent / elapsed:8.0f} msg/s  "
+                  f"enqueue {enqueued / args.messages * 1e6:.0f} µs/msg  failed={queue.failed}")
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
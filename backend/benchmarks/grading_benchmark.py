@@ -0,0 +1,54 @@
+"""
+Микробенчмарк оценки ответов по скомпилированным ключам (grading.grade_answers).
+
+    python -m backend.benchmarks.grading_benchmark
+"""
+import argparse
+import time
+import uuid
+
+from backend.app.english_test_schemas import AnswerPayload
+from backend.app.grading import compile_answer_key, grade_answers
+from backend.app.models import EnglishLevel, QuestionCategory, QuestionType
+from backend.app.question_bank import DragItemSnapshot, OptionSnapshot, QuestionSnapshot
+
+
+def synthetic_test(n_questions: int) -> tuple[dict, list[AnswerPayload]]:
+    session_id = uuid.uuid4()
+    keys, answers = {}, []
+    for i in range(n_questions):
+        qtype = list(QuestionType)[i % len(QuestionType)]
+        options = tuple(OptionSnapshot(uuid.uuid4(), f"o{j}", j == 0) for j in range(4))
+        drag_items = tuple(DragItemSnapshot(uuid.uuid4(), f"d{j}", str(j)) for j in range(3))
+        q = QuestionSnapshot(
+            id=uuid.uuid4(), prompt=f"q{i}", level=EnglishLevel.B1, category=QuestionCategory.grammar,
+            type=qtype, correct_answer="answer", options=options, drag_items=drag_items,
+        )
+        keys[q.id] = compile_answer_key(q)
+        answers.append(AnswerPayload(
+            session_id=session_id,
+            question_id=q.id,
+            selected_option_id=options[0].id,
+            answer_text=" Answer ",
+            match_pairs={d.id.hex: d.target_key for d in drag_items},
+        ))
+    return keys, answers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=30)
+    parser.add_argument("--iterations", type=int, default=10_000)
+    args = parser.parse_args()
+
+    keys, answers = synthetic_test(args.questions)
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        grade_answers(keys, answers)
+    elapsed = time.perf_counter() - start
+    print(f"{args.questions} answers: {elapsed / args.iterations * 1e6:.1f} µs per submission, "
+          f"{args.iterations / elapsed:.0f} submissions/s on one core")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Нагрузочный бенчмарк API: пропускная способность и p50/p99 при N параллельных клиентах.
+Запускается против работающего сервера, режимы сравниваются двумя запусками:
+
+    DB_ASYNC=false uvicorn backend.app.main:app --port 8000
+    python -m backend.benchmarks.load_benchmark --url http://localhost:8000
+
+    DB_ASYNC=true uvicorn backend.app.main:app --port 8000
+    python -m backend.benchmarks.load_benchmark --url http://localhost:8000
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+from backend.benchmarks.sampler_benchmark import percentile
+
+ENDPOINTS = {
+    "diagnostic": ("POST", "/test/generate-diagnostic-test"),
+    "profile": ("GET", "/profile/me"),
+}
+
+
+async def obtain_token(client: httpx.AsyncClient) -> str:
+    username = f"bench_{uuid.uuid4().hex[:8]}"
+    password = "benchpass123"
+    response = await client.post("/auth/register", json={
+        "username": username, "password": password, "password_repeat": password,
+    })
+    response.raise_for_status()
+    response = await client.post("/auth/token", data={"username": username, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def worker(client: httpx.AsyncClient, method: str, path: str, headers: dict, deadline: float,
+                 timings: list[float], errors: list[int]) -> None:
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.request(method, path, headers=headers)
+        timings.append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            errors.append(response.status_code)
+
+
+async def run(url: str, endpoint: str, concurrency: int, duration: float) -> None:
+    method, path = ENDPOINTS[endpoint]
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        headers = {"Authorization": f"Bearer {await obtain_token(client)}"}
+        timings, errors = [], []
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(
+            worker(client, method, path, headers, deadline, timings, errors) for _ in range(concurrency)
+        ))
+
+    print(f"{endpoint}: {len(timings) / duration:.1f} req/s, "
+          f"p50 {percentile(timings, 50):.1f} ms, p99 {percentile(timings, 99):.1f} ms, "
+          f"errors {len(errors)} / {len(timings)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="diagnostic")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=20.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.endpoint, args.concurrency, args.duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Пропускная способность входа (bcrypt verify) через пул процессов password_hashing
+в зависимости от числа процессов: входов в секунду всего и на одно ядро.
+
+    BCRYPT_ROUNDS=12 python -m backend.benchmarks.password_benchmark --logins 200
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from backend.utils.password_hashing import PasswordHasher, PasswordHasherBusy, hash_password
+
+
+async def run_logins(hasher: PasswordHasher, hashed: str, logins: int) -> tuple[float, int]:
+    """
+    Отправляет logins проверок пароля одновременно. Возвращает время и число отказов (429)
+    """
+    async def login() -> bool:
+        try:
+            return await hasher.verify("benchmark-password", hashed)
+        except PasswordHasherBusy:
+            return False
+
+    await hasher.run(os.getpid)  #прогрев: запуск процессов не входит в замер
+    start = time.perf_counter()
+    results = await asyncio.gather(*(login() for _ in range(logins)))
+    return time.perf_counter() - start, results.count(False)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    hashed = hash_password("benchmark-password")
+    print(f"hash: {hashed[:7]}... cores: {os.cpu_count()}")
+    workers = 1
+    while workers <= args.max_workers:
+        hasher = PasswordHasher(workers=workers, max_pending=args.logins)
+        try:
+            elapsed, rejected = asyncio.run(run_logins(hasher, hashed, args.logins))
+        finally:
+            hasher.shutdown()
+        rate = (args.logins - rejected) / elapsed
+        print(f"workers={workers:<3} {rate:8.1f} logins/s  {rate / workers:6.1f} logins/s per core  rejected={rejected}")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Бенчмарк стратегий выборки вопросов: p50/p99 задержки выборки 5 вопросов уровня
+в зависимости от размера банка.
+
+    python -m backend.benchmarks.sampler_benchmark          # BankSampler, без базы
+    python -m backend.benchmarks.sampler_benchmark --db     # + ORDER BY random() на настроенной базе,
+                                                            #   синтетические вопросы откатываются в конце
+"""
+import argparse
+import time
+import uuid
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from backend.app.models import EnglishLevel, Question, QuestionCategory, QuestionType
+from backend.app.question_bank import QuestionBank, QuestionSnapshot
+from backend.app.question_sampler import RandomOrderSampler
+
+LEVELS = [EnglishLevel.A1, EnglishLevel.A2, EnglishLevel.B1, EnglishLevel.B2, EnglishLevel.C1, EnglishLevel.C2]
+SAMPLE_SIZE = 5
+
+
+def percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def measure(fn, iterations: int) -> tuple[float, float]:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return percentile(timings, 50), percentile(timings, 99)
+
+
+def synthetic_rows(n: int) -> list[dict]:
+    return [
+        {
+            "id": uuid.uuid4(),
+            "prompt": f"Synthetic question {i}",
+            "level": LEVELS[i % len(LEVELS)],
+            "category": QuestionCategory.grammar,
+            "type": QuestionType.open_text,
+            "correct_answer": "answer",
+        }
+        for i in range(n)
+    ]
+
+
+def bench_bank(sizes: list[int], iterations: int) -> None:
+    print(f"{'sampler':<8} {'bank size':>10} {'p50, ms':>10} {'p99, ms':>10}")
+    for n in sizes:
+        bank = QuestionBank((QuestionSnapshot(**row) for row in synthetic_rows(n)), version=0)
+        p50, p99 = measure(lambda: bank.sample(EnglishLevel.B1, SAMPLE_SIZE), iterations)
+        print(f"{'bank':<8} {n:>10} {p50:>10.4f} {p99:>10.4f}")
+
+
+def bench_db(sizes: list[int], iterations: int) -> None:
+    from backend.database.database import engine
+
+    sampler = RandomOrderSampler()
+    connection = engine.connect()
+    transaction = connection.begin()
+    db = Session(bind=connection)
+    try:
+        inserted = 0
+        for n in sorted(sizes):
+            rows = synthetic_rows(n - inserted)
+            if rows:
+                db.execute(insert(Question), rows)
+            inserted = n
+            db.execute(Question.__table__.select().limit(1))  #прогрев после вставки
+            p50, p99 = measure(lambda: sampler.sample_ids(db, EnglishLevel.B1, SAMPLE_SIZE), iterations)
+            print(f"{'random':<8} {n:>10} {p50:>10.4f} {p99:>10.4f}")
+    finally:
+        db.close()
+        transaction.rollback()
+        connection.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 50_000, 100_000])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--db", action="store_true", help="также замерить ORDER BY random() на базе")
+    args = parser.parse_args()
+
+    bench_bank(args.sizes, args.iterations)
+    if args.db:
+        bench_db(args.sizes, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Время сериализации ответа генерации теста: прежний путь (QuestionResponse.model_validate
+на каждый вопрос, затем валидация по response_model и кодирование всего GenerateTestResponse,
+как это делает FastAPI) против сборки тела из готовых JSON-фрагментов вопросов.
+
+    python -m backend.benchmarks.serialization_benchmark --questions 15 30
+"""
+import argparse
+import time
+import uuid
+
+from pydantic import TypeAdapter
+
+from backend.app.english_test import encode_test_response
+from backend.app.english_test_schemas import GenerateTestResponse, QuestionResponse
+from backend.app.models import EnglishLevel, QuestionCategory, QuestionType
+from backend.app.prepared_tests import PreparedTest
+from backend.app.question_bank import DragItemSnapshot, DropTargetSnapshot, OptionSnapshot, QuestionBank, QuestionSnapshot
+
+
+def synthetic_bank(n_questions: int) -> QuestionBank:
+    questions = []
+    for i in range(n_questions):
+        qtype = list(QuestionType)[i % len(QuestionType)]
+        questions.append(QuestionSnapshot(
+            id=uuid.uuid4(), prompt=f"Synthetic question {i} with a realistic amount of text",
+            level=EnglishLevel.B1, category=QuestionCategory.grammar, type=qtype, correct_answer="answer",
+            options=tuple(OptionSnapshot(uuid.uuid4(), f"option {j}", j == 0) for j in range(4)),
+            drag_items=tuple(DragItemSnapshot(uuid.uuid4(), f"item {j}", str(j)) for j in range(3)),
+            drop_targets=tuple(DropTargetSnapshot(uuid.uuid4(), f"target {j}", str(j)) for j in range(3)),
+        ))
+    return QuestionBank(questions, version=0)
+
+
+RESPONSE_ADAPTER = TypeAdapter(GenerateTestResponse)  #то же, что FastAPI делает с response_model
+
+
+def model_path(questions: list[QuestionSnapshot]) -> bytes:
+    response = GenerateTestResponse(
+        session_id=str(uuid.uuid4()),
+        questions=[QuestionResponse.model_validate(q) for q in questions],
+    )
+    validated = RESPONSE_ADAPTER.validate_python(response, from_attributes=True)
+    return RESPONSE_ADAPTER.dump_json(validated)
+
+
+def fragment_path(bank: QuestionBank, questions: list[QuestionSnapshot]) -> bytes:
+    form = PreparedTest(
+        blueprint=(),
+        bank_generation=bank.generation,
+        question_ids=frozenset(q.id for q in questions),
+        questions=(),
+        questions_json=b"[" + b",".join(bank.question_json[q.id] for q in questions) + b"]",
+    )
+    response = GenerateTestResponse.model_construct(session_id=str(uuid.uuid4()), target_levels=None, questions=[])
+    response._questions_json = form.questions_json
+    return encode_test_response(response)
+
+
+def measure(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, nargs="+", default=[15, 30])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'questions':>9} {'model, µs':>10} {'fragments, µs':>14} {'speedup':>8}")
+    for n in args.questions:
+        bank = synthetic_bank(n)
+        questions = list(bank.questions.values())
+        model_us = measure(lambda: model_path(questions), args.iterations)
+        fragment_us = measure(lambda: fragment_path(bank, questions), args.iterations)
+        print(f"{n:>9} {model_us:>10.1f} {fragment_us:>14.1f} {model_us / fragment_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
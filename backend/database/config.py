@@ -8,12 +8,45 @@ DB_USER = os.getenv("DB_USER")
 DB_NAME = os.getenv("DB_NAME")
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")  #asyncpg + AsyncSession вместо psycopg2
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))  #постоянные соединения на процесс (uvicorn worker)
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))  #дополнительные соединения сверх pool_size под пиковую нагрузку
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  #секунды ожидания свободного соединения
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  #секунды жизни соединения, -1 — без ограничения
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
 SECRET_KEY = os.getenv("SECRET_KEY")
 REDIS_URL = os.getenv("REDIS_URL")
+TOKEN_REVOCATION_CACHE_TTL = float(os.getenv("TOKEN_REVOCATION_CACHE_TTL", "0"))  #секунды кэша «токен не отозван» в процессе, 0 — выключен
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  #стоимость bcrypt; при изменении хэши пересчитываются при следующем входе
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))  #число процессов uvicorn (как у uvicorn --workers)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "0"))  #процессы bcrypt в КАЖДОМ uvicorn worker, 0 — ядра / WEB_CONCURRENCY
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "0"))  #очередь хэширования, сверх неё — 429; 0 — 8 на процесс
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))  #секунды кэша пользователей для маршрутов только на чтение, 0 — выключен
 SMTP_SERVER = os.getenv("SMTP_SERVER")    
 SMTP_PORT =  os.getenv("SMTP_PORT")
 SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "10"))  #секунды на сетевые операции SMTP
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))  #простаивающее соединение закрывается через столько секунд
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "2"))  #потоки очереди писем = постоянные SMTP-соединения
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "20"))  #писем за один проход потока
+EMAIL_MAX_RETRIES = int(os.getenv("EMAIL_MAX_RETRIES", "5"))
+EMAIL_RETRY_BACKOFF = float(os.getenv("EMAIL_RETRY_BACKOFF", "2"))  #секунды до первого повтора, дальше удваивается
+EMAIL_QUEUE_SIZE = int(os.getenv("EMAIL_QUEUE_SIZE", "10000"))  #сверх этого enqueue выбрасывает EmailQueueFull
+AVATAR_MAX_BYTES = int(os.getenv("AVATAR_MAX_BYTES", str(2 * 1024 * 1024)))  #лимит размера загружаемого аватара
 
+QUESTION_BANK_TTL = int(os.getenv("QUESTION_BANK_TTL", "300"))  #секунды, 0 — без ограничения по времени
+QUESTION_SAMPLER = os.getenv("QUESTION_SAMPLER", "bank")  #bank | random
+TEST_FORM_POOL_SIZE = int(os.getenv("TEST_FORM_POOL_SIZE", "20"))  #готовых форм на каждый состав теста, 0 — пул выключен
+TEST_FORM_POOL_LOW_WATER = int(os.getenv("TEST_FORM_POOL_LOW_WATER", "5"))  #ниже этого фоновый поток пополняет пул
+TEST_FORM_RECENT_QUESTIONS = int(os.getenv("TEST_FORM_RECENT_QUESTIONS", "100"))  #сколько последних вопросов пользователя не повторять; учёт в памяти каждого uvicorn worker, между процессами не гарантируется
+ADAPTIVE_SE_TARGET = float(os.getenv("ADAPTIVE_SE_TARGET", "0.5"))  #адаптивная диагностика завершается, когда стандартная ошибка θ ниже
+ADAPTIVE_MIN_ITEMS = int(os.getenv("ADAPTIVE_MIN_ITEMS", "5"))
+ADAPTIVE_MAX_ITEMS = int(os.getenv("ADAPTIVE_MAX_ITEMS", "30"))
+ADAPTIVE_BATCH_SIZE = int(os.getenv("ADAPTIVE_BATCH_SIZE", "1"))  #вопросов за один шаг
+ADAPTIVE_RANDOMESQUE = int(os.getenv("ADAPTIVE_RANDOMESQUE", "3"))  #выбор случайно из стольких самых информативных
 
 
+
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))  #секунды хранения ответа на запрос с Idempotency-Key
@@ -1,17 +1,70 @@
+from typing import Callable, TypeVar, Union
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
 
-from backend.database.config import DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME
+from backend.database.config import (
+    DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME, DB_ASYNC,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+)
+from backend.database.pool_stats import InstrumentedAsyncQueuePool, InstrumentedQueuePool, pool_status
 
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-engine = create_engine(DATABASE_URL)
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+POOL_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+engine = create_engine(DATABASE_URL, poolclass=InstrumentedQueuePool, **POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False,bind=engine)
 Base = declarative_base()
 
-def get_db():
+#Асинхронный режим (DB_ASYNC=true): движок на asyncpg создаётся только если он включён,
+#чтобы синхронный режим не требовал asyncpg
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, poolclass=InstrumentedAsyncQueuePool, **POOL_OPTIONS
+) if DB_ASYNC else None
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False) if DB_ASYNC else None
+
+DbSession = Union[AsyncSession, Session]
+T = TypeVar("T")
+
+
+def get_pool_status() -> dict:
+    status = {"sync": pool_status(engine, "sync")}
+    if async_engine is not None:
+        status["async"] = pool_status(async_engine, "async")
+    return status
+
+
+def get_sync_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+get_db = get_async_db if DB_ASYNC else get_sync_db
+
+
+async def run_db(db: DbSession, fn: Callable[..., T]) -> T:
+    """
+    Выполняет синхронную функцию fn(session), не блокируя event loop:
+    в асинхронном режиме — через AsyncSession.run_sync (asyncpg, без потоков),
+    в синхронном — в пуле потоков Starlette
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn)
+    return await run_in_threadpool(fn, db)
@@ -0,0 +1,95 @@
+import threading
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+#границы бакетов гистограммы времени получения соединения из пула, секунды
+CHECKOUT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class PoolStats:
+    """
+    Накопительная статистика получения соединений из пула: количество, суммарное и
+    максимальное время ожидания, таймауты и гистограмма задержки checkout
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = CHECKOUT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.bucket_counts = [0] * (len(buckets) + 1)  #последний бакет — +Inf
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def observe_checkout(self, seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.bucket_counts[i] += 1
+                    break
+            else:
+                self.bucket_counts[-1] += 1
+
+    def observe_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            cumulative, histogram = 0, {}
+            for bound, count in zip(self.buckets + (float("inf"),), self.bucket_counts):
+                cumulative += count
+                histogram["+Inf" if bound == float("inf") else str(bound)] = cumulative
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "checkout_latency_histogram": histogram,
+            }
+
+
+POOL_STATS = {"sync": PoolStats(), "async": PoolStats()}
+
+
+class _InstrumentedPoolMixin:
+    stats_key = "sync"
+
+    def connect(self):
+        stats = POOL_STATS[self.stats_key]
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            stats.observe_timeout()
+            raise
+        stats.observe_checkout(time.perf_counter() - start)
+        return connection
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    stats_key = "sync"
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    stats_key = "async"
+
+
+def pool_status(engine, stats_key: str) -> dict:
+    """
+    Текущее состояние пула движка плюс накопленная статистика ожидания
+    """
+    pool = engine.sync_engine.pool if isinstance(engine, AsyncEngine) else engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        **POOL_STATS[stats_key].snapshot(),
+    }
@@ -1,13 +1,34 @@
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import MagicMock
+import asyncio
+import io
+import os
+import time
+import uuid
+from sqlalchemy import event
 from backend.app.main import app
 import backend.app.auth as auth_module
+from backend.app.models import EnglishLevel, User
+from backend.database.database import engine
+from backend.utils.migrate_token_blacklist import migrate_token_blacklist
+from backend.utils.password_hashing import PasswordHasher, PasswordHasherBusy
+import backend.utils.email_verification as email_verification_module
+from backend.utils.email import EmailQueueFull
+import backend.app.profile as profile_module
+from backend.app.avatars import DEFAULT_AVATAR_FILE, avatar_variant_url, collect_orphan_avatars, store_avatar
+from backend.app.media import MediaFiles
+from datetime import timedelta
+from fastapi import FastAPI, HTTPException
+from jose import jwt
+from PIL import Image
 
 # 🔌 Отключаем Redis
 auth_module.redis_client = MagicMock()
 auth_module.redis_client.sismember.return_value = False
 auth_module.redis_client.sadd.return_value = True
+auth_module.redis_client.exists.return_value = 0
+auth_module.redis_client.set.return_value = True
 
 client = TestClient(app)
 
@@ -80,3 +101,305 @@ def test_verify_blacklisted_token():
     response = client.get(f"/auth/verify-token/{access_token}")
     assert response.status_code == 403
     assert "Токен отозван" in response.json()["detail"]
+
+def test_verify_token_revoked_by_jti_key(monkeypatch):
+    monkeypatch.setattr(auth_module, "redis_client", MagicMock(**{"exists.return_value": 1}))
+    token = auth_module.create_access_token({"sub": "user"})
+    with pytest.raises(HTTPException) as exc:
+        auth_module.verify_token(token)
+    assert exc.value.detail == "Токен отозван"
+
+def test_revoke_token_uses_jti_key_with_remaining_ttl():
+    redis_mock = MagicMock(**{"exists.return_value": 0, "sismember.return_value": 0})
+    auth_module.redis_client, previous = redis_mock, auth_module.redis_client
+    try:
+        token = auth_module.create_access_token({"sub": "user"}, expires_delta=timedelta(minutes=10))
+        jti = jwt.get_unverified_claims(token)["jti"]
+
+        assert auth_module.revoke_token(token) is True
+        key, value = redis_mock.set.call_args.args
+        assert key == f"revoked_token:{jti}"
+        assert 590 <= redis_mock.set.call_args.kwargs["ex"] <= 600
+
+        expired = auth_module.create_access_token({"sub": "user"}, expires_delta=timedelta(seconds=-1))
+        assert auth_module.revoke_token(expired) is False
+        assert auth_module.revoke_token("not-a-jwt") is False
+        assert redis_mock.set.call_count == 1
+    finally:
+        auth_module.redis_client = previous
+
+def test_revocation_cache_skips_redis_until_revoked(monkeypatch):
+    redis_mock = MagicMock(**{"exists.return_value": 0, "sismember.return_value": 0})
+    monkeypatch.setattr(auth_module, "redis_client", redis_mock)
+    monkeypatch.setattr(auth_module, "revocation_cache", auth_module.RevocationCache(ttl=60))
+    token = auth_module.create_access_token({"sub": "user"})
+
+    assert auth_module.verify_token(token) == "user"
+    assert auth_module.verify_token(token) == "user"
+    assert redis_mock.exists.call_count == 1
+
+    auth_module.revoke_token(token)
+    redis_mock.exists.return_value = 1
+    with pytest.raises(HTTPException) as exc:
+        auth_module.verify_token(token)
+    assert exc.value.detail == "Токен отозван"
+
+def test_token_in_legacy_blacklist_is_revoked(monkeypatch):
+    token = auth_module.create_access_token({"sub": "user"})
+    redis_mock = MagicMock(**{"exists.return_value": 0, "sismember.side_effect": lambda key, member: key == "token_blacklist" and member == token})
+    monkeypatch.setattr(auth_module, "redis_client", redis_mock)
+    monkeypatch.setattr(auth_module, "revocation_cache", auth_module.RevocationCache(ttl=60))
+
+    with pytest.raises(HTTPException) as exc:
+        auth_module.verify_token(token)
+    assert exc.value.detail == "Токен отозван"
+    assert auth_module.verify_token(auth_module.create_access_token({"sub": "user"})) == "user"
+
+def test_legacy_blacklist_skipped_after_migration(monkeypatch):
+    redis_mock = MagicMock(**{"exists.return_value": 0, "scard.return_value": 0})
+    monkeypatch.setattr(auth_module, "redis_client", redis_mock)
+    monkeypatch.setattr(auth_module, "legacy_blacklist", auth_module.LegacyBlacklist())
+
+    for _ in range(3):
+        assert auth_module.verify_token(auth_module.create_access_token({"sub": "user"})) == "user"
+    redis_mock.sismember.assert_not_called()
+    assert redis_mock.scard.call_count == 1
+
+def test_migrate_token_blacklist(monkeypatch):
+    live = auth_module.create_access_token({"sub": "user"})
+    expired = auth_module.create_access_token({"sub": "user"}, expires_delta=timedelta(seconds=-1))
+    redis_mock = MagicMock()
+    redis_mock.sscan_iter.return_value = [live.encode(), expired.encode()]
+    monkeypatch.setattr(auth_module, "redis_client", redis_mock)
+
+    assert migrate_token_blacklist() == {"migrated": 1, "dropped": 1}
+    redis_mock.set.assert_called_once()
+    redis_mock.delete.assert_called_once_with("token_blacklist")
+
+
+@pytest.fixture
+def profile_user(db):
+    user = User(username=f"user_{uuid.uuid4().hex[:6]}", hashed_password="test_password", english_level=EnglishLevel.A2)
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+def test_profile_me_is_served_from_user_cache(db, profile_user, monkeypatch):
+    monkeypatch.setattr(auth_module, "redis_client", MagicMock(**{"exists.return_value": 0, "sismember.return_value": 0}))
+    headers = {"Authorization": f"Bearer {auth_module.create_access_token({'sub': str(profile_user.id)})}"}
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert client.get("/profile/me", headers=headers).json()["english_level"] == "A2"
+        statements.clear()
+        assert client.get("/profile/me", headers=headers).json()["english_level"] == "A2"
+        assert statements == []
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    # изменение пользователя через ORM сбрасывает запись в кэше
+    profile_user.english_level = EnglishLevel.B1
+    db.commit()
+    assert client.get("/profile/me", headers=headers).json()["english_level"] == "B1"
+
+def test_revoked_token_is_rejected_by_auth_dependencies(profile_user, monkeypatch):
+    monkeypatch.setattr(auth_module, "redis_client", MagicMock(**{"exists.return_value": 1}))
+    headers = {"Authorization": f"Bearer {auth_module.create_access_token({'sub': str(profile_user.id)})}"}
+    for response in (
+        client.get("/profile/me", headers=headers),
+        client.post("/profile/update-email", headers=headers, json={"email": "new@example.com"}),
+    ):
+        assert response.status_code == 403
+        assert response.json()["detail"] == "Токен отозван"
+
+def test_password_hasher_rejects_work_beyond_queue_limit():
+    hasher = PasswordHasher(workers=1, max_pending=1)
+
+    async def scenario():
+        slow = asyncio.ensure_future(hasher.run(time.sleep, 0.2))
+        await asyncio.sleep(0)
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.run(time.sleep, 0)
+        await slow
+        assert hasher.pending == 0
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        hasher.shutdown()
+
+def test_password_hasher_splits_cores_between_uvicorn_workers(monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    assert PasswordHasher().workers == 8
+    assert PasswordHasher(web_concurrency=4).workers == 2
+    assert PasswordHasher(web_concurrency=16).workers == 1
+    assert PasswordHasher(workers=3, web_concurrency=4).workers == 3
+
+def test_register_returns_429_when_hashing_pool_is_saturated(monkeypatch):
+    hasher = PasswordHasher(workers=1, max_pending=1)
+    hasher._pending = hasher.max_pending
+    monkeypatch.setattr(auth_module, "password_hasher", hasher)
+    response = client.post("/auth/register", json={
+        "username": f"user_{uuid.uuid4().hex[:6]}", "password": "validpass123", "password_repeat": "validpass123"
+    })
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+
+class FakePasswordHasher:
+    async def verify(self, plain_password, hashed_password):
+        return plain_password == "secret"
+
+    async def hash(self, password):
+        return "rehashed"
+
+    def needs_update(self, hashed_password):
+        return hashed_password != "rehashed"
+
+def test_login_rehashes_password_when_cost_changes(db, profile_user, monkeypatch):
+    monkeypatch.setattr(auth_module, "password_hasher", FakePasswordHasher())
+    assert asyncio.run(auth_module.authenticate_user(db, profile_user.username, "wrong")) is None
+
+    user = asyncio.run(auth_module.authenticate_user(db, profile_user.username, "secret"))
+    assert user.id == profile_user.id
+    db.expire_all()
+    assert db.get(User, profile_user.id).hashed_password == "rehashed"
+
+def test_update_email_enqueues_verification_code(profile_user, monkeypatch):
+    monkeypatch.setattr(auth_module, "redis_client", MagicMock(**{"exists.return_value": 0, "sismember.return_value": 0}))
+    queue = MagicMock()
+    monkeypatch.setattr(email_verification_module, "email_queue", queue)
+    headers = {"Authorization": f"Bearer {auth_module.create_access_token({'sub': str(profile_user.id)})}"}
+    email = f"{uuid.uuid4().hex[:8]}@example.com"
+
+    response = client.post("/profile/update-email", headers=headers, json={"email": email})
+    assert response.status_code == 200
+    queue.enqueue.assert_called_once()
+    assert queue.enqueue.call_args.kwargs["to_email"] == email
+
+def test_update_email_keeps_old_email_when_queue_is_full(db, profile_user, monkeypatch):
+    monkeypatch.setattr(auth_module, "redis_client", MagicMock(**{"exists.return_value": 0, "sismember.return_value": 0}))
+    queue = MagicMock(**{"enqueue.side_effect": EmailQueueFull()})
+    monkeypatch.setattr(email_verification_module, "email_queue", queue)
+    headers = {"Authorization": f"Bearer {auth_module.create_access_token({'sub': str(profile_user.id)})}"}
+    before = (profile_user.email, profile_user.email_verified, profile_user.email_verification_code)
+
+    response = client.post("/profile/update-email", headers=headers, json={"email": f"{uuid.uuid4().hex[:8]}@example.com"})
+    assert response.status_code == 503
+    db.expire_all()
+    user = db.get(User, profile_user.id)
+    assert (user.email, user.email_verified, user.email_verification_code) == before
+
+def image_bytes(width: int, height: int, image_format: str = "PNG", **save_options) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buffer, format=image_format, **save_options)
+    return buffer.getvalue()
+
+@pytest.fixture
+def avatar_client(profile_user, monkeypatch, tmp_path):
+    monkeypatch.setattr(auth_module, "redis_client", MagicMock(**{"exists.return_value": 0, "sismember.return_value": 0}))
+    monkeypatch.setattr(profile_module, "AVATAR_DIR", str(tmp_path))
+    headers = {"Authorization": f"Bearer {auth_module.create_access_token({'sub': str(profile_user.id)})}"}
+    return lambda content, content_type="image/png": client.post(
+        "/profile/upload-avatar", headers=headers, files={"file": ("a.png", content, content_type)}
+    )
+
+def test_upload_avatar_stores_webp_variants(avatar_client, profile_user, tmp_path):
+    exif = Image.Exif()
+    exif[0x010F] = "Camera"
+    contents = image_bytes(1000, 600, "JPEG", exif=exif.tobytes())
+    response = avatar_client(contents, "image/jpeg")
+    assert response.status_code == 200
+    avatar_url = response.json()["avatar_url"]
+    assert avatar_url.endswith("-400.webp")
+    assert response.json()["avatar_urls"]["64"] == avatar_url.replace("-400.webp", "-64.webp")
+
+    files = sorted(tmp_path.iterdir(), key=lambda p: p.stat().st_size)
+    assert len(files) == 3  # временных файлов не остаётся
+    for path, size in zip(files, (64, 128, 400)):
+        with Image.open(path) as variant:
+            assert (variant.format, variant.size) == ("WEBP", (size, size))
+            assert not variant.getexif()
+    assert files[-1].stat().st_size < len(contents)
+
+    #та же картинка даёт те же имена файлов
+    assert avatar_client(contents, "image/jpeg").json()["avatar_url"] == avatar_url
+    assert len(list(tmp_path.iterdir())) == 3
+
+def test_upload_avatar_does_not_upscale_small_images(avatar_client, tmp_path):
+    assert avatar_client(image_bytes(100, 150)).status_code == 200
+    sizes = set()
+    for path in tmp_path.iterdir():
+        with Image.open(path) as variant:
+            sizes.add(variant.size)
+    assert sizes == {(64, 64), (100, 100)}
+
+def test_upload_avatar_rejects_oversized_dimensions_and_garbage(avatar_client):
+    response = avatar_client(image_bytes(5000, 10))
+    assert response.status_code == 400
+    assert "4096x4096" in response.json()["detail"]
+    assert avatar_client(b"not an image").json()["detail"] == "Файл не является корректным изображением"
+
+def test_avatar_variant_url_keeps_legacy_urls():
+    assert avatar_variant_url("/media/avatars/default_user.png", 64) == "/media/avatars/default_user.png"
+    digest = "0123456789abcdef" * 2
+    assert avatar_variant_url(f"/media/avatars/{digest}-400.webp", 64) == f"/media/avatars/{digest}-64.webp"
+
+def test_upload_avatar_rejects_too_large_body(avatar_client):
+    response = avatar_client(b"\0" * (profile_module.AVATAR_MAX_BYTES + 128 * 1024))
+    assert response.status_code == 413
+
+def test_media_files_cache_headers(tmp_path):
+    digest = "0123456789abcdef" * 2
+    (tmp_path / f"{digest}-64.webp").write_bytes(b"webp")
+    (tmp_path / "legacy.png").write_bytes(b"png")
+    media_app = FastAPI()
+    media_app.mount("/media", MediaFiles(directory=str(tmp_path), in_memory={"default.png": b"default"}))
+    media_client = TestClient(media_app)
+
+    response = media_client.get(f"/media/{digest}-64.webp")
+    assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert response.headers["etag"] == f'"{digest}-64"'
+    assert media_client.get(f"/media/{digest}-64.webp", headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+    legacy = media_client.get("/media/legacy.png")
+    assert legacy.headers["cache-control"] == "no-cache"
+    assert media_client.get("/media/legacy.png", headers={"If-None-Match": legacy.headers["etag"]}).status_code == 304
+
+    (tmp_path / "default.png").write_bytes(b"stale file on disk")
+    default = media_client.get("/media/default.png")
+    assert (default.status_code, default.content, default.headers["content-type"]) == (200, b"default", "image/png")
+    assert media_client.get("/media/default.png", headers={"If-None-Match": default.headers["etag"]}).status_code == 304
+
+def test_default_avatar_is_served(profile_user):
+    response = client.get(profile_user.avatar_url)
+    assert response.status_code == 200
+    assert Image.open(io.BytesIO(response.content)).format == "PNG"
+
+def test_store_avatar_refreshes_existing_variants(db, tmp_path):
+    contents = image_bytes(500, 500)
+    digest = store_avatar(contents, str(tmp_path))
+    for path in tmp_path.iterdir():
+        os.utime(path, (time.time() - 7200,) * 2)
+
+    #повторная загрузка того же файла: варианты-сироты не должны попасть под сборку до коммита avatar_url
+    assert store_avatar(contents, str(tmp_path)) == digest
+    assert collect_orphan_avatars(db, str(tmp_path), grace_seconds=3600) == []
+
+def test_collect_orphan_avatars(db, profile_user, tmp_path):
+    kept, orphan, fresh = "a" * 32, "b" * 32, "c" * 32
+    profile_user.avatar_url = f"/media/avatars/{kept}-400.webp"
+    db.commit()
+    names = [f"{digest}-{size}.webp" for digest in (kept, orphan, fresh) for size in (64, 400)]
+    names += [f"{uuid.uuid4()}_photo.png", ".tmp-abc", DEFAULT_AVATAR_FILE]
+    for name in names:
+        (tmp_path / name).write_bytes(b"x")
+        if not name.startswith(fresh):
+            os.utime(tmp_path / name, (time.time() - 7200,) * 2)
+
+    removed = collect_orphan_avatars(db, str(tmp_path), grace_seconds=3600)
+    assert sorted(removed) == sorted([f"{orphan}-64.webp", f"{orphan}-400.webp", names[6], ".tmp-abc"])
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        [f"{kept}-64.webp", f"{kept}-400.webp", f"{fresh}-64.webp", f"{fresh}-400.webp", DEFAULT_AVATAR_FILE]
+    )
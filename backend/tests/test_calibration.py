@@ -0,0 +1,131 @@
+import uuid
+from datetime import timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import delete, func, select, update
+
+from backend.app import calibration as calibration_module
+from backend.app.calibration import AnswerSpill, ItemCalibrator, calibrate_items, fit_items
+from backend.app.irt import probability
+from backend.app.models import EnglishLevel, EnglishTestSession, ItemCalibrationRun, Question, User, UserAnswer
+from backend.database.database import SessionLocal
+
+
+def simulate(n_sessions: int, n_items: int, items_per_session: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    a = rng.uniform(0.6, 2.0, n_items)
+    b = rng.normal(0.0, 1.2, n_items)
+    theta = rng.normal(size=n_sessions)
+    items = np.stack([rng.choice(n_items, items_per_session, replace=False) for _ in range(n_sessions)])
+    correct = rng.random(items.shape) < probability(theta[:, None], a[items], b[items])
+    return a, b, items, correct
+
+
+def chunked(items: np.ndarray, correct: np.ndarray, sessions_per_chunk: int):
+    def read_chunks():
+        for first in range(0, len(items), sessions_per_chunk):
+            block = slice(first, first + sessions_per_chunk)
+            session_idx = np.repeat(np.arange(len(items[block])), items.shape[1])
+            yield session_idx, items[block].ravel(), correct[block].ravel()
+    return read_chunks
+
+
+def test_fit_items_recovers_simulated_parameters():
+    a, b, items, correct = simulate(n_sessions=4000, n_items=30, items_per_session=15)
+    calibrator = ItemCalibrator(np.ones(30), np.zeros(30))
+    report = fit_items(calibrator, chunked(items, correct, sessions_per_chunk=300))
+
+    assert report.converged
+    assert (report.sessions, report.answers) == (4000, 60000)
+    assert report.answers_per_item.sum() == 60000
+    assert np.abs(calibrator.b - b).mean() < 0.1
+    assert np.abs(calibrator.a - a).mean() < 0.15
+
+
+def test_incremental_fit_close_to_full_fit():
+    a, b, items, correct = simulate(n_sessions=4000, n_items=20, items_per_session=10, seed=1)
+    full = ItemCalibrator(np.ones(20), np.zeros(20))
+    fit_items(full, chunked(items, correct, 500))
+
+    first = ItemCalibrator(np.ones(20), np.zeros(20))
+    report = fit_items(first, chunked(items[:2000], correct[:2000], 500))
+    second = ItemCalibrator(first.a, first.b, answers_seen=report.answers_per_item)
+    fit_items(second, chunked(items[2000:], correct[2000:], 500))
+
+    assert np.abs(second.b - full.b).max() < 0.2
+    assert np.abs(second.a - full.a).max() < 0.3
+
+
+def test_fit_items_without_answers_keeps_parameters():
+    calibrator = ItemCalibrator(np.full(3, 1.3), np.array([-1.0, 0.0, 1.0]))
+    report = fit_items(calibrator, lambda: iter(()))
+    assert (report.iterations, report.answers) == (0, 0)
+    assert np.allclose(calibrator.b, [-1.0, 0.0, 1.0]) and np.allclose(calibrator.a, 1.3)
+
+
+def test_answer_spill_replays_chunks():
+    chunks = [
+        (np.array([0, 0, 1]), np.array([2, 0, 1]), np.array([True, False, True])),
+        (np.array([], dtype=np.intp), np.array([], dtype=np.intp), np.array([], dtype=bool)),
+        (np.array([0]), np.array([1]), np.array([False])),
+    ]
+    with AnswerSpill(iter(chunks)) as spill:
+        for _ in range(2):
+            replayed = list(spill.chunks())
+            assert len(replayed) == len(chunks)
+            for got, expected in zip(replayed, chunks):
+                for got_array, expected_array in zip(got, expected):
+                    assert np.array_equal(got_array, expected_array)
+
+    with AnswerSpill(iter(())) as spill:
+        assert list(spill.chunks()) == []
+
+
+@pytest.fixture
+def restore_question_parameters():
+    with SessionLocal() as db:
+        saved = db.execute(select(Question.id, Question.difficulty, Question.discrimination, Question.calibration_answers)).all()
+        runs_before = set(db.scalars(select(ItemCalibrationRun.id)))
+    yield
+    with SessionLocal() as db:
+        db.execute(update(Question), [row._asdict() for row in saved])
+        db.execute(delete(ItemCalibrationRun).where(ItemCalibrationRun.id.not_in(runs_before)))
+        db.commit()
+
+
+def test_calibrate_items_processes_only_answers_since_last_run(restore_question_parameters, monkeypatch):
+    with SessionLocal() as db:
+        now = db.scalar(select(func.now()))
+        questions = db.execute(select(Question.id, Question.difficulty).where(Question.level.in_([EnglishLevel.A1, EnglishLevel.C2]))).all()
+        #отметка «прошлого запуска»: всё, что завершено до неё, уже учтено
+        db.add(ItemCalibrationRun(
+            started_at=now, finished_at=now, watermark=now - timedelta(seconds=1), sessions=0, answers=0,
+            items_updated=0, iterations=0, converged=True, duration_seconds=0,
+        ))
+        user = User(username=f"user_{uuid.uuid4().hex[:6]}", email=f"user_{uuid.uuid4().hex[:6]}@example.com", hashed_password="x")
+        db.add(user)
+        db.flush()
+        for _ in range(20):
+            session = EnglishTestSession(user_id=user.id, level=EnglishLevel.B1, score=0, completed=True, completed_at=now)
+            db.add(session)
+            db.flush()
+            #лёгкие вопросы решены, трудные — нет
+            db.add_all(UserAnswer(session_id=session.id, question_id=q.id, is_correct=q.difficulty < 0) for q in questions)
+        db.commit()
+
+        streams = []
+        stream_answer_chunks = calibration_module.stream_answer_chunks
+        monkeypatch.setattr(calibration_module, "stream_answer_chunks", lambda *args: streams.append(args) or stream_answer_chunks(*args))
+        run, report = calibrate_items(db, chunk_size=7, lag=timedelta(0))
+        assert report.iterations > 1 and len(streams) == 1  #ответы читаются и сортируются один раз за запуск
+        assert (run.sessions, run.answers, run.items_updated) == (20, 20 * len(questions), len(questions))
+        assert run.converged and run.watermark >= now
+
+        calibrated = dict(db.execute(select(Question.id, Question.difficulty).where(Question.id.in_([q.id for q in questions]))).all())
+        for q in questions:
+            assert calibrated[q.id] < q.difficulty if q.difficulty < 0 else calibrated[q.id] > q.difficulty
+
+        repeat, _ = calibrate_items(db, lag=timedelta(0))
+        assert (repeat.sessions, repeat.answers, repeat.items_updated) == (0, 0, 0)
+        assert repeat.watermark >= run.watermark
@@ -0,0 +1,122 @@
+import smtplib
+import socket
+import threading
+from collections import Counter
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from backend.utils.email import EmailQueue, EmailQueueFull
+
+
+class RecordingHandler:
+    """
+    Локальный SMTP-сервер для тестов: считает подключения (EHLO) и принятые письма,
+    первые temporary_failures попыток каждому получателю отвечает 451, адресам из rejected — 550
+    """
+
+    def __init__(self, temporary_failures: int = 0, rejected: tuple = ()):
+        self.temporary_failures = temporary_failures
+        self.rejected = rejected
+        self.attempts = Counter()
+        self.delivered = []
+        self.sessions = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.sessions += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        recipient = envelope.rcpt_tos[0]
+        self.attempts[recipient] += 1
+        if recipient in self.rejected:
+            return "550 mailbox unavailable"
+        if self.attempts[recipient] <= self.temporary_failures:
+            return "451 try again later"
+        self.delivered.append(recipient)
+        return "250 OK"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    servers = []
+
+    def start(**handler_options):
+        handler = RecordingHandler(**handler_options)
+        controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+        controller.start()
+        servers.append(controller)
+        return handler, lambda: smtplib.SMTP(controller.hostname, controller.port, timeout=5)
+
+    yield start
+    for controller in servers:
+        controller.stop()
+
+
+def test_email_queue_reuses_persistent_connections(smtp_server):
+    handler, connect = smtp_server()
+    queue = EmailQueue(workers=2, batch_size=10, connect=connect)
+    for i in range(50):
+        queue.enqueue(f"user{i}@example.com", "Код", "123456")
+
+    assert queue.flush(timeout=10)
+    queue.close(timeout=5)
+    assert sorted(handler.delivered) == sorted(f"user{i}@example.com" for i in range(50))
+    assert queue.sent == 50
+    assert handler.sessions <= 2
+
+
+def test_email_queue_retries_temporary_failures_with_backoff(smtp_server):
+    handler, connect = smtp_server(temporary_failures=2, rejected=("bad@example.com",))
+    queue = EmailQueue(workers=1, retry_backoff=0.01, max_retries=3, connect=connect)
+    queue.enqueue("user@example.com", "Код", "123456")
+    queue.enqueue("bad@example.com", "Код", "123456")
+
+    assert queue.flush(timeout=10)
+    queue.close(timeout=5)
+    assert handler.delivered == ["user@example.com"]
+    assert handler.attempts["user@example.com"] == 3
+    assert handler.attempts["bad@example.com"] == 1  # 5xx не повторяется
+    assert (queue.sent, queue.failed) == (1, 1)
+
+
+def test_email_queue_retries_when_server_is_unreachable():
+    def connect():
+        raise ConnectionRefusedError()
+
+    queue = EmailQueue(workers=1, retry_backoff=0.01, max_retries=2, max_size=1, connect=connect)
+    queue.enqueue("user@example.com", "Код", "123456")
+    with pytest.raises(EmailQueueFull):
+        queue.enqueue("other@example.com", "Код", "123456")
+
+    assert queue.flush(timeout=10)
+    queue.close(timeout=5)
+    assert (queue.sent, queue.failed) == (0, 1)
+
+
+def test_email_queue_stays_closed_while_worker_is_running():
+    release = threading.Event()
+
+    def connect():
+        release.wait(10)
+        raise ConnectionRefusedError()
+
+    queue = EmailQueue(workers=1, retry_backoff=0.01, max_retries=1, connect=connect)
+    queue.enqueue("user@example.com", "Код", "123456")
+    queue.close(timeout=0.1)
+    with pytest.raises(RuntimeError):
+        queue.enqueue("other@example.com", "Код", "123456")
+
+    release.set()
+    queue.close(timeout=5)
+    queue.enqueue("other@example.com", "Код", "123456")
+    assert queue.flush(timeout=10)
+    queue.close(timeout=5)
+    assert queue.failed == 2
@@ -1,7 +1,20 @@
+import asyncio
+import json
+import threading
+import time
 import uuid
 import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
 from sqlalchemy.orm import Session
-from backend.database.database import SessionLocal
+from fastapi.testclient import TestClient
+from backend.database.database import SessionLocal, engine
+import backend.app.auth as auth_module
+import backend.app.english_test as english_test_module
+import backend.app.prepared_tests as prepared_tests_module
+import backend.app.question_bank as question_bank_module
+from backend.app.prepared_tests import PreparedTestPool, apply_item_order, pack_item_orders, unpack_item_orders
+from backend.app.main import app
 from backend.app.english_test import (
     select_english_level,
     generate_level_progression_test,
@@ -18,9 +31,39 @@ from backend.app.models import (
     LevelUpgradeRequest
 )
 from backend.app.english_test_schemas import (
+    GenerateTestResponse,
     SelectLevelRequest,
     SubmitAnswersRequest
 )
+from backend.app.models import QuestionCategory
+from backend.app.question_bank import (
+    QuestionBank,
+    QuestionSnapshot,
+    get_question_bank,
+    invalidate_question_bank,
+    load_questions
+)
+from backend.app.question_sampler import QuestionSampler, get_question_sampler
+from backend.app.profile import load_test_history, load_test_session_detail
+from backend.app.progress import build_progress_summaries, get_progress_summary, rebuild_progress_summaries, record_completed_session
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+from backend.app.grading import compile_answer_key, grade_answers
+from backend.app.english_test_schemas import AnswerPayload
+from backend.app.question_bank import DragItemSnapshot, OptionSnapshot
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)
 
 # Fixtures
 @pytest.fixture
@@ -43,7 +86,7 @@ def test_user(db: Session):
 # Tests
 def test_select_level(db, test_user):
     payload = SelectLevelRequest(level=EnglishLevel.B2)
-    response = select_english_level(payload, user=test_user, db=db)
+    response = asyncio.run(select_english_level(payload, user=test_user, db=db))
     assert response["level"] == "B2"
     assert test_user.english_level == EnglishLevel.B2
 
@@ -144,6 +187,92 @@ def test_submit_diagnostic_all_types(db, test_user):
     updated_user = db.get(User, test_user.id)
     assert updated_user.english_level.value == response.diagnosed_level
 
+def test_submit_diagnostic_constant_query_count(db):
+    questions = db.query(Question).all()
+    counts = []
+    for n_answers in (3, len(questions)):
+        user = User(username=f"user_{uuid.uuid4().hex[:6]}", hashed_password="test_password", english_level=EnglishLevel.unknown)
+        session_id = uuid.uuid4()
+        db.add(user)
+        db.flush()
+        db.add(EnglishTestSession(id=session_id, user_id=user.id, level=EnglishLevel.unknown, score=0, completed=False))
+        db.flush()
+        db.add_all(UserAnswer(session_id=session_id, question_id=q.id, is_correct=q.level in (EnglishLevel.A1, EnglishLevel.A2)) for q in questions[:n_answers])
+        db.commit()
+        user_id = user.id
+
+        with count_queries() as statements:
+            response = submit_diagnostic(session_id, db)
+        counts.append(len([s for s in statements if not s.startswith("SAVEPOINT")]))
+
+        session = db.get(EnglishTestSession, session_id)
+        expected_score = sum(1 for q in questions[:n_answers] if q.level in (EnglishLevel.A1, EnglishLevel.A2))
+        assert (session.completed, session.score) == (True, expected_score)
+        assert db.get(User, user_id).english_level.value == response.diagnosed_level
+        assert get_progress_summary(db, user_id)["tests_taken"] == 1
+
+    assert response.diagnosed_level == "A2"
+    assert counts[0] == counts[1] <= 7
+
+def test_submit_diagnostic_without_answers(db, test_user):
+    session = EnglishTestSession(user_id=test_user.id, level=EnglishLevel.unknown, score=0, completed=False)
+    db.add(session)
+    db.commit()
+    with pytest.raises(HTTPException) as exc:
+        submit_diagnostic(session.id, db)
+    assert exc.value.status_code == 400
+
+def run_while_session_locked(session_id, finish, workers=1, answer=None):
+    """
+    Держит сессию FOR SHARE (как запись ответов) и запускает завершение теста в потоках;
+    блокировка снимается коммитом после старта потоков
+    """
+    holder = SessionLocal()
+    holder.query(EnglishTestSession).filter_by(id=session_id).with_for_update(read=True).one()
+    if answer is not None:
+        holder.add(answer)
+        holder.flush()
+
+    def _finish():
+        with SessionLocal() as worker_db:
+            finish(session_id, worker_db)
+
+    threads = [threading.Thread(target=_finish) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.3)
+    holder.commit()
+    holder.close()
+    for thread in threads:
+        thread.join(timeout=10)
+
+def test_submit_diagnostic_counts_answers_committed_while_waiting_for_lock(db, test_user):
+    questions = db.query(Question).filter_by(type=QuestionType.open_text).limit(2).all()
+    session = EnglishTestSession(user_id=test_user.id, level=EnglishLevel.unknown, score=0, completed=False)
+    db.add(session)
+    db.flush()
+    db.add(UserAnswer(session_id=session.id, question_id=questions[0].id, answer_text="x", is_correct=True))
+    db.commit()
+
+    late_answer = UserAnswer(session_id=session.id, question_id=questions[1].id, answer_text="x", is_correct=True)
+    run_while_session_locked(session.id, submit_diagnostic, answer=late_answer)
+
+    db.expire_all()
+    assert db.get(EnglishTestSession, session.id).score == 2
+
+def test_concurrent_upgrade_submissions_record_session_once(db, test_user):
+    test_user.english_level = EnglishLevel.B1
+    session = EnglishTestSession(user_id=test_user.id, level=EnglishLevel.B2, score=0, completed=False)
+    db.add(session)
+    db.flush()
+    for q in db.query(Question).filter_by(level=EnglishLevel.B2.value).limit(3):
+        db.add(UserAnswer(session_id=session.id, question_id=q.id, is_correct=False))
+    db.commit()
+
+    run_while_session_locked(session.id, evaluate_upgrade_test, workers=2)
+
+    assert get_progress_summary(db, test_user.id)["tests_taken"] == 1
+
 def test_evaluate_upgrade_test_success(db, test_user):
     test_user.english_level = EnglishLevel.B1
     db.commit()
@@ -185,3 +314,640 @@ def test_evaluate_upgrade_test_failure(db, test_user):
     assert response.diagnosed_level == EnglishLevel.B1.value
     updated_user = db.get(User, test_user.id)
     assert updated_user.english_level.value == EnglishLevel.B1.value
+
+def test_question_bank_sample_by_level_and_type():
+    snapshots = [
+        QuestionSnapshot(
+            id=uuid.uuid4(),
+            prompt=f"q{i}",
+            level=lvl,
+            category=QuestionCategory.grammar,
+            type=qtype
+        )
+        for i, (lvl, qtype) in enumerate(
+            [(EnglishLevel.A1, QuestionType.open_text)] * 4
+            + [(EnglishLevel.A1, QuestionType.multiple_choice)] * 3
+            + [(EnglishLevel.B2, QuestionType.open_text)] * 2
+        )
+    ]
+    bank = QuestionBank(snapshots, version=1)
+
+    assert len(bank) == 9
+    sample = bank.sample("A1", 5)
+    assert len(sample) == 5
+    assert len(set(q.id for q in sample)) == 5
+    assert all(q.level == EnglishLevel.A1 for q in sample)
+    assert len(bank.sample(EnglishLevel.B2, 5)) == 2
+    assert bank.sample("C2", 5) == []
+    mc = bank.sample("A1", 10, QuestionType.multiple_choice)
+    assert len(mc) == 3
+    assert all(q.type == QuestionType.multiple_choice for q in mc)
+
+def test_question_bank_invalidated_on_question_commit(db):
+    bank = get_question_bank(db)
+    assert get_question_bank(db) is bank
+
+    question = Question(
+        prompt="Cache invalidation check",
+        level=EnglishLevel.A1,
+        category=QuestionCategory.vocabulary,
+        type=QuestionType.open_text,
+        correct_answer="ok"
+    )
+    db.add(question)
+    db.commit()
+    try:
+        refreshed = get_question_bank(db)
+        assert refreshed is not bank
+        assert refreshed.get(question.id).correct_answer == "ok"
+    finally:
+        db.delete(question)
+        db.commit()
+    assert get_question_bank(db).get(question.id) is None
+
+def test_load_questions_constant_query_count(db):
+    all_ids = [q.id for q in db.query(Question.id).all()]
+    assert len(all_ids) > 1
+
+    with count_queries() as one:
+        loaded_one = load_questions(db, all_ids[:1])
+    with count_queries() as many:
+        loaded_many = load_questions(db, all_ids)
+
+    assert len(loaded_one) == 1
+    assert [q.id for q in loaded_many] == all_ids
+    assert len(one) == len(many) == 4
+
+@pytest.mark.parametrize("warm_bank", [False, True])
+def test_generators_query_count_is_bounded(db, test_user, warm_bank, monkeypatch):
+    monkeypatch.setattr(prepared_tests_module, "get_question_sampler", lambda: get_question_sampler("bank"))
+    test_user.english_level = EnglishLevel.B1
+    db.commit()
+    if warm_bank:
+        get_question_bank(db)
+    else:
+        invalidate_question_bank()
+
+    # вставка сессии + (при холодном кэше) 4 запроса на загрузку банка,
+    # вне зависимости от того, сколько вопросов попало в тест
+    bound = 4 if warm_bank else 8
+    with count_queries() as statements:
+        result = generate_diagnostic_test(test_user.id, db)
+    assert len(result.questions) >= 6
+    assert len(statements) <= bound
+
+    with count_queries() as statements:
+        generate_level_progression_test(test_user.id, db)
+    assert len(statements) <= 4
+
+    with count_queries() as statements:
+        generate_upgrade_test(test_user.id, db)
+    assert len(statements) <= 5
+
+def test_prepared_test_pool_avoids_recent_questions_and_stale_bank(db, test_user):
+    blueprint = ((EnglishLevel.B1, 2),)
+    pool = PreparedTestPool(size=4, low_water=2, recent_questions=100)
+    assert pool.refill(db, [blueprint]) == 4
+    forms = list(pool._forms[blueprint])
+    assert len({form.question_ids for form in forms}) == 4
+
+    seen = set()
+    for _ in range(3):
+        form = pool.take(db, blueprint, test_user.id)
+        assert len(form.question_ids) == 2
+        assert seen.isdisjoint(form.question_ids)
+        assert {q.level for q in form.questions} == {"B1"}
+        seen |= form.question_ids
+    assert pool.hits >= 1 and pool.hits + pool.misses == 3
+    assert pool.available(blueprint) == 4 - pool.hits
+
+    invalidate_question_bank()
+    pool.take(db, blueprint, uuid.uuid4())
+    assert pool.available(blueprint) == 0  #формы старой версии банка отброшены
+
+def test_prepared_test_pool_drops_forms_after_ttl_reload(db, test_user, monkeypatch):
+    blueprint = ((EnglishLevel.B1, 2),)
+    pool = PreparedTestPool(size=3, low_water=0, recent_questions=0)
+    pool.refill(db, [blueprint])
+    bank = get_question_bank(db)
+
+    #снимок устарел по TTL: банк перечитывается с той же version, но с новым поколением
+    monkeypatch.setattr(question_bank_module, "QUESTION_BANK_TTL", 1)
+    monkeypatch.setattr(bank, "loaded_at", time.monotonic() - 2)
+    pool.take(db, blueprint, test_user.id)
+    reloaded = get_question_bank(db)
+    assert reloaded is not bank and reloaded.version == bank.version
+    assert reloaded.generation > bank.generation
+    assert pool.available(blueprint) == 0
+
+def test_generate_takes_prepared_form_without_extra_queries(db, test_user, monkeypatch):
+    pool = PreparedTestPool(size=2, low_water=1)
+    monkeypatch.setattr(english_test_module, "prepared_test_pool", pool)
+    pool.refill(db, [english_test_module.diagnostic_blueprint()])
+    user_id = test_user.id
+
+    with count_queries() as statements:
+        result = generate_diagnostic_test(user_id, db)
+    assert pool.hits == 1
+    assert len(statements) == 1  #только INSERT сессии
+    assert db.get(EnglishTestSession, uuid.UUID(result.session_id)).user_id == user_id
+
+def test_prepared_test_pool_producer_refills_in_background(db, test_user):
+    blueprint = ((EnglishLevel.A2, 2),)
+    pool = PreparedTestPool(size=3, low_water=2)
+    pool.start([blueprint])
+    try:
+        deadline = time.monotonic() + 5
+        while pool.available(blueprint) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert pool.available(blueprint) == 3
+        pool.take(db, blueprint, uuid.uuid4())
+        pool.take(db, blueprint, uuid.uuid4())
+        deadline = time.monotonic() + 5
+        while pool.available(blueprint) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert pool.available(blueprint) == 3
+    finally:
+        pool.close(5)
+
+def test_pre_encoded_test_response_matches_model_serialization(db, test_user):
+    result = generate_diagnostic_test(test_user.id, db)
+    body = english_test_module.encode_test_response(result)
+    expected = GenerateTestResponse.model_validate(result.model_dump()).model_dump(mode="json")
+    assert json.loads(body) == expected
+    assert json.loads(GenerateTestResponse.model_validate(result.model_dump()).model_dump_json()) == expected
+
+def test_cold_question_bank_loaded_once_without_blocking_event_loop(monkeypatch):
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from backend.database.database import ASYNC_DATABASE_URL, run_db
+
+    loads = []
+    original_load = question_bank_module.load_question_bank
+    monkeypatch.setattr(question_bank_module, "load_question_bank", lambda db, version: loads.append(version) or original_load(db, version))
+    monkeypatch.setattr(question_bank_module, "_bank", None)
+
+    async def scenario():
+        async_engine = create_async_engine(ASYNC_DATABASE_URL)
+        try:
+            async with AsyncSession(async_engine) as first, AsyncSession(async_engine) as second:
+                return await asyncio.gather(run_db(first, get_question_bank), run_db(second, get_question_bank))
+        finally:
+            await async_engine.dispose()
+
+    results = []
+    #run_sync выполняет загрузку в потоке event loop: при блокировке loop встаёт навсегда, поэтому сценарий — в отдельном потоке
+    worker = threading.Thread(target=lambda: results.append(asyncio.run(scenario())), daemon=True)
+    worker.start()
+    worker.join(timeout=20)
+    assert not worker.is_alive(), "event loop заблокирован загрузкой банка вопросов"
+    first_bank, second_bank = results[0]
+    assert first_bank is second_bank and len(first_bank) > 0
+    assert len(loads) == 1
+
+def test_stale_question_bank_served_while_one_caller_reloads(db, monkeypatch):
+    stale = get_question_bank(db)
+    started, release = threading.Event(), threading.Event()
+    original_load = question_bank_module.load_question_bank
+
+    def slow_load(load_db, version):
+        started.set()
+        release.wait(10)
+        return original_load(load_db, version)
+
+    monkeypatch.setattr(question_bank_module, "load_question_bank", slow_load)
+    invalidate_question_bank()
+    reloaded = []
+
+    def _reload():
+        with SessionLocal() as loader_db:
+            reloaded.append(get_question_bank(loader_db))
+
+    loader = threading.Thread(target=_reload)
+    loader.start()
+    assert started.wait(10)
+    assert get_question_bank(db) is stale  #второй вызов не грузит банк сам
+    release.set()
+    loader.join(timeout=10)
+    assert get_question_bank(db) is reloaded[0] is not stale
+
+def test_question_json_rebuilt_with_bank(db):
+    question = db.query(Question).filter_by(level=EnglishLevel.A1).first()
+    original_prompt = question.prompt
+    assert json.loads(get_question_bank(db).question_json[question.id])["prompt"] == original_prompt
+    try:
+        question.prompt = "Changed prompt"
+        db.commit()
+        assert json.loads(get_question_bank(db).question_json[question.id])["prompt"] == "Changed prompt"
+    finally:
+        question.prompt = original_prompt
+        db.commit()
+
+def test_item_orders_pack_roundtrip_and_apply():
+    orders = [((2, 0, 1), ()), ((), ()), ((), (1, 0))]
+    packed = pack_item_orders(orders)
+    assert len(packed) == 11
+    assert unpack_item_orders(packed) == orders
+
+    options = tuple(OptionSnapshot(uuid.UUID(int=i), f"option {i}", i == 0) for i in range(3))
+    question = QuestionSnapshot(id=uuid.uuid4(), prompt="q", level=EnglishLevel.A1, category=QuestionCategory.grammar, type=QuestionType.multiple_choice, options=tuple(reversed(options)))
+    #индексы — в порядке id, а не в порядке загрузки банка
+    assert [o.text for o in apply_item_order(question, orders[0]).options] == ["option 2", "option 0", "option 1"]
+    assert apply_item_order(question, ((1, 0), ())) is question  #вариантов стало больше — порядок не применяется
+
+def test_render_form_encodes_each_question_order_once(db, monkeypatch):
+    bank = get_question_bank(db)
+    questions = [q for q in bank.questions.values() if q.options][:3]
+    orders = [prepared_tests_module.shuffled_order(q) for q in questions]
+    first = prepared_tests_module.render_form(bank, questions, orders)
+
+    encoded = []
+    monkeypatch.setattr(prepared_tests_module, "encode_question", lambda q: encoded.append(q) or question_bank_module.encode_question(q))
+    assert prepared_tests_module.render_form(bank, questions, orders) == first
+    assert encoded == []
+
+    reversed_order = (tuple(reversed(range(len(questions[0].options)))), ())
+    bank.rendered.pop((questions[0].id, reversed_order), None)
+    rendered, questions_json = prepared_tests_module.render_form(bank, questions[:1], [reversed_order])
+    assert len(encoded) == 1
+    assert json.loads(questions_json)[0]["options"] == [o.model_dump(mode="json") for o in rendered[0].options]
+
+def test_resume_test_session_rebuilds_issued_form(db, test_user):
+    result = generate_diagnostic_test(test_user.id, db)
+    session_id = uuid.UUID(result.session_id)
+    issued = json.loads(english_test_module.encode_test_response(result))["questions"]
+    question = next(q for q in result.questions if q.type == "open_text")
+    submit_answer(SubmitAnswersRequest(answers=[open_text_answer(session_id, db.get(Question, question.id), True)]).answers, db)
+
+    user_id = test_user.id
+    invalidate_question_bank()  #банк перечитывается: порядок вариантов не должен зависеть от порядка загрузки
+    with count_queries() as statements:
+        resumed = english_test_module.resume_test_session(user_id, session_id, db)
+    body = json.loads(english_test_module.encode_test_response(resumed))
+    assert body["questions"] == issued
+    assert body["answered_question_ids"] == [str(question.id)]
+    assert [q.model_dump(mode="json") for q in resumed.questions] == issued
+    assert len([s for s in statements if not s.startswith("SAVEPOINT")]) <= 2 + 4  #сессия, ответы и загрузка банка
+
+    with pytest.raises(HTTPException) as exc:
+        english_test_module.resume_test_session(uuid.uuid4(), session_id, db)
+    assert exc.value.status_code == 404
+    submit_diagnostic(session_id, db)
+    with pytest.raises(HTTPException) as exc:
+        english_test_module.resume_test_session(user_id, session_id, db)
+    assert exc.value.status_code == 400
+
+def answer_adaptive_questions(db, step, know_levels):
+    answers = []
+    for q in step.questions:
+        question = db.get(Question, q.id)
+        knows = q.level in know_levels
+        if question.type == QuestionType.multiple_choice:
+            option = next(o for o in db.query(Option).filter_by(question_id=q.id) if bool(o.is_correct) == knows)
+            answers.append(AnswerPayload(session_id=step.session_id, question_id=q.id, selected_option_id=option.id))
+        elif question.type == QuestionType.open_text:
+            answers.append(AnswerPayload(session_id=step.session_id, question_id=q.id, answer_text=question.correct_answer if knows else "wrong"))
+        else:
+            items = db.query(DragItem).filter_by(question_id=q.id).all()
+            answers.append(AnswerPayload(
+                session_id=step.session_id, question_id=q.id,
+                match_pairs={item.id.hex: item.target_key if knows else "wrong" for item in items},
+            ))
+    return answers
+
+def test_adaptive_diagnostic_converges_and_updates_level(db, test_user, monkeypatch):
+    monkeypatch.setattr(english_test_module, "ADAPTIVE_SE_TARGET", 0.6)
+    user_id = test_user.id
+    step = english_test_module.start_adaptive_diagnostic(user_id, db)
+    assert (step.finished, step.answered, len(step.questions)) == (False, 0, 1)
+    session_id = uuid.UUID(step.session_id)
+
+    served = set()
+    while not step.finished:
+        served.update(q.id for q in step.questions)
+        answers = answer_adaptive_questions(db, step, know_levels={"A1", "A2", "B1"})
+        step = english_test_module.submit_adaptive_answers(user_id, session_id, answers, db)
+        assert step.answered == len(served)
+        assert served.isdisjoint(q.id for q in step.questions)
+
+    assert step.answered < 30
+    assert step.questions == []
+    assert step.diagnosed_level in ("B1", "B2")
+    assert db.get(User, user_id).english_level.value == step.diagnosed_level
+    assert db.get(EnglishTestSession, session_id).completed
+    assert get_progress_summary(db, user_id)["last_diagnosed_level"] == step.diagnosed_level
+    #пересборка берёт уровень из сессии, а не из diagnose_level по ответам адаптивного теста
+    db.expire_all()
+    assert db.get(EnglishTestSession, session_id).diagnosed_level.value == step.diagnosed_level
+    [rebuilt] = build_progress_summaries(db, [user_id])
+    assert rebuilt["last_diagnosed_level"].value == step.diagnosed_level
+
+    with pytest.raises(HTTPException) as exc:
+        english_test_module.submit_adaptive_answers(user_id, session_id, [], db)
+    assert exc.value.status_code == 400
+    with pytest.raises(HTTPException) as exc:
+        english_test_module.submit_adaptive_answers(uuid.uuid4(), session_id, [], db)
+    assert exc.value.status_code == 404
+
+@pytest.mark.parametrize("sampler_name", ["bank", "random"])
+def test_question_samplers_return_distinct_ids_of_level(db, sampler_name):
+    sampler = get_question_sampler(sampler_name)
+    ids = sampler.sample_ids(db, "B1", 3)
+    assert 0 < len(ids) <= 3
+    assert len(set(ids)) == len(ids)
+    levels = {q.level for q in db.query(Question).filter(Question.id.in_(ids))}
+    assert levels == {EnglishLevel.B1}
+
+    level_ids = [qid for (qid,) in db.query(Question.id).filter_by(level=EnglishLevel.B1)]
+    assert set(sampler.sample_ids(db, "B1", 1, exclude=level_ids[1:])) == {level_ids[0]}
+    #неисключённых не хватает — выборка добирается исключёнными
+    filled = sampler.sample_ids(db, "B1", 2, exclude=level_ids[1:])
+    assert level_ids[0] in filled and len(set(filled)) == 2
+
+def test_question_sampler_is_abstract():
+    with pytest.raises(TypeError):
+        QuestionSampler()
+
+def test_unknown_question_sampler():
+    with pytest.raises(ValueError):
+        get_question_sampler("tablesample")
+
+def test_submit_answer_bulk_grades_all_types_with_bounded_queries(db, test_user):
+    session = EnglishTestSession(id=uuid.uuid4(), user_id=test_user.id, level=EnglishLevel.unknown, score=0, completed=False)
+    db.add(session)
+    db.commit()
+
+    answers = []
+    expected = {}
+    for q in db.query(Question).filter_by(type=QuestionType.multiple_choice).limit(10).all():
+        correct = db.query(Option).filter_by(question_id=q.id, is_correct=True).first()
+        answers.append({"session_id": session.id, "question_id": q.id, "selected_option_id": correct.id})
+        expected[q.id] = True
+    for q in db.query(Question).filter_by(type=QuestionType.open_text).limit(5).all():
+        answers.append({"session_id": session.id, "question_id": q.id, "answer_text": "definitely wrong"})
+        expected[q.id] = False
+    for q in db.query(Question).filter_by(type=QuestionType.drag_and_drop).limit(5).all():
+        drag_items = db.query(DragItem).filter_by(question_id=q.id).all()
+        answers.append({
+            "session_id": session.id,
+            "question_id": q.id,
+            "match_pairs": {item.id.hex: item.target_key for item in drag_items}
+        })
+        expected[q.id] = True
+
+    payload = SubmitAnswersRequest(answers=answers)
+    get_question_bank(db)
+    with count_queries() as statements:
+        submit_answer(payload.answers, db)
+    # ключи ответов берутся из банка: проверка сессии и один INSERT ... ON CONFLICT
+    assert len(statements) == 2
+
+    saved = db.query(UserAnswer).filter_by(session_id=session.id).all()
+    assert {a.question_id: a.is_correct for a in saved} == expected
+    assert all(a.match_pairs is None for a in saved if a.question_id in expected and a.selected_option_id)
+
+def open_text_answer(session_id, question, correct):
+    return {"session_id": session_id, "question_id": question.id, "answer_text": question.correct_answer if correct else "definitely wrong"}
+
+def test_submit_answer_upserts_and_accepts_only_form_questions(db, test_user):
+    result = generate_diagnostic_test(test_user.id, db)
+    session_id = uuid.UUID(result.session_id)
+    session = db.get(EnglishTestSession, session_id)
+    assert session.question_ids == [q.id for q in result.questions]
+
+    question = next(db.get(Question, q.id) for q in result.questions if q.type == "open_text")
+    submit_answer(SubmitAnswersRequest(answers=[open_text_answer(session_id, question, False)]).answers, db)
+    #повтор с исправленным ответом и дубль внутри запроса — остаётся одна строка, последний ответ
+    retry = [open_text_answer(session_id, question, False), open_text_answer(session_id, question, True)]
+    submit_answer(SubmitAnswersRequest(answers=retry).answers, db)
+    saved = db.query(UserAnswer).filter_by(session_id=session_id).all()
+    assert [(a.question_id, a.is_correct) for a in saved] == [(question.id, True)]
+
+    outside = db.query(Question).filter(Question.id.not_in(session.question_ids)).first()
+    for answers, status_code in (
+        ([open_text_answer(session_id, outside, True)], 400),
+        ([open_text_answer(uuid.uuid4(), question, True)], 404),
+    ):
+        with pytest.raises(HTTPException) as exc:
+            submit_answer(SubmitAnswersRequest(answers=answers).answers, db)
+        assert exc.value.status_code == status_code
+        db.rollback()
+
+    submit_diagnostic(session_id, db)
+    with pytest.raises(HTTPException) as exc:
+        submit_answer(SubmitAnswersRequest(answers=[open_text_answer(session_id, question, False)]).answers, db)
+    assert exc.value.status_code == 400
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+def test_submit_answers_idempotency_key_replays_response(db, test_user, monkeypatch):
+    monkeypatch.setattr(auth_module, "redis_client", FakeRedis())
+    calls = []
+    original_submit_answer = english_test_module.submit_answer
+    monkeypatch.setattr(english_test_module, "submit_answer", lambda answers, s: calls.append(answers) or original_submit_answer(answers, s))
+
+    session = EnglishTestSession(id=uuid.uuid4(), user_id=test_user.id, level=EnglishLevel.unknown, score=0, completed=False)
+    db.add(session)
+    db.commit()
+    question = db.query(Question).filter_by(type=QuestionType.open_text).first()
+    body = {"answers": [json.loads(json.dumps(open_text_answer(session.id, question, True), default=str))]}
+
+    client = TestClient(app)
+    first = client.post("/test/submit-answers", json=body, headers={"Idempotency-Key": "retry-1"})
+    second = client.post("/test/submit-answers", json=body, headers={"Idempotency-Key": "retry-1"})
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert len(calls) == 1
+
+    body["answers"][0]["answer_text"] = "changed"
+    assert client.post("/test/submit-answers", json=body, headers={"Idempotency-Key": "retry-1"}).status_code == 422
+    assert client.post("/test/submit-answers", json=body, headers={"Idempotency-Key": "retry-2"}).status_code == 200
+    assert len(calls) == 2
+    assert db.query(UserAnswer).filter_by(session_id=session.id).count() == 1
+
+    #тот же ключ в другой сессии — отдельная операция, а не конфликт с чужим телом запроса
+    other = EnglishTestSession(id=uuid.uuid4(), user_id=test_user.id, level=EnglishLevel.unknown, score=0, completed=False)
+    db.add(other)
+    db.commit()
+    body["answers"][0]["session_id"] = str(other.id)
+    assert client.post("/test/submit-answers", json=body, headers={"Idempotency-Key": "retry-1"}).status_code == 200
+    assert len(calls) == 3
+
+def test_grade_answers_with_compiled_keys():
+    correct_option, wrong_option = uuid.uuid4(), uuid.uuid4()
+    drag_a, drag_b = uuid.uuid4(), uuid.uuid4()
+    mc = QuestionSnapshot(
+        id=uuid.uuid4(), prompt="mc", level=EnglishLevel.A1, category=QuestionCategory.grammar,
+        type=QuestionType.multiple_choice,
+        options=(OptionSnapshot(correct_option, "yes", True), OptionSnapshot(wrong_option, "no", False))
+    )
+    ot = QuestionSnapshot(
+        id=uuid.uuid4(), prompt="ot", level=EnglishLevel.A1, category=QuestionCategory.grammar,
+        type=QuestionType.open_text, correct_answer="  Went "
+    )
+    dd = QuestionSnapshot(
+        id=uuid.uuid4(), prompt="dd", level=EnglishLevel.A1, category=QuestionCategory.grammar,
+        type=QuestionType.drag_and_drop,
+        drag_items=(DragItemSnapshot(drag_a, "a", "1"), DragItemSnapshot(drag_b, "b", "2"))
+    )
+    keys = {q.id: compile_answer_key(q) for q in (mc, ot, dd)}
+    session_id = uuid.uuid4()
+
+    answers = [
+        AnswerPayload(session_id=session_id, question_id=mc.id, selected_option_id=correct_option),
+        AnswerPayload(session_id=session_id, question_id=mc.id, selected_option_id=wrong_option),
+        AnswerPayload(session_id=session_id, question_id=ot.id, answer_text="went"),
+        AnswerPayload(session_id=session_id, question_id=ot.id, answer_text="go"),
+        AnswerPayload(session_id=session_id, question_id=dd.id, match_pairs={drag_a.hex: "1", drag_b.hex: "2"}),
+        AnswerPayload(session_id=session_id, question_id=dd.id, match_pairs={drag_a.hex: "2"}),
+        AnswerPayload(session_id=session_id, question_id=uuid.uuid4(), answer_text="unknown question"),
+    ]
+    graded = grade_answers(keys, answers)
+    assert [is_correct for _, _, is_correct in graded] == [True, False, True, False, True, False]
+
+def test_history_keyset_pagination_one_query_per_page(db, test_user):
+    question = db.query(Question).filter_by(type=QuestionType.multiple_choice).first()
+    option = db.query(Option).filter_by(question_id=question.id, is_correct=True).first()
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    sessions = []
+    for i in range(3):
+        session = EnglishTestSession(user_id=test_user.id, level=EnglishLevel.B1, score=1, completed=True, completed_at=start + timedelta(days=i), question_ids=[question.id] if i else None)
+        db.add(session)
+        db.flush()
+        db.add(UserAnswer(session_id=session.id, question_id=question.id, selected_option_id=option.id, is_correct=True))
+        sessions.append(session)
+    db.add(EnglishTestSession(user_id=test_user.id, level=EnglishLevel.B1, score=0, completed=False))
+    user_id = test_user.id
+    db.commit()
+
+    with count_queries() as statements:
+        first = load_test_history(user_id, db, limit=2)
+    assert len(statements) == 1
+    assert [h["session_id"] for h in first["history"]] == [str(sessions[2].id), str(sessions[1].id)]
+    assert first["history"][0]["answers_total"] == first["history"][0]["answers_correct"] == 1
+    assert first["history"][0]["questions_total"] == 1
+
+    second = load_test_history(test_user.id, db, limit=2, cursor=first["next_cursor"])
+    assert [h["session_id"] for h in second["history"]] == [str(sessions[0].id)]
+    assert second["history"][0]["questions_total"] is None  #сессия без сохранённой формы
+    assert second["next_cursor"] is None
+
+    with pytest.raises(HTTPException) as exc:
+        load_test_history(test_user.id, db, cursor="not-a-cursor")
+    assert exc.value.status_code == 400
+
+def test_history_session_detail_single_query(db, test_user):
+    question = db.query(Question).filter_by(type=QuestionType.multiple_choice).first()
+    options = db.query(Option).filter_by(question_id=question.id).all()
+    correct = next(o for o in options if o.is_correct)
+    wrong = next(o for o in options if not o.is_correct)
+    open_questions = db.query(Question).filter_by(type=QuestionType.open_text).limit(2).all()
+    #форма: open_text, multiple_choice, open_text — ответы записаны в другом порядке
+    form = [open_questions[0].id, question.id, open_questions[1].id]
+    session = EnglishTestSession(user_id=test_user.id, level=EnglishLevel.A1, score=0, completed=True, completed_at=datetime.now(timezone.utc), question_ids=form)
+    db.add(session)
+    db.flush()
+    db.add(UserAnswer(session_id=session.id, question_id=question.id, selected_option_id=wrong.id, is_correct=False))
+    for q in reversed(open_questions):
+        db.add(UserAnswer(session_id=session.id, question_id=q.id, answer_text="x", is_correct=True))
+    user_id, session_id = test_user.id, session.id
+    db.commit()
+
+    with count_queries() as statements:
+        detail = load_test_session_detail(user_id, session_id, db)
+    assert len(statements) == 1
+    assert (detail["answers_total"], detail["answers_correct"], detail["questions_total"]) == (3, 2, 3)
+    assert [q["question_text"] for q in detail["questions"]] == [open_questions[0].prompt, question.prompt, open_questions[1].prompt]
+    assert detail["questions"][1] == {
+        "question_text": question.prompt,
+        "user_answer": wrong.text,
+        "correct_answer": correct.text,
+        "is_correct": False,
+    }
+
+    with pytest.raises(HTTPException) as exc:
+        load_test_session_detail(uuid.uuid4(), session_id, db)
+    assert exc.value.status_code == 404
+
+def test_rebuild_progress_summaries_waits_for_concurrent_completion(db, test_user):
+    question = db.query(Question).filter_by(type=QuestionType.open_text).first()
+    finished = EnglishTestSession(user_id=test_user.id, level=EnglishLevel.B1, score=0, completed=True)
+    session = EnglishTestSession(user_id=test_user.id, level=EnglishLevel.B1, score=1, completed=False)
+    db.add_all([finished, session])
+    db.flush()
+    db.add(UserAnswer(session_id=session.id, question_id=question.id, answer_text="x", is_correct=True))
+    record_completed_session(db, finished)  #строка сводки уже есть
+    user_id, session_id = test_user.id, session.id
+    db.commit()
+
+    #завершение теста держит строку сводки, пока идёт пересборка
+    completing = SessionLocal()
+    completed = completing.get(EnglishTestSession, session_id)
+    completed.completed = True
+    completing.flush()
+    record_completed_session(completing, completed)
+    completing.flush()
+
+    def _rebuild():
+        with SessionLocal() as rebuild_db:
+            rebuild_progress_summaries(rebuild_db)
+
+    rebuild = threading.Thread(target=_rebuild)
+    rebuild.start()
+    time.sleep(0.3)
+    completing.commit()
+    completing.close()
+    rebuild.join(timeout=30)
+
+    db.expire_all()
+    assert get_progress_summary(db, user_id)["tests_taken"] == 2
+
+def test_progress_summary_incremental_matches_rebuild(db, test_user):
+    questions = db.query(Question).filter_by(type=QuestionType.open_text).limit(3).all()
+    user_id = test_user.id
+
+    def completed_session(level, correct_flags):
+        session = EnglishTestSession(user_id=user_id, level=level, score=0, completed=False)
+        db.add(session)
+        db.flush()
+        for question, is_correct in zip(questions, correct_flags):
+            db.add(UserAnswer(session_id=session.id, question_id=question.id, answer_text="x", is_correct=is_correct))
+        db.commit()
+        return session.id
+
+    diagnostic_id = completed_session(EnglishLevel.unknown, [True, False, True])
+    diagnosed = submit_diagnostic(diagnostic_id, db).diagnosed_level
+    completed_at = db.get(EnglishTestSession, diagnostic_id).completed_at
+    submit_diagnostic(diagnostic_id, db)  # повторная отправка не учитывается дважды
+    db.expire_all()
+    assert db.get(EnglishTestSession, diagnostic_id).completed_at == completed_at
+    evaluate_upgrade_test(completed_session(EnglishLevel.B1, [True, True, False]), db)
+
+    summary = get_progress_summary(db, user_id)
+    assert summary["tests_taken"] == 2
+    assert summary["last_diagnosed_level"] == diagnosed
+    assert summary["best_scores"] == {"B1": 2}
+    assert sum(stats["total"] for stats in summary["category_accuracy"].values()) == 6
+    assert sum(stats["correct"] for stats in summary["category_accuracy"].values()) == 4
+
+    [rebuilt] = build_progress_summaries(db, [user_id])
+    assert rebuilt["tests_taken"] == summary["tests_taken"]
+    assert rebuilt["best_scores"] == summary["best_scores"]
+    assert rebuilt["last_diagnosed_level"].value == summary["last_diagnosed_level"]
+    assert rebuilt["category_stats"] == {
+        category: {"correct": stats["correct"], "total": stats["total"]}
+        for category, stats in summary["category_accuracy"].items()
+    }
@@ -0,0 +1,58 @@
+import numpy as np
+
+from backend.app.irt import (
+    LEVEL_DIFFICULTY,
+    ItemPool,
+    estimate_ability,
+    item_information,
+    probability,
+    select_items,
+    theta_to_level,
+)
+
+
+def test_estimate_ability_recovers_simulated_theta():
+    rng = np.random.default_rng(0)
+    b = rng.uniform(-3, 3, 400)
+    a = rng.uniform(0.8, 2.0, 400)
+    for true_theta in (-1.5, 0.0, 1.2):
+        correct = rng.random(400) < probability(true_theta, a, b)
+        estimate = estimate_ability(a, b, correct)
+        assert abs(estimate.theta - true_theta) < 3 * estimate.standard_error
+        assert estimate.standard_error < 0.15
+
+
+def test_estimate_ability_without_answers_is_prior():
+    estimate = estimate_ability(np.empty(0), np.empty(0), np.empty(0, dtype=bool))
+    assert abs(estimate.theta) < 1e-9
+    assert abs(estimate.standard_error - 1.0) < 0.01
+
+
+def test_standard_error_shrinks_with_answers():
+    a, b = np.ones(20), np.zeros(20)
+    correct = np.arange(20) % 2 == 0
+    errors = [estimate_ability(a[:n], b[:n], correct[:n]).standard_error for n in (2, 10, 20)]
+    assert errors == sorted(errors, reverse=True)
+
+
+def test_select_items_prefers_information_and_skips_excluded():
+    b = np.array([-2.0, 0.1, 0.0, 2.0])
+    a = np.ones(4)
+    assert item_information(0.0, a, b).argmax() == 2
+    assert list(select_items(0.0, a, b, np.array([False, False, False, False]), k=2)) == [2, 1]
+    assert list(select_items(0.0, a, b, np.array([False, False, True, False]), k=1)) == [1]
+    assert len(select_items(0.0, a, b, np.ones(4, dtype=bool), k=1)) == 0
+
+    rng = np.random.default_rng(0)
+    picks = {int(select_items(0.0, a, b, np.zeros(4, dtype=bool), k=1, randomesque=2, rng=rng)[0]) for _ in range(50)}
+    assert picks == {1, 2}
+
+
+def test_theta_to_level_matches_initial_difficulty():
+    assert [theta_to_level(value) for value in LEVEL_DIFFICULTY.values()] == list(LEVEL_DIFFICULTY)
+
+
+def test_item_pool_estimate_ignores_unknown_questions():
+    pool = ItemPool(["q1", "q2"], [1.0, 1.0], [0.0, 1.0])
+    assert pool.mask(["q2", "missing"]).tolist() == [False, True]
+    assert pool.estimate({"q1": True, "missing": False}) == estimate_ability(np.array([1.0]), np.array([0.0]), np.array([True]))
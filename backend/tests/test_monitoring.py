@@ -0,0 +1,100 @@
+import uuid
+from unittest.mock import MagicMock
+
+from fastapi.testclient import TestClient
+
+import backend.app.auth as auth_module
+import backend.app.monitoring as monitoring_module
+from backend.app.main import app
+from backend.database.database import SessionLocal
+from backend.database.pool_stats import POOL_STATS, PoolStats
+from sqlalchemy import text
+
+client = TestClient(app)
+
+
+def test_pool_stats_histogram_is_cumulative():
+    stats = PoolStats(buckets=(0.01, 0.1))
+    for seconds in (0.005, 0.05, 0.05, 3.0):
+        stats.observe_checkout(seconds)
+    stats.observe_timeout()
+
+    snapshot = stats.snapshot()
+    assert snapshot["checkouts"] == 4
+    assert snapshot["timeouts"] == 1
+    assert snapshot["wait_seconds_max"] == 3.0
+    assert snapshot["checkout_latency_histogram"] == {"0.01": 1, "0.1": 3, "+Inf": 4}
+
+
+def test_pool_stats_endpoint_reports_checkouts():
+    before = POOL_STATS["sync"].snapshot()["checkouts"]
+    db = SessionLocal()
+    try:
+        db.execute(text("SELECT 1"))
+        response = client.get("/pool-stats")
+    finally:
+        db.close()
+
+    assert response.status_code == 200
+    sync = response.json()["sync"]
+    assert sync["checkouts"] > before
+    assert sync["checked_out"] >= 1
+    assert set(sync) >= {"size", "checked_in", "overflow", "wait_seconds_total", "checkout_latency_histogram"}
+
+
+def test_health():
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+
+def test_ready_reports_each_dependency(monkeypatch):
+    redis_mock = MagicMock()
+    monkeypatch.setattr(auth_module, "redis_client", redis_mock)
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["checks"] == {"postgres": "ok", "redis": "ok"}
+
+    redis_mock.ping.side_effect = ConnectionError("redis down")
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["checks"]["redis"].startswith("error")
+
+
+def test_ready_checks_async_engine_when_enabled(monkeypatch):
+    checked = []
+
+    class FakeConnection:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def execute(self, statement):
+            checked.append(str(statement))
+
+    monkeypatch.setattr(monitoring_module, "async_engine", MagicMock(**{"connect.return_value": FakeConnection()}))
+    monkeypatch.setattr(monitoring_module, "engine", None)  #синхронный движок не трогается
+    monkeypatch.setattr(auth_module, "redis_client", MagicMock())
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert checked == ["SELECT 1"]
+
+def test_metrics_are_labeled_by_route_template():
+    client.get("/pool-stats")
+    client.post(f"/test/submit-upgrade-test/{uuid.uuid4()}")
+    client.get(f"/media/avatars/{uuid.uuid4()}.png")
+    client.post("/test/adaptive-diagnostic/answers/answers", json={"answers": []})  #значение параметра совпадает с литеральным сегментом
+    client.get("/no-such-route")
+
+    body = client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/pool-stats",status="200"}' in body
+    assert 'route="/test/submit-upgrade-test/{session_id}"' in body
+    assert 'http_request_db_queries_count{route="/test/submit-upgrade-test/{session_id}"}' in body
+    assert 'route="/media/{path}"' in body
+    assert 'route="/test/adaptive-diagnostic/{session_id}/answers"' in body
+    assert 'route="/test/adaptive-diagnostic/answers/{session_id}"' not in body
+    assert 'route="unmatched"' in body
+    assert "db_pool_checked_out" in body
+    assert 'db_pool_checkout_seconds_bucket{le="+Inf",pool="sync"}' in body
@@ -0,0 +1,111 @@
+import re
+import uuid
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+import backend.app.prepared_tests as prepared_tests_module
+from backend.app.english_test import (
+    evaluate_upgrade_test,
+    generate_diagnostic_test,
+    generate_level_progression_test,
+    generate_upgrade_test,
+    submit_answer,
+    submit_diagnostic,
+)
+from backend.app.english_test_schemas import AnswerPayload
+from backend.app.models import EnglishLevel, Option, Question, QuestionType, User
+from backend.app.profile import load_test_history, load_test_session_detail
+from backend.app.progress import get_progress_summary
+from backend.app.question_bank import invalidate_question_bank, load_questions
+from backend.app.question_sampler import get_question_sampler
+from backend.database.database import SessionLocal, engine
+
+
+@contextmanager
+def capture_statements():
+    statements = []
+
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+
+
+def seq_scans(statement: str, parameters) -> list[str]:
+    """
+    Seq Scan в плане запроса при запрещённом seq scan: на маленьких seed-данных планировщик
+    иначе всегда выбирает полный проход, а так Seq Scan остаётся только там, где нет подходящего индекса
+    """
+    with engine.connect() as conn:
+        with conn.begin() as transaction:
+            conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            plan = [row[0] for row in conn.exec_driver_sql("EXPLAIN " + statement, parameters)]
+            transaction.rollback()
+    return [line.strip() for line in plan if "Seq Scan" in line]
+
+
+def run_hot_paths(db, monkeypatch):
+    """
+    Сценарий пользователя по путям запросов english_test.py и profile.py
+    """
+    monkeypatch.setattr(prepared_tests_module, "get_question_sampler", lambda: get_question_sampler("random"))
+    user = User(username=f"user_{uuid.uuid4().hex[:6]}", hashed_password="test_password", english_level=EnglishLevel.unknown)
+    db.add(user)
+    db.commit()
+    user_id = user.id
+
+    diagnostic = generate_diagnostic_test(user_id, db)
+    answers = []
+    for q in diagnostic.questions:
+        if q.type == QuestionType.multiple_choice.value and q.options:
+            answers.append(AnswerPayload(session_id=diagnostic.session_id, question_id=q.id, selected_option_id=q.options[0].id))
+        else:
+            answers.append(AnswerPayload(session_id=diagnostic.session_id, question_id=q.id, answer_text="x"))
+    submit_answer(answers, db)
+    submit_diagnostic(uuid.UUID(diagnostic.session_id), db)
+
+    db.get(User, user_id).english_level = EnglishLevel.B1
+    db.commit()
+    generate_level_progression_test(user_id, db)
+    upgrade = generate_upgrade_test(user_id, db)
+    submit_answer([AnswerPayload(session_id=upgrade.session_id, question_id=q.id, answer_text="x") for q in upgrade.questions], db)
+    evaluate_upgrade_test(uuid.UUID(upgrade.session_id), db)
+
+    load_questions(db, [q.id for q in diagnostic.questions])
+    history = load_test_history(user_id, db, limit=1)
+    load_test_history(user_id, db, limit=1, cursor=history["next_cursor"])
+    load_test_session_detail(user_id, uuid.UUID(diagnostic.session_id), db)
+    get_progress_summary(db, user_id)
+
+
+def test_hot_queries_use_indexes(monkeypatch):
+    db = SessionLocal()
+    try:
+        if not db.query(Question).first() or not db.query(Option).first():
+            pytest.skip("нужны seed-данные: python backend/tests/seed_questions.py")
+        invalidate_question_bank()
+        with capture_statements() as statements:
+            run_hot_paths(db, monkeypatch)
+    finally:
+        db.close()
+
+    checked = 0
+    offenders = {}
+    for statement, parameters in statements:
+        #без WHERE — намеренные полные выборки (загрузка банка вопросов целиком), INSERT планов чтения не имеет
+        if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")) or not re.search(r"\bWHERE\b", statement):
+            continue
+        checked += 1
+        scans = seq_scans(statement, parameters)
+        if scans:
+            offenders[statement] = scans
+
+    assert checked > 10
+    assert offenders == {}
@@ -0,0 +1,31 @@
+"""
+Калибровка трудности и дискриминативности вопросов (модель 2PL) по ответам завершённых тестов.
+
+Инкрементальная: обрабатываются только тесты, завершённые после прошлого запуска
+(item_calibration_runs.watermark), прежние ответы учтены в текущих параметрах. Ответы
+читаются серверным курсором кусками по --chunk-size строк один раз во временные файлы, память
+не зависит от размера user_answers. Каждая итерация EM — отдельный проход по этим файлам, поэтому
+запускать по расписанию (например, раз в сутки), а не после каждого теста.
+
+    python -m backend.utils.calibrate_items [--chunk-size 50000] [--max-iterations 100] [--tolerance 0.001]
+"""
+import argparse
+
+from backend.app.calibration import CHUNK_SIZE, MAX_ITERATIONS, TOLERANCE, calibrate_items
+from backend.database.database import SessionLocal
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--max-iterations", type=int, default=MAX_ITERATIONS)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        run, report = calibrate_items(db, args.chunk_size, args.max_iterations, args.tolerance)
+        status = "сошлась" if run.converged else "не сошлась"
+        print(f"✅ Тестов: {run.sessions}, ответов: {run.answers}, обновлено вопросов: {run.items_updated}")
+        print(f"   EM {status} за {run.iterations} итераций, max Δ = {run.max_change or 0:.2e}, log L = {run.log_likelihood or 0:.1f}")
+        print(f"   {run.duration_seconds:.1f} с: чтение и E-шаг {report.e_step_seconds:.1f} с, M-шаг {report.m_step_seconds:.2f} с, "
+              f"watermark {run.watermark:%Y-%m-%d %H:%M:%S}")
@@ -0,0 +1,27 @@
+"""
+Удаление файлов аватаров, на которые больше не ссылается ни один пользователь.
+
+Загрузка нового аватара сохраняет варианты под новыми именами (хеш содержимого),
+а прежние файлы остаются на диске — их и подбирает этот скрипт. Файлы моложе
+--grace-hours не удаляются, чтобы не задеть загрузку, ещё не записавшую avatar_url.
+
+    python -m backend.utils.collect_orphan_avatars [--grace-hours 1] [--dry-run]
+"""
+import argparse
+
+from backend.app.avatars import AVATAR_DIR, collect_orphan_avatars
+from backend.database.database import SessionLocal
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--directory", default=AVATAR_DIR)
+    parser.add_argument("--grace-hours", type=float, default=1)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        removed = collect_orphan_avatars(db, args.directory, args.grace_hours * 3600, args.dry_run)
+    for name in removed:
+        print(name)
+    print(f"{'Будет удалено' if args.dry_run else '✅ Удалено'} файлов: {len(removed)}")
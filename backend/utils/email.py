@@ -1,17 +1,265 @@
+import heapq
+import itertools
+import logging
 import smtplib
+import threading
+import time
+from dataclasses import dataclass
+from email.message import Message
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from backend.database.config import SMTP_PASSWORD,SMTP_PORT,SMTP_SERVER,SMTP_USER
+from typing import Optional
 
-def send_email(to_email: str, subject: str, body: str):
+from backend.database.config import (
+    EMAIL_BATCH_SIZE,
+    EMAIL_MAX_RETRIES,
+    EMAIL_QUEUE_SIZE,
+    EMAIL_RETRY_BACKOFF,
+    EMAIL_WORKERS,
+    SMTP_IDLE_TIMEOUT,
+    SMTP_PASSWORD,
+    SMTP_PORT,
+    SMTP_SERVER,
+    SMTP_STARTTLS,
+    SMTP_TIMEOUT,
+    SMTP_USER,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def build_message(to_email: str, subject: str, body: str) -> Message:
     msg = MIMEMultipart()
     msg["From"] = SMTP_USER
     msg["To"] = to_email
     msg["Subject"] = subject
 
     msg.attach(MIMEText(body, "plain"))
+    return msg
+
+
+def open_smtp_connection() -> smtplib.SMTP:
+    """
+    Новое SMTP-соединение: STARTTLS и логин, если они настроены
+    """
+    server = smtplib.SMTP(SMTP_SERVER, int(SMTP_PORT or 587), timeout=SMTP_TIMEOUT)
+    try:
+        if SMTP_STARTTLS:
+            server.starttls()
+        if SMTP_USER and SMTP_PASSWORD:
+            server.login(SMTP_USER, SMTP_PASSWORD)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def send_email(to_email: str, subject: str, body: str):
+    """
+    Синхронная отправка через отдельное соединение — для скриптов. Из обработчиков запросов
+    письма ставятся в очередь: email_queue.enqueue
+    """
+    with open_smtp_connection() as server:
+        server.send_message(build_message(to_email, subject, body))
+
+
+class EmailQueueFull(Exception):
+    """
+    Очередь исходящих писем заполнена
+    """
+
+
+@dataclass
+class OutgoingEmail:
+    message: Message
+    attempts: int = 0
+
+
+def _is_permanent_failure(error: Exception) -> bool:
+    """
+    5xx и отказ всех получателей повторять бесполезно, сетевые ошибки и 4xx — временные
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+class EmailQueue:
+    """
+    Очередь исходящих писем. Фоновые потоки держат по постоянному авторизованному
+    SMTP-соединению, забирают письма пачками до batch_size и отправляют их через одно
+    соединение. Временные ошибки повторяются с экспоненциальной задержкой
+    (retry_backoff * 2^попытка), после max_retries письмо отбрасывается с записью в лог.
+    Соединение, простаивающее idle_timeout секунд, закрывается
+    """
+
+    def __init__(
+        self,
+        workers: int = EMAIL_WORKERS,
+        batch_size: int = EMAIL_BATCH_SIZE,
+        max_retries: int = EMAIL_MAX_RETRIES,
+        retry_backoff: float = EMAIL_RETRY_BACKOFF,
+        max_size: int = EMAIL_QUEUE_SIZE,
+        idle_timeout: float = SMTP_IDLE_TIMEOUT,
+        connect=open_smtp_connection,
+    ):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.connect = connect
+
+        self.sent = 0
+        self.failed = 0
+        self._heap = []  #(не раньше, порядковый номер, письмо) — новые письма и отложенные повторы
+        self._sequence = itertools.count()
+        self._unfinished = 0
+        self._closed = False
+        self._threads = []
+        self._cond = threading.Condition()
+
+    def enqueue(self, to_email: str, subject: str, body: str) -> None:
+        """
+        Ставит письмо в очередь и сразу возвращает управление. Потоки запускаются при первом вызове
+        """
+        message = build_message(to_email, subject, body)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Очередь писем закрыта")
+            if self._unfinished >= self.max_size:
+                raise EmailQueueFull()
+            self._unfinished += 1
+            heapq.heappush(self._heap, (0.0, next(self._sequence), OutgoingEmail(message)))
+            if not self._threads:
+                self._start_workers()
+            self._cond.notify()
+
+    def _start_workers(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"email-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Ждёт, пока все поставленные письма будут отправлены или отброшены
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._unfinished == 0, timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Дожидается отправки очереди (не дольше timeout) и останавливает потоки.
+        Следующий enqueue запустит их снова. Если какой-то поток не завершился за timeout,
+        очередь остаётся закрытой, пока повторный close не дождётся его
+        """
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        with self._cond:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            if self._threads:
+                #иначе следующий enqueue запустит новые потоки рядом с ещё работающими
+                names = ", ".join(thread.name for thread in self._threads)
+                logger.warning(f"Очередь писем не остановлена, потоки ещё работают: {names}")
+                return
+            self._closed = False
+
+    def _next_batch(self) -> Optional[list[OutgoingEmail]]:
+        """
+        Ждёт готовые к отправке письма. [] — простой дольше idle_timeout, None — очередь закрыта
+        """
+        with self._cond:
+            idle_deadline = time.monotonic() + self.idle_timeout
+            while True:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    batch = []
+                    while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                        batch.append(heapq.heappop(self._heap)[2])
+                    return batch
+                if self._closed and not self._heap:
+                    return None
+                if now >= idle_deadline:
+                    return []
+                wake_at = min(self._heap[0][0], idle_deadline) if self._heap else idle_deadline
+                self._cond.wait(wake_at - now)
+
+    def _finish(self, email: OutgoingEmail, sent: bool) -> None:
+        with self._cond:
+            if sent:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self._unfinished -= 1
+            self._cond.notify_all()
+
+    def _retry_later(self, email: OutgoingEmail, error: Exception, permanent: Optional[bool] = None) -> None:
+        email.attempts += 1
+        if permanent is None:
+            permanent = _is_permanent_failure(error)
+        if permanent or email.attempts > self.max_retries:
+            logger.error(f"Письмо для {email.message['To']} не отправлено после {email.attempts} попыток: {error!r}")
+            self._finish(email, sent=False)
+            return
+        delay = self.retry_backoff * 2 ** (email.attempts - 1)
+        logger.warning(f"Ошибка отправки письма для {email.message['To']}, повтор через {delay:.1f} с: {error!r}")
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), email))
+            self._cond.notify()
+
+    @staticmethod
+    def _close_connection(connection: Optional[smtplib.SMTP]) -> None:
+        if connection is None:
+            return
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    def _worker(self) -> None:
+        connection = None
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                self._close_connection(connection)
+                connection = None
+                if batch is None:
+                    return
+                continue
+
+            for email in batch:
+                try:
+                    if connection is None:
+                        connection = self.connect()
+                except Exception as e:
+                    #ошибка подключения или логина не связана с письмом — всегда временная
+                    self._retry_later(email, e, permanent=False)
+                    continue
+                try:
+                    try:
+                        connection.send_message(email.message)
+                    except smtplib.SMTPServerDisconnected:
+                        #сервер закрыл простаивавшее соединение — переподключаемся один раз без задержки
+                        connection.close()
+                        connection = None
+                        connection = self.connect()
+                        connection.send_message(email.message)
+                except Exception as e:
+                    #после отказа сервера smtplib делает RSET и соединение пригодно, после сетевой ошибки — нет
+                    if not isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+                        self._close_connection(connection)
+                        connection = None
+                    self._retry_later(email, e)
+                else:
+                    self._finish(email, sent=True)
+
 
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASSWORD)
-        server.send_message(msg)
\ No newline at end of file
+email_queue = EmailQueue()
@@ -1,10 +1,10 @@
 import random
-from backend.utils.email import send_email  
+from backend.utils.email import email_queue
 
 def generate_verification_code(length: int = 6) -> str:
     return ''.join(str(random.randint(0, 9)) for _ in range(length))
 
-def send_verification_code(email: str, code: str):
+def send_verification_code(email: str, code: str):  #ставит письмо в очередь, не дожидаясь SMTP
     subject = "Подтверждение email"
     body = f"Ваш код подтверждения: {code}"
-    send_email(to_email=email, subject=subject, body=body)
\ No newline at end of file
+    email_queue.enqueue(to_email=email, subject=subject, body=body)
\ No newline at end of file
@@ -0,0 +1,28 @@
+"""
+Перенос старого глобального множества token_blacklist на ключи revoked_token:<id> с TTL.
+
+Ещё действующие токены отзываются заново через revoke_token (для токенов без jti
+ключом служит sha256 токена), истёкшие и невалидные просто отбрасываются,
+после чего множество удаляется. Скрипт идемпотентен, запускать после деплоя:
+
+    python -m backend.utils.migrate_token_blacklist
+"""
+import backend.app.auth as auth_module
+
+
+def migrate_token_blacklist(batch_size: int = 1000) -> dict:
+    redis_client = auth_module.redis_client
+    migrated = dropped = 0
+    for raw_token in redis_client.sscan_iter(auth_module.LEGACY_BLACKLIST_KEY, count=batch_size):
+        token = raw_token.decode() if isinstance(raw_token, bytes) else raw_token
+        if auth_module.revoke_token(token):
+            migrated += 1
+        else:
+            dropped += 1
+    redis_client.delete(auth_module.LEGACY_BLACKLIST_KEY)
+    return {"migrated": migrated, "dropped": dropped}
+
+
+if __name__ == "__main__":
+    result = migrate_token_blacklist()
+    print(f"✅ Перенесено токенов: {result['migrated']}, отброшено истёкших/невалидных: {result['dropped']}")
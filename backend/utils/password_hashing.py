@@ -0,0 +1,94 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+from backend.database.config import BCRYPT_ROUNDS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_WORKERS, WEB_CONCURRENCY
+
+
+#min/max_rounds равны текущей стоимости: needs_update срабатывает для хэшей с любой другой
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Очередь хэширования заполнена — клиенту нужно повторить запрос позже
+    """
+
+
+class PasswordHasher:
+    """
+    Пул процессов для bcrypt с ограниченной очередью. Хэширование не держит GIL
+    и слоты пула потоков приложения; при заполненной очереди задача не ставится,
+    а сразу выбрасывается PasswordHasherBusy.
+    Пул свой в каждом процессе uvicorn: по умолчанию ядра делятся между web_concurrency процессами
+    """
+
+    def __init__(self, workers: int = 0, max_pending: int = 0, web_concurrency: int = 1):
+        self.workers = workers or max(1, (os.cpu_count() or 1) // max(1, web_concurrency))
+        self.max_pending = max_pending or self.workers * 8
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                #spawn: дочерние процессы не наследуют соединения с БД и потоки приложения
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    async def run(self, fn, *args):
+        executor = self._get_executor()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PasswordHasherBusy()
+            self._pending += 1
+        try:
+            return await asyncio.wrap_future(executor.submit(fn, *args))
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    def needs_update(self, hashed_password: str) -> bool:
+        """
+        Хэш сделан с другой стоимостью или устаревшей схемой. Проверка дешёвая — без bcrypt
+        """
+        return pwd_context.needs_update(hashed_password)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, WEB_CONCURRENCY)
@@ -0,0 +1,26 @@
+"""
+Полная пересборка таблицы user_progress_summaries по test_sessions и user_answers.
+
+Нужна после миграции, добавившей таблицу, и если сводки разошлись с данными
+(ручные правки в базе, восстановление из бэкапа). Пользователи обрабатываются
+батчами, каждый батч — отдельная транзакция; строки сводок батча блокируются так же,
+как при завершении теста, поэтому пересборку можно запускать под нагрузкой.
+
+    python -m backend.utils.rebuild_progress_summaries [--batch-size 1000]
+"""
+import argparse
+import time
+
+from backend.app.progress import rebuild_progress_summaries
+from backend.database.database import SessionLocal
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with SessionLocal() as db:
+        written = rebuild_progress_summaries(db, args.batch_size)
+    print(f"✅ Пересобрано сводок: {written} за {time.perf_counter() - start:.1f} с")
@@ -0,0 +1,48 @@
+"""item calibration runs
+
+Revision ID: a7d5c9e1f3b4
+Revises: f6c4b8d0e2a3
+Create Date: 2025-08-26 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d5c9e1f3b4'
+down_revision: Union[str, Sequence[str], None] = 'f6c4b8d0e2a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('questions', sa.Column('calibration_answers', sa.Integer(), server_default='0', nullable=False))
+    op.create_table('item_calibration_runs',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('started_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('watermark', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('sessions', sa.Integer(), nullable=False),
+    sa.Column('answers', sa.Integer(), nullable=False),
+    sa.Column('items_updated', sa.Integer(), nullable=False),
+    sa.Column('iterations', sa.Integer(), nullable=False),
+    sa.Column('converged', sa.Boolean(), nullable=False),
+    sa.Column('max_change', sa.Float(), nullable=True),
+    sa.Column('log_likelihood', sa.Float(), nullable=True),
+    sa.Column('duration_seconds', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_item_calibration_runs_watermark'), 'item_calibration_runs', ['watermark'], unique=False)
+    op.create_index('ix_test_sessions_completed_at', 'test_sessions', ['completed_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_test_sessions_completed_at', table_name='test_sessions')
+    op.drop_index(op.f('ix_item_calibration_runs_watermark'), table_name='item_calibration_runs')
+    op.drop_table('item_calibration_runs')
+    op.drop_column('questions', 'calibration_answers')
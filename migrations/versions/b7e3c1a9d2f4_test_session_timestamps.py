@@ -0,0 +1,34 @@
+"""test session timestamps
+
+Revision ID: b7e3c1a9d2f4
+Revises: 5fec0b39d1e2
+Create Date: 2025-08-12 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3c1a9d2f4'
+down_revision: Union[str, Sequence[str], None] = '5fec0b39d1e2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('test_sessions', sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+    op.add_column('test_sessions', sa.Column('completed_at', sa.DateTime(timezone=True), nullable=True))
+    # завершённые до миграции сессии получают метку времени миграции, чтобы попасть в историю
+    op.execute("UPDATE test_sessions SET completed_at = created_at WHERE completed")
+    op.create_index('ix_test_sessions_user_completed_at', 'test_sessions', ['user_id', 'completed_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_test_sessions_user_completed_at', table_name='test_sessions')
+    op.drop_column('test_sessions', 'completed_at')
+    op.drop_column('test_sessions', 'created_at')
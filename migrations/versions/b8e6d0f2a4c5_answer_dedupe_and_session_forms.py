@@ -0,0 +1,63 @@
+"""answer dedupe and session forms
+
+Revision ID: b8e6d0f2a4c5
+Revises: a7d5c9e1f3b4
+Create Date: 2025-08-29 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e6d0f2a4c5'
+down_revision: Union[str, Sequence[str], None] = 'a7d5c9e1f3b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NULL — сессии, созданные до появления колонки: для них состав формы не проверяется
+    op.add_column('test_sessions', sa.Column('question_ids', postgresql.ARRAY(sa.UUID()), nullable=True))
+
+    # дубли от повторных отправок. Времени записи у ответа нет, поэтому из дублей остаётся
+    # правильный ответ, при равенстве — с заполненными данными ответа; среди полностью равных — любой
+    # во временную таблицу попадают только удаляемые строки, а не весь user_answers
+    op.execute(
+        "CREATE TEMPORARY TABLE duplicate_answers ON COMMIT DROP AS "
+        "SELECT row_ctid, session_id FROM ("
+        "SELECT ctid AS row_ctid, session_id, row_number() OVER ("
+        "PARTITION BY session_id, question_id ORDER BY is_correct DESC, "
+        "(selected_option_id IS NOT NULL OR answer_text IS NOT NULL OR match_pairs IS NOT NULL) DESC, ctid"
+        ") AS rank FROM user_answers"
+        ") ranked WHERE rank > 1"
+    )
+    op.execute("DELETE FROM user_answers WHERE ctid IN (SELECT row_ctid FROM duplicate_answers)")
+    # score завершённых сессий считал дубли: пересчитывается по оставшимся ответам.
+    # Сводки прогресса после миграции — python -m backend.utils.rebuild_progress_summaries
+    op.execute(
+        "UPDATE test_sessions s SET score = ("
+        "SELECT count(*) FILTER (WHERE a.is_correct) FROM user_answers a WHERE a.session_id = s.id"
+        ") WHERE s.completed AND s.id IN (SELECT session_id FROM duplicate_answers)"
+    )
+
+    # уникальный индекс строится без блокировки записи; если построение упало из-за дублей,
+    # записанных после DELETE, — удалить невалидный индекс и запустить миграцию снова
+    with op.get_context().autocommit_block():
+        op.create_index('uq_user_answers_session_question', 'user_answers', ['session_id', 'question_id'], unique=True, postgresql_concurrently=True, if_not_exists=True)
+    op.execute("ALTER TABLE user_answers ADD CONSTRAINT uq_user_answers_session_question UNIQUE USING INDEX uq_user_answers_session_question")
+    # session_id — первая колонка уникального индекса
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_user_answers_session_id', table_name='user_answers', postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index('ix_user_answers_session_id', 'user_answers', ['session_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+    op.drop_constraint('uq_user_answers_session_question', 'user_answers', type_='unique')
+    op.drop_column('test_sessions', 'question_ids')
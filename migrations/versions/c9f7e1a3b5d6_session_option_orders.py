@@ -0,0 +1,28 @@
+"""session option orders
+
+Revision ID: c9f7e1a3b5d6
+Revises: b8e6d0f2a4c5
+Create Date: 2025-09-02 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9f7e1a3b5d6'
+down_revision: Union[str, Sequence[str], None] = 'b8e6d0f2a4c5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('test_sessions', sa.Column('option_orders', sa.LargeBinary(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('test_sessions', 'option_orders')
@@ -0,0 +1,31 @@
+"""session diagnosed level
+
+Revision ID: d0a8e2f4b6c7
+Revises: c9f7e1a3b5d6
+Create Date: 2025-09-05 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd0a8e2f4b6c7'
+down_revision: Union[str, Sequence[str], None] = 'c9f7e1a3b5d6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NULL у диагностик, завершённых до появления колонки: для них пересборка сводок
+    # определяет уровень по ответам, как раньше
+    op.add_column('test_sessions', sa.Column('diagnosed_level', postgresql.ENUM('A1', 'A2', 'B1', 'B2', 'C1', 'C2', 'unknown', name='englishlevel', create_type=False), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('test_sessions', 'diagnosed_level')
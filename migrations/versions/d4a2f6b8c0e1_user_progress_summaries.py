@@ -0,0 +1,40 @@
+"""user progress summaries
+
+Revision ID: d4a2f6b8c0e1
+Revises: b7e3c1a9d2f4
+Create Date: 2025-08-14 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a2f6b8c0e1'
+down_revision: Union[str, Sequence[str], None] = 'b7e3c1a9d2f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # тип englishlevel уже создан вместе с users
+    op.create_table('user_progress_summaries',
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('tests_taken', sa.Integer(), nullable=False),
+    sa.Column('last_diagnosed_level', postgresql.ENUM('A1', 'A2', 'B1', 'B2', 'C1', 'C2', 'unknown', name='englishlevel', create_type=False), nullable=True),
+    sa.Column('best_scores', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('category_stats', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    # заполнить таблицу: python -m backend.utils.rebuild_progress_summaries
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_progress_summaries')
@@ -0,0 +1,45 @@
+"""hot path indexes
+
+Revision ID: e5b3a7c9d1f2
+Revises: d4a2f6b8c0e1
+Create Date: 2025-08-18 09:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b3a7c9d1f2'
+down_revision: Union[str, Sequence[str], None] = 'd4a2f6b8c0e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# test_sessions.user_id уже покрыт ix_test_sessions_user_completed_at (user_id — первая колонка)
+INDEXES = [
+    ('ix_user_answers_session_id', 'user_answers', ['session_id']),
+    ('ix_options_question_id', 'options', ['question_id']),
+    ('ix_drag_items_question_id', 'drag_items', ['question_id']),
+    ('ix_drop_targets_question_id', 'drop_targets', ['question_id']),
+    ('ix_questions_level_type', 'questions', ['level', 'type']),
+    ('ix_level_upgrade_requests_user_target', 'level_upgrade_requests', ['user_id', 'target_level']),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX CONCURRENTLY не блокирует запись, но не может выполняться в транзакции.
+    # Если построение прервалось, останется невалидный индекс — его нужно удалить
+    # (DROP INDEX CONCURRENTLY) и запустить миграцию снова
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,36 @@
+"""question irt parameters
+
+Revision ID: f6c4b8d0e2a3
+Revises: e5b3a7c9d1f2
+Create Date: 2025-08-22 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f6c4b8d0e2a3'
+down_revision: Union[str, Sequence[str], None] = 'e5b3a7c9d1f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# начальная трудность по уровню — как backend.app.irt.LEVEL_DIFFICULTY на момент миграции
+LEVEL_DIFFICULTY = {'A1': -2.5, 'A2': -1.5, 'B1': -0.5, 'B2': 0.5, 'C1': 1.5, 'C2': 2.5}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('questions', sa.Column('difficulty', sa.Float(), server_default='0', nullable=False))
+    op.add_column('questions', sa.Column('discrimination', sa.Float(), server_default='1', nullable=False))
+    cases = ' '.join(f"WHEN '{level}' THEN {value}" for level, value in LEVEL_DIFFICULTY.items())
+    op.execute(f"UPDATE questions SET difficulty = CASE level::text {cases} ELSE 0 END")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('questions', 'discrimination')
+    op.drop_column('questions', 'difficulty')